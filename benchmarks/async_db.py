@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from fastapi import FastAPI, Response
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from benchmarks.datagen import BenchmarkScale, seedLibrary
+from benchmarks.report import compareResults, formatSummary, summarize, writeResults
+from benchmarks.workload import OperationResult
+from migrations.migrate import runMigrations
+from models.db_models import Snip
+from utils.pagination import selectSnipList
+from utils.serialization import dumpSnipList
+
+#p99 latency of concurrent snip list reads with a database session that blocks the event loop (the handlers before
+#the async layer: async def routes calling a sync Session) against the AsyncSession every router uses now. Each mode
+#is served by its own uvicorn worker from the same seeded database, and a slow report query (--slowms) runs alongside
+#the reads every --slowevery seconds, the way one slow query on a shared worker stalls every request behind it. The
+#app is just the /getSnips query, without auth, caches or ETags, so the session is the only difference.
+#Uses BENCH_DATABASE_URL if set (e.g. a local postgres, sync mode connects through psycopg2; the slow query is a real
+#pg_sleep). Otherwise a temporary sqlite file, which answers from local disk without any network wait, so the time a
+#networked database spends away is modelled: --rtt per statement and --slowms for the report, slept blocking in sync
+#mode as a sync driver would and awaited in async mode as asyncpg would. Client and server share the machine, so keep
+#--concurrency below what saturates its CPUs, past that both modes measure only the queue for the CPU.
+#Run with: python -m benchmarks.async_db [--concurrency 8] [--duration 10] [--rtt 1] [--out async_db.json]
+PAGE = 100
+
+def syncUrl(url: str) -> str:
+    parsedUrl = make_url(url)
+    driver = {"postgresql": "postgresql+psycopg2", "sqlite": "sqlite"}[parsedUrl.get_backend_name()]
+    return parsedUrl.set(drivername=driver).render_as_string(hide_password=False)
+
+def asyncUrl(url: str) -> str:
+    parsedUrl = make_url(url)
+    driver = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}[parsedUrl.get_backend_name()]
+    return parsedUrl.set(drivername=driver).render_as_string(hide_password=False)
+
+def snipPage(userId: int):
+    return selectSnipList().where(Snip.userid == userId).order_by(Snip.lastmodified.desc(), Snip.snipid.desc()).limit(PAGE)
+
+#uvicorn --factory entry point, configured through the ASYNC_DB_* variables
+def serverApp() -> FastAPI:
+    app = FastAPI()
+    url = os.environ["ASYNC_DB_URL"]
+    rtt, slow = float(os.environ["ASYNC_DB_RTT"]) / 1000, float(os.environ["ASYNC_DB_SLOW"]) / 1000
+    networked = make_url(url).get_backend_name() != "sqlite"
+    slowQuery = text("SELECT pg_sleep(:seconds)") if networked else text("SELECT 1")
+
+    if (os.environ["ASYNC_DB_MODE"] == "sync"):
+        engine = create_engine(syncUrl(url))
+
+        @app.get("/getSnips/{userId}")
+        async def getSnips(userId: int) -> Response:
+            with Session(engine) as session:
+                time.sleep(rtt)
+                return Response(dumpSnipList(session.exec(snipPage(userId)).all()), media_type="application/json")
+
+        @app.get("/slow")
+        async def slowReport() -> Response:
+            with Session(engine) as session:
+                time.sleep(rtt + (0 if networked else slow))
+                session.exec(slowQuery, params={"seconds": slow})
+                return Response("done")
+    else:
+        sessions = async_sessionmaker(create_async_engine(asyncUrl(url)), class_=AsyncSession, expire_on_commit=False)
+
+        @app.get("/getSnips/{userId}")
+        async def getSnips(userId: int) -> Response:
+            async with sessions() as session:
+                await asyncio.sleep(rtt)
+                return Response(dumpSnipList((await session.exec(snipPage(userId))).all()), media_type="application/json")
+
+        @app.get("/slow")
+        async def slowReport() -> Response:
+            async with sessions() as session:
+                await asyncio.sleep(rtt + (0 if networked else slow))
+                await session.exec(slowQuery, params={"seconds": slow})
+                return Response("done")
+
+    return app
+
+def seed(url: str, scale: BenchmarkScale) -> list:
+    engine = create_engine(syncUrl(url))
+
+    with engine.begin() as connection:
+        runMigrations(connection)
+        userIds = seedLibrary(connection, scale)
+
+    engine.dispose()
+    return userIds
+
+def freePort() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def startServer(mode: str, url: str, port: int, args) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.async_db:serverApp", "--factory", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, "ASYNC_DB_MODE": mode, "ASYNC_DB_URL": url, "ASYNC_DB_RTT": str(args.rtt), "ASYNC_DB_SLOW": str(args.slowms)}
+    )
+
+async def drive(baseUrl: str, userIds: list, args) -> list:
+    results = []
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+
+    async with httpx.AsyncClient(base_url=baseUrl, timeout=120, limits=limits) as client:
+        for _ in range(100):
+            try:
+                await client.get(f"/getSnips/{userIds[0]}")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        deadline = time.perf_counter() + args.duration
+
+        async def reader(seed: int):
+            rng = random.Random(seed)
+
+            while (time.perf_counter() < deadline):
+                start = time.perf_counter()
+                response = await client.get(f"/getSnips/{rng.choice(userIds)}")
+                results.append(OperationResult("getSnips", time.perf_counter() - start, response.status_code))
+
+        async def slowReports():
+            while (time.perf_counter() < deadline):
+                start = time.perf_counter()
+                response = await client.get("/slow")
+                results.append(OperationResult("slow report", time.perf_counter() - start, response.status_code))
+                await asyncio.sleep(args.slowevery)
+
+        await asyncio.gather(slowReports(), *(reader(i) for i in range(args.concurrency)))
+
+    return results
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.async_db")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--snipsperuser", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent readers")
+    parser.add_argument("--duration", type=float, default=10, help="seconds measured per session mode")
+    parser.add_argument("--slowevery", type=float, default=0.5, help="seconds between slow queries")
+    parser.add_argument("--slowms", type=float, default=300, help="milliseconds the slow query keeps the database busy")
+    parser.add_argument("--rtt", type=float, default=None, help="modelled milliseconds per statement. Default 1 on sqlite, 0 on a networked database")
+    parser.add_argument("--out", help="write both results documents here")
+    args = parser.parse_args(argv)
+
+    url = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/async_db.db")
+
+    if (args.rtt is None):
+        args.rtt = 1 if make_url(url).get_backend_name() == "sqlite" else 0
+
+    scale = BenchmarkScale(users=args.users, snipsperuser=args.snipsperuser)
+    userIds = seed(url, scale)
+    documents = {}
+
+    for mode in ("sync", "async"):
+        port = freePort()
+        server = startServer(mode, url, port, args)
+
+        try:
+            results = asyncio.run(drive(f"http://127.0.0.1:{port}", userIds, args))
+        finally:
+            server.terminate()
+            server.wait()
+
+        settings = {"concurrency": args.concurrency, "duration": args.duration, "slowevery": args.slowevery, "slowms": args.slowms, "rtt": args.rtt}
+        documents[mode] = summarize(results, args.duration, f"{mode} session", settings, scale.model_dump())
+        print(f"{mode} session\n{formatSummary(documents[mode])}\n")
+
+    print(compareResults(documents["sync"], documents["async"]))
+
+    if (args.out):
+        writeResults(documents, args.out)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,61 @@
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+#Times authenticate(), the per-request JWT check, with the verified token cache (TOKEN_CACHE_SIZE) off and on, in
+#microseconds per call, and _getVerifiedClaims() on its own ("claims"), the part the cache replaces, without building
+#the UserContext. "one token" is a client repeating requests with its session, the cache's hit path. "rotating"
+#cycles through more tokens than the cache holds, so every call misses, verifies and evicts: what a cache too small for
+#the active sessions costs on top of no cache at all. csrf is checked on every call in every case.
+#Run with: python -m benchmarks.auth [calls]
+os.environ.setdefault("JWT_SECRET", "auth-benchmark-secret-0123456789abcdef0123456789")
+
+import utils.security as security
+from utils.security import authenticate, issueTokens
+
+CALLS = 20000
+REPEATS = 5
+CACHE_SIZE = 1000
+ROTATING_TOKENS = 2 * CACHE_SIZE
+
+def checkClaims(csrf: str, jwtToken: str) -> bool:
+    return security._getVerifiedClaims(jwtToken)[3] == csrf
+
+#Median microseconds per call of check over REPEATS runs of calls calls, starting each run from an empty cache
+def timeCalls(check, tokens: list, calls: int, cacheSize: int) -> float:
+    security.TOKEN_CACHE_SIZE = cacheSize
+    samples = []
+
+    for _ in range(REPEATS):
+        security._tokenCache.clear()
+        start = time.perf_counter()
+
+        for i in range(calls):
+            csrf, jwtToken = tokens[i % len(tokens)]
+
+            if (not check(csrf, jwtToken)):
+                raise RuntimeError("benchmark token rejected")
+
+        samples.append((time.perf_counter() - start) * 1000000 / calls)
+
+    return statistics.median(samples)
+
+def main(calls: int) -> int:
+    exp = datetime.now(timezone.utc) + timedelta(hours=2)
+    tokens = [issueTokens(userId, f"auth{userId}@example.com", exp) for userId in range(1, ROTATING_TOKENS + 1)]
+    authenticated = lambda csrf, jwtToken: authenticate(csrf, jwtToken) is not None
+    print(f"{'tokens':<10} {'call':<13} {'off us':>8} {'on us':>8} {'speedup':>8}")
+
+    for name, used in (("one token", tokens[:1]), ("rotating", tokens)):
+        for call, check in (("authenticate", authenticated), ("claims", checkClaims)):
+            offUs = timeCalls(check, used, calls, 0)
+            onUs = timeCalls(check, used, calls, CACHE_SIZE)
+            print(f"{name:<10} {call:<13} {offUs:>8.1f} {onUs:>8.1f} {offUs / onUs:>7.1f}x")
+
+    print(f"token cache {security.tokenCacheStats}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else CALLS))
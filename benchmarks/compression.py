@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#Snip content compression benchmark, app in process on a fresh sqlite file. For each of --sizes (KB) creates --snips
+#snips of code-like text through /createSnip with SNIP_COMPRESSION off and then on, and reports the bytes stored for
+#their bodies (snipcontent plus snipcontentz), createSnip latency and the getSnipDetails latency of --fetches random
+#reads. Each body ends in a word of its own, searched for through /searchSnips to confirm compressed snips stay
+#searchable. Sizes under SNIP_COMPRESSION_THRESHOLD are stored as text in both modes.
+#Run with: python -m benchmarks.compression [--sizes 4,64,256,1024] [--snips 20] [--out compression.json]
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/compression.db"
+os.environ["JOB_WORKER"] = "false"
+os.environ["SNIP_COMPRESSION"] = "true"
+os.environ.setdefault("JWT_SECRET", "compression-benchmark-secret-0123456789abcdef0123456789")
+
+import httpx
+from sqlalchemy import insert, select
+from benchmarks.report import percentile, writeResults
+import config
+import utils.snip_content
+from main import app
+from models.db_models import Collection, Snip, User
+from utils.security import issueTokens
+
+OWNER = 1
+WORDS = ("cache", "parse", "request", "index", "token", "retry", "stream", "buffer", "query", "render", "config", "worker", "result", "value")
+
+def codeBody(generator: random.Random, size: int, marker: str) -> str:
+    lines = []
+    length = 0
+
+    while (length < size):
+        indent = "    " * generator.randrange(4)
+        lines.append(f"{indent}{generator.choice(WORDS)}_{generator.randrange(5000)} = {generator.choice(WORDS)}({generator.choice(WORDS)}_{generator.randrange(500)}, {generator.randrange(1000)})\n")
+        length += len(lines[-1])
+
+    return "".join(lines) + f"# {marker}\n"
+
+def auth() -> dict:
+    csrf, jwtToken = issueTokens(OWNER, "compression@example.com", datetime.now(timezone.utc) + timedelta(hours=2))
+    return {"snipsnap_csrf": csrf, "Cookie": f"snipsnap_jwt={jwtToken}"}
+
+def _milliseconds(seconds: list) -> dict:
+    seconds = sorted(seconds)
+    return {f"p{p}_ms": round(percentile(seconds, p) * 1000, 2) for p in (50, 90, 99)} | {"max_ms": round(seconds[-1] * 1000, 2)}
+
+async def storedBytes(snipIds: list) -> dict:
+    async with config.engine.connect() as connection:
+        rows = (await connection.execute(select(Snip.snipcontent, Snip.snipcontentz).where(Snip.snipid.in_(snipIds)))).all()
+
+    return {
+        "text_bytes": sum(len(row.snipcontent.encode('utf-8')) for row in rows),
+        "compressed_bytes": sum(len(row.snipcontentz) for row in rows if row.snipcontentz is not None),
+        "compressed_snips": sum(1 for row in rows if row.snipcontentz is not None)
+    }
+
+async def measure(client: httpx.AsyncClient, headers: dict, generator: random.Random, compression: bool, sizeKb: int, args) -> dict:
+    snipIds = []
+    bodyBytes = 0
+    createTimes = []
+
+    for i in range(args.snips):
+        marker = f"marker{'on' if compression else 'off'}{sizeKb}x{i}"
+        body = codeBody(generator, sizeKb * 1024, marker)
+        bodyBytes += len(body.encode('utf-8'))
+        snip = {"snipid": 0, "snipname": f"{sizeKb} KB snip {i}", "sniplanguage": "python", "snipdescription": "", "snipcontent": body, "collectionid": 1, "lastmodified": datetime.now(timezone.utc).isoformat(), "sharedwith": []}
+        start = time.perf_counter()
+        response = await client.post("/createSnip", json=snip, headers=headers)
+        createTimes.append(time.perf_counter() - start)
+        response.raise_for_status()
+        snipIds.append(response.json())
+
+    fetchTimes = []
+
+    for _ in range(args.fetches):
+        start = time.perf_counter()
+        response = await client.get(f"/getSnipDetails/{generator.choice(snipIds)}", headers=headers)
+        fetchTimes.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+    found = 0
+
+    for i, snipId in enumerate(snipIds):
+        hits = (await client.get("/searchSnips", params={"q": f"marker{'on' if compression else 'off'}{sizeKb}x{i}"}, headers=headers)).json()
+        found += any(hit["snipid"] == snipId for hit in hits)
+
+    stored = await storedBytes(snipIds)
+
+    return {
+        "compression": compression,
+        "snip_kb": sizeKb,
+        "snips": args.snips,
+        "body_bytes": bodyBytes,
+        **stored,
+        "stored_ratio": round((stored["text_bytes"] + stored["compressed_bytes"]) / bodyBytes, 3),
+        "searchable": found,
+        "createSnip": _milliseconds(createTimes),
+        "getSnipDetails": _milliseconds(fetchTimes)
+    }
+
+async def run(args) -> dict:
+    generator = random.Random(args.seed)
+    document = {"settings": {"snips": args.snips, "fetches": args.fetches, "seed": args.seed, "threshold": config.SNIP_COMPRESSION_THRESHOLD, "level": config.SNIP_COMPRESSION_LEVEL}, "results": []}
+
+    try:
+        async with app.router.lifespan_context(app):
+            now = datetime.now(timezone.utc)
+
+            async with config.engine.begin() as connection:
+                await connection.execute(insert(User), [{"userid": OWNER, "email": "compression@example.com", "password": "x", "firstname": "Compression", "lastname": "Benchmark", "dataversion": 0, "createdon": now, "lastmodified": now}])
+                await connection.execute(insert(Collection), [{"collectionid": 1, "userid": OWNER, "collectionname": "Compressed", "createdon": now, "lastmodified": now}])
+
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://compression", timeout=60) as client:
+                for compression in (False, True):
+                    utils.snip_content.SNIP_COMPRESSION = compression #packSnipContent reads the setting from its module
+
+                    for sizeKb in args.sizes:
+                        result = await measure(client, auth(), generator, compression, sizeKb, args)
+                        document["results"].append(result)
+                        print(f"compression {'on ' if compression else 'off'} {sizeKb:>5} KB: stored {result['stored_ratio']:.3f} of the body, getSnipDetails p50 {result['getSnipDetails']['p50_ms']} ms p99 {result['getSnipDetails']['p99_ms']} ms, createSnip p50 {result['createSnip']['p50_ms']} ms, {result['searchable']}/{args.snips} found by search", file=sys.stderr)
+    finally:
+        await config.engine.dispose()
+
+    return document
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compression")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[4, 64, 256, 1024], help="snip sizes in KB, comma separated")
+    parser.add_argument("--snips", type=int, default=20, help="snips created per size and mode")
+    parser.add_argument("--fetches", type=int, default=200, help="getSnipDetails calls per size and mode")
+    parser.add_argument("--seed", type=int, default=15)
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    document = asyncio.run(run(args))
+    print(json.dumps(document, indent=2))
+
+    if (args.out):
+        writeResults(document, args.out)
+
+    return 0 if all(result["searchable"] == result["snips"] for result in document["results"]) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#createSnip round trips and latency by the number of contacts a snip is shared with, app in process on a fresh sqlite
+#file. Runs --creates creates sharing with each of --contacts contacts through /createSnip and through a copy of the
+#handler from before it went to one transaction (/createSnipTwoCommits below: collection check, insert, refresh and
+#the shares as separate statements over two commits), and reports the statements and commits per create, each a round
+#trip to a networked database, with latency percentiles. SQLite answers from local disk, so each statement and
+#commit also waits --rtt milliseconds, the round trip a networked database would add.
+#Run with: python -m benchmarks.create_snip [--contacts 1,10,100] [--creates 200] [--rtt 1] [--out create_snip.json]
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/create_snip.db"
+os.environ["JOB_WORKER"] = "false"
+os.environ.setdefault("JWT_SECRET", "create-snip-benchmark-secret-0123456789abcdef0123456789")
+
+import httpx
+from fastapi import Depends
+from sqlalchemy import event, insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from benchmarks.report import percentile, writeResults
+import config
+from main import app
+from models.db_models import Collection, Contact, Shared, Snip, User
+from models.http.request_models import SaveSnipRequest
+from utils.etag import bumpDataVersion
+from utils.query_counter import countStatements
+from utils.security import UserContext, getCurrentUser, issueTokens
+from utils.snip_content import packSnipContent
+
+OWNER = 1
+
+#The handler before createSnip went to one transaction, less its error handling and cache invalidation
+async def createSnipTwoCommits(snipreq: SaveSnipRequest, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(config.get_session)) -> int:
+    collection = (await session.exec(select(Collection.collectionid).where((Collection.userid == user.userid) & (Collection.collectionid == snipreq.collectionid)))).first()
+    snip = Snip(userid=user.userid, snipname=snipreq.snipname, snipdescription=snipreq.snipdescription, sniplanguage=snipreq.sniplanguage, **packSnipContent(snipreq.snipcontent), collectionid=collection)
+    session.add(snip)
+    await bumpDataVersion(session, user.userid)
+    await session.commit()
+    await session.refresh(snip)
+
+    if (len(snipreq.sharedwith) > 0):
+        session.add_all([Shared(snipid=snip.snipid, userid=user.userid, contactid=contactid) for contactid in snipreq.sharedwith])
+        await bumpDataVersion(session, user.userid)
+        await session.commit()
+
+    return snip.snipid
+
+app.add_api_route("/createSnipTwoCommits", createSnipTwoCommits, methods=["POST"])
+
+def auth() -> dict:
+    csrf, jwtToken = issueTokens(OWNER, "owner@example.com", datetime.now(timezone.utc) + timedelta(hours=2))
+    return {"snipsnap_csrf": csrf, "Cookie": f"snipsnap_jwt={jwtToken}"}
+
+def _milliseconds(seconds: list) -> dict:
+    seconds = sorted(seconds)
+    return {f"p{p}_ms": round(percentile(seconds, p) * 1000, 2) for p in (50, 90, 99)} | {"max_ms": round(seconds[-1] * 1000, 2)}
+
+async def seed(contacts: int):
+    now = datetime.now(timezone.utc)
+
+    async with config.engine.begin() as connection:
+        await connection.execute(insert(User), [{"userid": userId, "email": "owner@example.com" if userId == OWNER else f"contact{userId}@example.com", "password": "x", "firstname": "Create", "lastname": "Snip", "dataversion": 0, "createdon": now, "lastmodified": now} for userId in range(OWNER, contacts + 2)])
+        await connection.execute(insert(Contact), [{"userid": OWNER, "contactid": userId, "displayname": f"Contact {userId}"} for userId in range(OWNER + 1, contacts + 2)])
+        await connection.execute(insert(Collection), [{"collectionid": 1, "userid": OWNER, "collectionname": "Created", "createdon": now, "lastmodified": now}])
+
+async def measure(client: httpx.AsyncClient, headers: dict, path: str, contacts: int, args) -> dict:
+    snip = {"snipid": 0, "snipname": "created", "sniplanguage": "python", "snipdescription": "", "snipcontent": "print('created')\n" * 20, "collectionid": 1, "sharedwith": list(range(OWNER + 1, OWNER + 1 + contacts))}
+    commits = 0
+
+    def onCommit(connection):
+        nonlocal commits
+        commits += 1
+        time.sleep(args.rtt / 1000)
+
+    def onExecute(connection, cursor, statement, parameters, context, executemany):
+        time.sleep(args.rtt / 1000)
+
+    event.listen(config.engine.sync_engine, "commit", onCommit)
+    event.listen(config.engine.sync_engine, "before_cursor_execute", onExecute)
+    times = []
+
+    try:
+        with countStatements(config.engine) as counter:
+            for _ in range(args.creates):
+                start = time.perf_counter()
+                response = await client.post(path, json={**snip, "lastmodified": datetime.now(timezone.utc).isoformat()}, headers=headers)
+                times.append(time.perf_counter() - start)
+                response.raise_for_status()
+    finally:
+        event.remove(config.engine.sync_engine, "commit", onCommit)
+        event.remove(config.engine.sync_engine, "before_cursor_execute", onExecute)
+
+    return {"statements": round(counter.count / args.creates, 2), "commits": round(commits / args.creates, 2), **_milliseconds(times)}
+
+async def run(args) -> dict:
+    document = {"settings": {"creates": args.creates, "rtt": args.rtt}, "results": []}
+
+    try:
+        async with app.router.lifespan_context(app):
+            await seed(max(args.contacts))
+
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://create-snip", timeout=60) as client:
+                for contacts in args.contacts:
+                    result = {"contacts": contacts}
+
+                    for name, path in (("two_commits", "/createSnipTwoCommits"), ("one_transaction", "/createSnip")):
+                        result[name] = await measure(client, auth(), path, contacts, args)
+                        print(f"{contacts:>4} contacts, {name.replace('_', ' '):<15}: {result[name]['statements']} statements, {result[name]['commits']} commits, p50 {result[name]['p50_ms']} ms, p99 {result[name]['p99_ms']} ms", file=sys.stderr)
+
+                    document["results"].append(result)
+    finally:
+        await config.engine.dispose()
+
+    return document
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.create_snip")
+    parser.add_argument("--contacts", type=lambda value: [int(count) for count in value.split(",")], default=[1, 10, 100], help="contacts each snip is shared with, comma separated")
+    parser.add_argument("--creates", type=int, default=200, help="snips created per contact count and handler")
+    parser.add_argument("--rtt", type=float, default=1, help="modelled milliseconds per statement and commit")
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    document = asyncio.run(run(args))
+    print(json.dumps(document, indent=2))
+
+    if (args.out):
+        writeResults(document, args.out)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
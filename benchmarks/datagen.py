@@ -0,0 +1,124 @@
+import random
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Connection, func, insert, select
+from sqlmodel import SQLModel
+from models.db_models import Collection, Contact, Shared, Snip, User
+from utils.security import hashPassword
+from utils.snip_content import packSnipContent
+
+#Synthetic SnipSnap data for the load test. The same scale and seed always produce the same library, so results
+#from different commits are comparable. Libraries are skewed like real ones: the heaviest users own most of the snips
+#(snip counts follow a Zipf distribution with exponent skew, 0 for every user alike) and sharing goes to contacts
+
+BENCH_PASSWORD = "benchmark-password"
+LANGUAGES = ("python", "javascript", "typescript", "sql", "bash", "go", "rust", "java")
+WORDS = ("cache", "parse", "request", "index", "token", "retry", "stream", "buffer", "query", "render", "config", "worker")
+
+class BenchmarkScale(SQLModel):
+    users: int = 200
+    snipsperuser: int = 50 #Mean. The total is users * snipsperuser whatever the skew
+    skew: float = 1.0
+    collectionsperuser: int = 5
+    contactsperuser: int = 8
+    sharerate: float = 0.2 #Fraction of snips shared, each with 1 to 3 of the owner's contacts
+    contentbytes: int = 2000 #Mean snip body size
+    seed: int = 1
+
+def benchEmail(index: int) -> str:
+    return f"bench-{index}@example.com"
+
+#Snip counts per user: total split by Zipf weights, largest first
+def snipCounts(scale: BenchmarkScale) -> list:
+    weights = [1 / (rank + 1) ** scale.skew for rank in range(scale.users)]
+    total = scale.users * scale.snipsperuser
+    counts = [int(total * weight / sum(weights)) for weight in weights]
+    counts[0] += total - sum(counts)
+    return counts
+
+def _content(rng: random.Random, meanBytes: int) -> str:
+    lines = []
+    size = 0
+    target = max(16, int(rng.expovariate(1 / meanBytes))) if meanBytes > 0 else 0
+
+    while (size < target):
+        line = f"{rng.choice(WORDS)}_{rng.randrange(1000)} = {rng.choice(WORDS)}({rng.choice(WORDS)}, {rng.randrange(100)})"
+        lines.append(line)
+        size += len(line) + 1
+
+    return "\n".join(lines)
+
+#Insert the library described by scale and return its user ids in rank order (index 0 owns the most snips).
+#Runs in the caller's transaction. Refuses a database that already has benchmark users
+def seedLibrary(connection: Connection, scale: BenchmarkScale, batchSize: int = 5000) -> list:
+    if (connection.execute(select(func.count()).select_from(User.__table__).where(User.email.like("bench-%@example.com"))).scalar() > 0):
+        raise RuntimeError("The database already has benchmark users, seed a fresh one")
+
+    rng = random.Random(scale.seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    password = hashPassword(BENCH_PASSWORD) #Hashed once, every benchmark user shares it
+    userIds = connection.execute(insert(User.__table__).returning(User.__table__.c.userid, sort_by_parameter_order=True), [
+        {"email": benchEmail(i), "password": password, "firstname": "Bench", "lastname": f"User {i}", "dataversion": 0, "createdon": now, "lastmodified": now}
+        for i in range(scale.users)
+    ]).scalars().all()
+
+    contacts = {}
+    contactRows = []
+
+    for i, userId in enumerate(userIds):
+        others = [other for other in rng.sample(range(scale.users), min(scale.users, scale.contactsperuser + 1)) if other != i][:scale.contactsperuser]
+        contacts[userId] = [userIds[other] for other in others]
+        contactRows.extend({"userid": userId, "contactid": contactId, "displayname": f"Contact {contactId}"} for contactId in contacts[userId])
+
+    if (len(contactRows) > 0):
+        connection.execute(insert(Contact.__table__), contactRows)
+
+    collectionRows = connection.execute(insert(Collection.__table__).returning(Collection.__table__.c.userid, Collection.__table__.c.collectionid, sort_by_parameter_order=True), [
+        {"userid": userId, "collectionname": f"{rng.choice(WORDS)} {c}", "createdon": now, "lastmodified": now}
+        for userId in userIds for c in range(scale.collectionsperuser)
+    ]).all() if scale.collectionsperuser > 0 else []
+    collections = {}
+
+    for userId, collectionId in collectionRows:
+        collections.setdefault(userId, []).append(collectionId)
+
+    pending = []
+
+    def flush():
+        snipIds = connection.execute(insert(Snip.__table__).returning(Snip.__table__.c.snipid, sort_by_parameter_order=True), [row for row, _ in pending]).scalars().all()
+        shares = [
+            {"snipid": snipId, "userid": row["userid"], "contactid": contactId}
+            for snipId, (row, sharedWith) in zip(snipIds, pending) for contactId in sharedWith
+        ]
+
+        if (len(shares) > 0):
+            connection.execute(insert(Shared.__table__), shares)
+
+        pending.clear()
+
+    for userId, count in zip(userIds, snipCounts(scale)):
+        for s in range(count):
+            modified = now - timedelta(minutes=rng.randrange(60 * 24 * 365))
+            row = {
+                "userid": userId,
+                "collectionid": rng.choice(collections[userId]) if userId in collections else None,
+                "snipname": f"{rng.choice(WORDS)} {rng.choice(WORDS)} {s}",
+                "sniplanguage": rng.choice(LANGUAGES),
+                "snipdescription": f"{rng.choice(WORDS)} helper for {rng.choice(WORDS)}",
+                **packSnipContent(_content(rng, scale.contentbytes)),
+                "createdon": modified,
+                "lastmodified": modified
+            }
+            sharedWith = []
+
+            if (len(contacts[userId]) > 0 and rng.random() < scale.sharerate):
+                sharedWith = rng.sample(contacts[userId], min(len(contacts[userId]), rng.randint(1, 3)))
+
+            pending.append((row, sharedWith))
+
+            if (len(pending) >= batchSize):
+                flush()
+
+    if (len(pending) > 0):
+        flush()
+
+    return userIds
@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#Library export/import round trip. Seeds one user with --snips snips, streams their library from GET /export to a
+#file, then uploads the file to POST /import as a second, empty user, and reports the time of each and the server's
+#peak RSS while it ran next to its RSS before, so memory that grows with the library shows up as the peak rising with
+#--snips. The app runs in its own uvicorn process so client memory and seeding don't count. Linux only, RSS comes
+#from /proc. Uses BENCH_DATABASE_URL if set (e.g. a local postgres), otherwise a temporary sqlite file.
+#Run with: python -m benchmarks.library [--snips 100000] [--contentbytes 500] [--out library.json]
+os.environ.setdefault("JWT_SECRET", "library-benchmark-secret-0123456789abcdef0123456789") #Shared with the server
+
+import httpx
+from sqlalchemy import create_engine, func, insert, select
+from benchmarks.async_db import asyncUrl, freePort, syncUrl
+from benchmarks.datagen import BenchmarkScale, benchEmail, seedLibrary
+from benchmarks.report import writeResults
+from migrations.migrate import runMigrations
+from models.db_models import Snip, User
+from utils.security import issueTokens
+
+CHUNK_BYTES = 64 * 1024 #Upload chunk size, a client streaming a file
+IMPORTER_EMAIL = "library-import@example.com"
+
+def seed(url: str, scale: BenchmarkScale) -> tuple[int, int]:
+    engine = create_engine(syncUrl(url))
+    now = datetime.now(timezone.utc)
+
+    with engine.begin() as connection:
+        runMigrations(connection)
+        ownerId = seedLibrary(connection, scale)[0]
+        importerId = connection.execute(insert(User.__table__).returning(User.__table__.c.userid), [
+            {"email": IMPORTER_EMAIL, "password": "x", "firstname": "Library", "lastname": "Import", "dataversion": 0, "createdon": now, "lastmodified": now}
+        ]).scalar()
+
+    engine.dispose()
+    return ownerId, importerId
+
+def countSnips(url: str, userId: int) -> int:
+    engine = create_engine(syncUrl(url))
+
+    with engine.connect() as connection:
+        count = connection.execute(select(func.count()).select_from(Snip.__table__).where(Snip.__table__.c.userid == userId)).scalar()
+
+    engine.dispose()
+    return count
+
+def startServer(url: str, port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, "DATABASE_URL": asyncUrl(url), "JOB_WORKER": "false"}
+    )
+
+def rssBytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if (line.startswith("VmRSS:")):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+#Run phase while sampling the server's RSS. Returns the phase's result, its seconds, and the RSS before and at peak
+async def sampled(pid: int, phase) -> tuple:
+    before = rssBytes(pid)
+    peak = before
+    done = asyncio.Event()
+
+    async def sampler():
+        nonlocal peak
+
+        while (not done.is_set()):
+            peak = max(peak, rssBytes(pid))
+            await asyncio.sleep(0.01)
+
+    task = asyncio.create_task(sampler())
+    start = time.perf_counter()
+
+    try:
+        result = await phase
+    finally:
+        elapsed = time.perf_counter() - start
+        done.set()
+        await task
+
+    return result, elapsed, before, max(peak, rssBytes(pid))
+
+def auth(userId: int, email: str) -> dict:
+    csrf, jwtToken = issueTokens(userId, email, datetime.now(timezone.utc) + timedelta(hours=2))
+    return {"snipsnap_csrf": csrf, "Cookie": f"snipsnap_jwt={jwtToken}"}
+
+async def export(client: httpx.AsyncClient, headers: dict, path: str) -> int:
+    size = 0
+
+    async with client.stream("GET", "/export", headers=headers) as response:
+        response.raise_for_status()
+
+        with open(path, "wb") as file:
+            async for chunk in response.aiter_bytes(CHUNK_BYTES):
+                file.write(chunk)
+                size += len(chunk)
+
+    return size
+
+async def upload(client: httpx.AsyncClient, headers: dict, path: str) -> dict:
+    async def chunks():
+        with open(path, "rb") as file:
+            while (chunk := file.read(CHUNK_BYTES)):
+                yield chunk
+
+    response = await client.post("/import", content=chunks(), headers={**headers, "Content-Type": "application/x-ndjson"})
+    response.raise_for_status()
+    return response.json()
+
+async def roundTrip(port: int, pid: int, ownerId: int, importerId: int, path: str) -> dict:
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=3600) as client:
+        for _ in range(100):
+            try:
+                await client.get("/docs")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        size, exportSeconds, exportBefore, exportPeak = await sampled(pid, export(client, auth(ownerId, benchEmail(0)), path))
+        imported, importSeconds, importBefore, importPeak = await sampled(pid, upload(client, auth(importerId, IMPORTER_EMAIL), path))
+
+    megabytes = lambda value: round(value / 1024 / 1024, 1)
+
+    return {
+        "file_mb": megabytes(size),
+        "export": {"seconds": round(exportSeconds, 2), "rss_before_mb": megabytes(exportBefore), "rss_peak_mb": megabytes(exportPeak)},
+        "import": {"seconds": round(importSeconds, 2), "rss_before_mb": megabytes(importBefore), "rss_peak_mb": megabytes(importPeak), "result": imported}
+    }
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.library")
+    parser.add_argument("--snips", type=int, default=100000, help="snips in the exported library")
+    parser.add_argument("--contentbytes", type=int, default=500, help="mean snip body size")
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    url = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{directory}/library.db")
+    scale = BenchmarkScale(users=1, snipsperuser=args.snips, contactsperuser=0, sharerate=0, contentbytes=args.contentbytes)
+    ownerId, importerId = seed(url, scale)
+    port = freePort()
+    server = startServer(url, port)
+
+    try:
+        document = asyncio.run(roundTrip(port, server.pid, ownerId, importerId, f"{directory}/library.ndjson"))
+    finally:
+        server.terminate()
+        server.wait()
+
+    document["settings"] = {"snips": args.snips, "contentbytes": args.contentbytes}
+    document["imported_snips"] = countSnips(url, importerId)
+    print(json.dumps(document, indent=2))
+
+    if (args.out):
+        writeResults(document, args.out)
+
+    return 0 if document["imported_snips"] == args.snips else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+#Load test for the API. Seeds a synthetic library (benchmarks/datagen.py), replays the workload mix
+#(benchmarks/workload.py) and writes throughput and latency percentiles as JSON (benchmarks/report.py).
+#
+#  python -m benchmarks.loadtest run --out before.json           App in process on a fresh sqlite file
+#  python -m benchmarks.loadtest seed                             Seed BENCH_DATABASE_URL for a server to use
+#  python -m benchmarks.loadtest run --url http://localhost:8000  Against that server over HTTP
+#  python -m benchmarks.loadtest compare before.json after.json
+#
+#In process runs use BENCH_DATABASE_URL if set (e.g. a local postgres), otherwise a temporary sqlite file. Never the
+#configured DATABASE_URL. Keep the scale and run options the same across commits for comparable results
+os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/loadtest.db")
+os.environ.setdefault("JWT_SECRET", "load-test-secret-0123456789abcdef0123456789")
+
+import httpx
+from benchmarks.datagen import BenchmarkScale, seedLibrary
+from benchmarks.report import compareResults, formatSummary, readResults, summarize, writeResults
+from benchmarks.workload import MIX, runWorkload
+import config
+
+async def seed(scale: BenchmarkScale):
+    await config.init_db()
+
+    async with config.engine.begin() as connection:
+        userIds = await connection.run_sync(seedLibrary, scale)
+
+    print(f"Seeded {len(userIds)} users and {scale.users * scale.snipsperuser} snips", file=sys.stderr)
+
+async def seedOnly(scale: BenchmarkScale):
+    await seed(scale)
+    await config.engine.dispose()
+
+def _settings(args, target: str) -> dict:
+    settings = {"concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup, "mix": MIX}
+
+    #Only known for the app in process. A server over HTTP runs with its own environment
+    if (target == "in-process"):
+        settings.update(
+            database=config.engine.dialect.name,
+            bcryptrounds=config.BCRYPT_ROUNDS,
+            readcache=config.READ_CACHE_BACKEND,
+            snipcompression=config.SNIP_COMPRESSION,
+            poolsize=config.DB_POOL_SIZE,
+            replicas=len(config.replicaEngines),
+            metrics=config.METRICS_ENABLED
+        )
+
+    return settings
+
+async def run(args, scale: BenchmarkScale) -> dict:
+    if (args.url):
+        async with httpx.AsyncClient(base_url=args.url, timeout=60, limits=httpx.Limits(max_connections=args.concurrency)) as client:
+            results = await runWorkload(client, scale, args.concurrency, args.duration, args.warmup, scale.seed)
+
+        return summarize(results, args.duration, args.url, _settings(args, args.url), scale.model_dump())
+
+    from main import app #Imported here so runs over HTTP don't build the app
+
+    async with app.router.lifespan_context(app):
+        if (not args.noseed):
+            await seed(scale)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=60) as client:
+            results = await runWorkload(client, scale, args.concurrency, args.duration, args.warmup, scale.seed)
+
+    await config.engine.dispose()
+    return summarize(results, args.duration, "in-process", _settings(args, "in-process"), scale.model_dump())
+
+def parseArgs(argv: list):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.loadtest")
+    commands = parser.add_subparsers(dest="command", required=True)
+    seedCommand = commands.add_parser("seed", help="seed BENCH_DATABASE_URL")
+    runCommand = commands.add_parser("run", help="replay the workload and report")
+    compareCommand = commands.add_parser("compare", help="compare two results files")
+
+    for command in (seedCommand, runCommand):
+        for name, field in BenchmarkScale.model_fields.items():
+            command.add_argument(f"--{name}", type=type(field.default), default=field.default)
+
+    runCommand.add_argument("--url", help="base URL of a running server, seeded with the same scale. Default: the app in process")
+    runCommand.add_argument("--noseed", action="store_true", help="in process: use BENCH_DATABASE_URL as already seeded")
+    runCommand.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    runCommand.add_argument("--duration", type=float, default=30, help="seconds measured")
+    runCommand.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    runCommand.add_argument("--out", help="write the results JSON here")
+    compareCommand.add_argument("before")
+    compareCommand.add_argument("after")
+    return parser.parse_args(argv)
+
+def main(argv: list) -> int:
+    args = parseArgs(argv)
+
+    if (args.command == "compare"):
+        print(compareResults(readResults(args.before), readResults(args.after)))
+        return 0
+
+    scale = BenchmarkScale(**{name: getattr(args, name) for name in BenchmarkScale.model_fields})
+
+    if (args.command == "seed"):
+        asyncio.run(seedOnly(scale))
+        return 0
+
+    document = asyncio.run(run(args, scale))
+    print(formatSummary(document))
+
+    if (args.out):
+        writeResults(document, args.out)
+
+    return 1 if document["total"]["count"] == 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
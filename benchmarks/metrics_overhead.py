@@ -0,0 +1,102 @@
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from fastapi import FastAPI
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from utils.metrics import MetricsMiddleware, RequestMetrics, currentRequestMetrics, instrumentEngine
+
+#Measures what the metrics add per request and per statement: the same trivial route driven straight through ASGI
+#with and without MetricsMiddleware, and the same SELECT 1 on a sqlite file through engines with and without the hooks.
+#Run with: python -m benchmarks.metrics_overhead [requests]
+REQUESTS = 20000
+STATEMENTS = 5000
+REPEATS = 9
+
+def buildApp(withMetrics: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{itemId}")
+    async def item(itemId: int) -> dict:
+        return {"itemId": itemId}
+
+    if (withMetrics):
+        app.add_middleware(MetricsMiddleware)
+
+    return app
+
+async def driveRequests(app, count: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+
+    for i in range(count):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": f"/items/{i}", "raw_path": f"/items/{i}".encode(), "root_path": "", "query_string": b"",
+            "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80), "state": {}
+        }
+        await app(scope, receive, send)
+
+    return (time.perf_counter() - start) / count * 1e6
+
+async def driveStatements(engine, count: int) -> float:
+    token = currentRequestMetrics.set(RequestMetrics())
+
+    try:
+        async with engine.connect() as connection:
+            start = time.perf_counter()
+
+            for _ in range(count):
+                await connection.execute(text("SELECT 1"))
+
+            return (time.perf_counter() - start) / count * 1e6
+    finally:
+        currentRequestMetrics.reset(token)
+
+#Medians of REPEATS runs of each drive, alternating between them so drift in machine load hits both alike.
+#Microseconds per operation
+async def compare(baseline, instrumented) -> tuple:
+    baselineRuns = []
+    instrumentedRuns = []
+
+    for _ in range(REPEATS):
+        baselineRuns.append(await baseline())
+        instrumentedRuns.append(await instrumented())
+
+    return (statistics.median(baselineRuns), statistics.median(instrumentedRuns))
+
+async def run(requests: int):
+    plain = buildApp(False)
+    measured = buildApp(True)
+    await driveRequests(plain, 1000) #Warm up routing and pydantic
+    await driveRequests(measured, 1000)
+    plainUs, measuredUs = await compare(lambda: driveRequests(plain, requests), lambda: driveRequests(measured, requests))
+    print(f"request:   {plainUs:8.2f} us without metrics, {measuredUs:8.2f} us with, {measuredUs - plainUs:+.2f} us per request")
+
+    path = f"{tempfile.mkdtemp()}/metrics_overhead.db"
+    bare = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    hooked = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    instrumentEngine(hooked)
+
+    try:
+        await driveStatements(bare, 500)
+        await driveStatements(hooked, 500)
+        bareUs, hookedUs = await compare(lambda: driveStatements(bare, STATEMENTS), lambda: driveStatements(hooked, STATEMENTS))
+        print(f"statement: {bareUs:8.2f} us without hooks,   {hookedUs:8.2f} us with, {hookedUs - bareUs:+.2f} us per statement")
+    finally:
+        await bare.dispose()
+        await hooked.dispose()
+
+def main(args: list) -> int:
+    asyncio.run(run(int(args[0]) if args else REQUESTS))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
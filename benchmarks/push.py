@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#Push event benchmark against one uvicorn worker on a fresh sqlite file, both measured from a client process on the
+#same machine.
+#  Fan-out: an owner shares a snip with --subscribers contacts, each with an /events stream open, then edits it. Reports
+#  the time from sending the edit to each stream receiving its event, over --rounds edits.
+#  Idle: opens up to --idle more streams in steps of --step for a user nobody shares with, and after each step reports
+#  the worker's resident memory (Linux /proc), its growth per stream opened and the latency of a /sync request alongside them.
+#Client and server share the machine's CPUs, so on small machines latencies include the client reading every stream.
+#Raise the open files limit (ulimit -n) above --idle + --subscribers first. Run with:
+#  python -m benchmarks.push [--subscribers 1000] [--idle 10000] [--out push.json]
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/push.db"
+os.environ["NOTIFY_BACKEND"] = "memory"
+os.environ.setdefault("JWT_SECRET", "push-benchmark-secret-0123456789abcdef0123456789")
+
+import httpx
+from sqlalchemy import insert
+from benchmarks.report import percentile, writeResults
+import config
+from models.db_models import Collection, Contact, Shared, Snip, User
+from utils.security import issueTokens
+from utils.snip_content import packSnipContent
+
+OWNER = 1
+IDLE_USER = 2 #Recipients are users 3 and up
+
+async def seed(subscribers: int) -> int:
+    await config.init_db()
+    now = datetime.now(timezone.utc)
+    recipients = range(IDLE_USER + 1, IDLE_USER + 1 + subscribers)
+
+    async with config.engine.begin() as connection:
+        await connection.execute(insert(User.__table__), [
+            {"userid": userId, "email": f"push-{userId}@example.com", "password": "x", "firstname": "Push", "lastname": f"User {userId}", "dataversion": 0, "createdon": now, "lastmodified": now}
+            for userId in (OWNER, IDLE_USER, *recipients)
+        ])
+        await connection.execute(insert(Contact.__table__), [{"userid": OWNER, "contactid": userId, "displayname": f"Contact {userId}"} for userId in recipients])
+        await connection.execute(insert(Collection.__table__).values(collectionid=1, userid=OWNER, collectionname="pushed", createdon=now, lastmodified=now))
+        await connection.execute(insert(Snip.__table__).values(snipid=1, userid=OWNER, collectionid=1, snipname="pushed", sniplanguage="python", snipdescription="", **packSnipContent("x"), createdon=now, lastmodified=now))
+
+        if (subscribers > 0):
+            await connection.execute(insert(Shared.__table__), [{"snipid": 1, "userid": OWNER, "contactid": userId} for userId in recipients])
+
+    await config.engine.dispose()
+    return list(recipients)
+
+def auth(userId: int) -> dict:
+    csrf, jwtToken = issueTokens(userId, f"push-{userId}@example.com", datetime.now(timezone.utc) + timedelta(hours=2))
+    return {"headers": {"snipsnap_csrf": csrf, "Cookie": f"snipsnap_jwt={jwtToken}"}}
+
+def freePort() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def startServer(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", "--no-access-log", "--backlog", "4096"],
+        env=os.environ.copy()
+    )
+
+#Resident memory of pid in KB, None off Linux
+def residentKb(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if (line.startswith("VmRSS:")):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+    return None
+
+#One /events stream. ready resolves once the server has subscribed it, every "event:" line after that is timestamped
+class Stream:
+    def __init__(self, client: httpx.AsyncClient, credentials: dict):
+        self.ready = asyncio.get_running_loop().create_future()
+        self.received = []
+        self.task = asyncio.create_task(self._read(client, credentials))
+
+    async def _read(self, client: httpx.AsyncClient, credentials: dict):
+        try:
+            async with client.stream("GET", "/events", headers=credentials["headers"]) as response:
+                if (response.status_code != 200):
+                    raise RuntimeError(f"/events returned {response.status_code}")
+
+                async for line in response.aiter_lines():
+                    if (line.startswith(": subscribed") and not self.ready.done()):
+                        self.ready.set_result(True)
+                    elif (line.startswith("event:")):
+                        self.received.append((time.perf_counter(), line[len("event: "):]))
+        except Exception as error:
+            if (not self.ready.done()):
+                self.ready.set_exception(error)
+
+async def openStreams(client: httpx.AsyncClient, credentials: list, count: int, parallel: int = 200) -> list:
+    streams = []
+
+    for start in range(0, count, parallel):
+        opened = [Stream(client, credentials[i % len(credentials)]) for i in range(start, min(count, start + parallel))]
+        await asyncio.gather(*(stream.ready for stream in opened))
+        streams.extend(opened)
+
+    return streams
+
+async def timeRequest(client: httpx.AsyncClient, method: str, url: str, credentials: dict, **kwargs) -> float:
+    start = time.perf_counter()
+    response = await client.request(method, url, headers=credentials["headers"], **kwargs)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+def _milliseconds(seconds: list) -> dict:
+    seconds = sorted(seconds)
+    return {f"p{p}_ms": round(percentile(seconds, p) * 1000, 2) for p in (50, 90, 99)} | {"max_ms": round(seconds[-1] * 1000, 2)}
+
+async def fanOut(client: httpx.AsyncClient, recipients: list, rounds: int) -> dict:
+    owner = auth(OWNER)
+    streams = await openStreams(client, [auth(userId) for userId in recipients], len(recipients))
+    snip = {"snipid": 1, "snipname": "pushed", "sniplanguage": "python", "snipdescription": "", "snipcontent": "x", "collectionid": 1, "lastmodified": datetime.now(timezone.utc).isoformat(), "sharedwith": recipients}
+    latencies = []
+    requests = []
+    missed = 0
+
+    for round in range(rounds):
+        for stream in streams:
+            stream.received.clear()
+
+        start = time.perf_counter()
+        requests.append(await timeRequest(client, "PATCH", "/editSnip", owner, json={**snip, "snipcontent": f"round {round}"}))
+        deadline = time.perf_counter() + 30
+
+        while (any(len(stream.received) == 0 for stream in streams) and time.perf_counter() < deadline):
+            await asyncio.sleep(0.005)
+
+        for stream in streams:
+            if (len(stream.received) > 0):
+                latencies.append(stream.received[0][0] - start)
+            else:
+                missed += 1
+
+        await asyncio.sleep(0.2)
+
+    for stream in streams:
+        stream.task.cancel()
+
+    await asyncio.gather(*(stream.task for stream in streams), return_exceptions=True)
+    return {"subscribers": len(streams), "rounds": rounds, "missed": missed, "edit": _milliseconds(requests), "delivery": _milliseconds(latencies) if latencies else None}
+
+async def idleCapacity(client: httpx.AsyncClient, pid: int, total: int, step: int) -> list:
+    idle = auth(IDLE_USER)
+    streams = []
+    previous = (0, residentKb(pid))
+    steps = []
+
+    while (len(streams) < total):
+        try:
+            streams.extend(await openStreams(client, [idle], min(step, total - len(streams))))
+        except Exception as error:
+            steps.append({"connections": len(streams), "error": repr(error)})
+            break
+
+        await asyncio.sleep(0.5)
+        probes = [await timeRequest(client, "GET", "/sync", idle) for _ in range(20)]
+        resident = residentKb(pid)
+        steps.append({
+            "connections": len(streams),
+            "rss_kb": resident,
+            #Growth since the previous step. Memory the fan-out streams freed is reused first, so early steps read low
+            "kb_per_connection": round((resident - previous[1]) / (len(streams) - previous[0]), 1) if resident is not None and previous[1] is not None else None,
+            "sync": _milliseconds(probes)
+        })
+        previous = (len(streams), resident)
+        print(f"{len(streams):>7} idle streams  rss {resident} KB  {steps[-1]['kb_per_connection']} KB each  /sync p50 {steps[-1]['sync']['p50_ms']} ms", file=sys.stderr)
+
+    for stream in streams:
+        stream.task.cancel()
+
+    await asyncio.gather(*(stream.task for stream in streams), return_exceptions=True)
+    return steps
+
+async def run(args) -> dict:
+    recipients = await seed(args.subscribers)
+    port = freePort()
+    server = startServer(port)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=20)
+
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=httpx.Timeout(60, read=None), limits=limits) as client:
+            for _ in range(100):
+                try:
+                    await client.post("/checkAuth")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+            document = {"baseline_rss_kb": residentKb(server.pid)}
+            document["fanout"] = await fanOut(client, recipients, args.rounds)
+            print(f"fan-out to {args.subscribers}: {json.dumps(document['fanout'])}", file=sys.stderr)
+            document["idle"] = await idleCapacity(client, server.pid, args.idle, args.step)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return document
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.push")
+    parser.add_argument("--subscribers", type=int, default=1000, help="streams the fan-out edit reaches")
+    parser.add_argument("--rounds", type=int, default=5, help="fan-out edits measured")
+    parser.add_argument("--idle", type=int, default=10000, help="idle streams opened in total")
+    parser.add_argument("--step", type=int, default=1000, help="idle streams opened between measurements")
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    document = asyncio.run(run(args))
+    print(json.dumps(document, indent=2))
+
+    if (args.out):
+        writeResults(document, args.out)
+
+    return 0 if document["fanout"]["missed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
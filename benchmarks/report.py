@@ -0,0 +1,113 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+#Load test results as JSON. Files carry the commit, settings and scale they were made with next to throughput and
+#latency percentiles per operation, so runs on different commits can be lined up with compareResults
+
+RESULTS_VERSION = 1
+PERCENTILES = (50, 90, 95, 99)
+
+#Nearest rank percentile of sorted values
+def percentile(values: list, p: float) -> float:
+    if (len(values) == 0):
+        return 0.0
+
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+def _latencySummary(seconds: list, statuses: list, duration: float) -> dict:
+    milliseconds = sorted(s * 1000 for s in seconds)
+    errors = sum(1 for status in statuses if status == 0 or status >= 400)
+
+    return {
+        "count": len(milliseconds),
+        "errors": errors,
+        "throughput": round(len(milliseconds) / duration, 2) if duration > 0 else 0.0, #Operations per second
+        "mean_ms": round(sum(milliseconds) / len(milliseconds), 3) if milliseconds else 0.0,
+        **{f"p{p}_ms": round(percentile(milliseconds, p), 3) for p in PERCENTILES},
+        "max_ms": round(milliseconds[-1], 3) if milliseconds else 0.0
+    }
+
+def gitCommit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#Results document for a run. results are OperationResults from benchmarks.workload
+def summarize(results: list, duration: float, target: str, settings: dict, scale: dict) -> dict:
+    operations = {}
+
+    for result in results:
+        operation = operations.setdefault(result.op, ([], []))
+        operation[0].append(result.seconds)
+        operation[1].append(result.status)
+
+    statusCounts = {}
+
+    for result in results:
+        statusCounts[str(result.status)] = statusCounts.get(str(result.status), 0) + 1
+
+    return {
+        "version": RESULTS_VERSION,
+        "commit": gitCommit(),
+        "ranat": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "target": target,
+        "settings": settings,
+        "scale": scale,
+        "duration": duration,
+        "total": _latencySummary([r.seconds for r in results], [r.status for r in results], duration),
+        "statuses": dict(sorted(statusCounts.items())),
+        "operations": {op: _latencySummary(seconds, statuses, duration) for op, (seconds, statuses) in sorted(operations.items())}
+    }
+
+def formatSummary(document: dict) -> str:
+    lines = [f"{'operation':<16} {'count':>7} {'errors':>6} {'ops/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+
+    for name, summary in (*document["operations"].items(), ("total", document["total"])):
+        lines.append(f"{name:<16} {summary['count']:>7} {summary['errors']:>6} {summary['throughput']:>9.1f} {summary['p50_ms']:>9.2f} {summary['p90_ms']:>9.2f} {summary['p99_ms']:>9.2f} {summary['max_ms']:>9.2f}")
+
+    return "\n".join(lines)
+
+#Side by side table of two results documents, with the change in throughput and p50/p99 latency per operation
+def compareResults(before: dict, after: dict) -> str:
+    lines = []
+
+    for key in ("settings", "scale"):
+        if (before.get(key) != after.get(key)):
+            lines.append(f"warning: {key} differ, the runs may not be comparable")
+
+    lines.append(f"{before.get('commit')} -> {after.get('commit')}")
+    lines.append(f"{'operation':<16} {'ops/s':>17} {'change':>8} {'p50 ms':>17} {'change':>8} {'p99 ms':>17} {'change':>8}")
+
+    def change(old: float, new: float) -> str:
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    names = sorted(set(before["operations"]) | set(after["operations"]))
+
+    for name in (*names, "total"):
+        old = before["total"] if name == "total" else before["operations"].get(name)
+        new = after["total"] if name == "total" else after["operations"].get(name)
+
+        if (old is None or new is None):
+            lines.append(f"{name:<16} only in {'after' if old is None else 'before'}")
+            continue
+
+        lines.append(
+            f"{name:<16} {old['throughput']:>8.1f}{new['throughput']:>9.1f} {change(old['throughput'], new['throughput']):>8}"
+            f" {old['p50_ms']:>8.2f}{new['p50_ms']:>9.2f} {change(old['p50_ms'], new['p50_ms']):>8}"
+            f" {old['p99_ms']:>8.2f}{new['p99_ms']:>9.2f} {change(old['p99_ms'], new['p99_ms']):>8}"
+        )
+
+    return "\n".join(lines)
+
+def writeResults(document: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(document, file, indent=2)
+        file.write("\n")
+
+def readResults(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#Revision history benchmark, app in process on a fresh sqlite file. For each of --sizes (KB) a snip of that size takes
+#--edits small random edits through /editSnip: a few characters changed on a line, a line added or a line removed.
+#Reports the revision storage per edit next to the mean size of an edit and of the snip, so growth that follows the
+#snip rather than the edits shows up as bytes per edit rising with --sizes. Then fetches --fetches random revisions
+#through /getSnipRevision, checking each against a hash of the body it had, and reports edit and rebuild latency.
+#Run with: python -m benchmarks.revisions [--sizes 16,256] [--edits 5000] [--out revisions.json]
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/revisions.db"
+os.environ["JOB_WORKER"] = "false"
+os.environ.setdefault("JWT_SECRET", "revisions-benchmark-secret-0123456789abcdef0123456789")
+
+import httpx
+from sqlalchemy import func, insert, select
+from benchmarks.report import percentile, writeResults
+import config
+from main import app
+from models.db_models import Collection, SnipRevision, User
+from utils.revisions import SNAPSHOT
+from utils.security import issueTokens
+
+OWNER = 1
+WORDS = ("value", "result", "index", "count", "items", "return", "self", "data", "None", "for", "in", "if", "else", "print")
+
+def randomLine(generator: random.Random) -> str:
+    return "    " * generator.randrange(4) + " ".join(generator.choice(WORDS) for _ in range(generator.randrange(2, 12))) + "\n"
+
+def largeBody(generator: random.Random, size: int) -> list:
+    lines = []
+    length = 0
+
+    while (length < size):
+        lines.append(randomLine(generator))
+        length += len(lines[-1])
+
+    return lines
+
+#Change lines in place, returning how many characters the edit removed plus how many it added, 0 if it changed nothing
+def editLines(generator: random.Random, lines: list) -> int:
+    at = generator.randrange(len(lines))
+    kind = generator.random()
+
+    if (kind < 0.6):
+        old = lines[at]
+        start = generator.randrange(len(old) - 1) #Keep the newline
+        removed = min(generator.randrange(1, 8), len(old) - 1 - start)
+        replacement = generator.choice(WORDS)
+        lines[at] = old[:start] + replacement + old[start + removed:]
+        return removed + len(replacement) if lines[at] != old else 0
+    elif (kind < 0.8 or len(lines) < 2):
+        lines.insert(at, randomLine(generator))
+        return len(lines[at])
+    else:
+        return len(lines.pop(at))
+
+def auth() -> dict:
+    csrf, jwtToken = issueTokens(OWNER, "revisions@example.com", datetime.now(timezone.utc) + timedelta(hours=2))
+    return {"snipsnap_csrf": csrf, "Cookie": f"snipsnap_jwt={jwtToken}"}
+
+def _milliseconds(seconds: list) -> dict:
+    seconds = sorted(seconds)
+    return {f"p{p}_ms": round(percentile(seconds, p) * 1000, 2) for p in (50, 90, 99)} | {"max_ms": round(seconds[-1] * 1000, 2)}
+
+async def storage(snipId: int) -> dict:
+    async with config.engine.connect() as connection:
+        rows = (await connection.execute(
+            select(SnipRevision.kind, func.count(), func.sum(func.length(SnipRevision.data))).where(SnipRevision.snipid == snipId).group_by(SnipRevision.kind)
+        )).all()
+
+    return {kind: {"rows": count, "bytes": size} for kind, count, size in rows}
+
+async def firstSnapshotBytes(snipId: int) -> int:
+    async with config.engine.connect() as connection:
+        return (await connection.execute(select(func.length(SnipRevision.data)).where((SnipRevision.snipid == snipId) & (SnipRevision.revision == 1)))).scalar()
+
+async def createSnip(client: httpx.AsyncClient, headers: dict, content: str) -> int:
+    response = await client.post("/createSnip", json={"snipid": 0, "snipname": "revised", "sniplanguage": "python", "snipdescription": "", "snipcontent": content, "collectionid": 1, "lastmodified": datetime.now(timezone.utc).isoformat(), "sharedwith": []}, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+async def replay(client: httpx.AsyncClient, headers: dict, generator: random.Random, sizeKb: int, edits: int, fetches: int) -> dict:
+    lines = largeBody(generator, sizeKb * 1024)
+    body = "".join(lines)
+    snipId = await createSnip(client, headers, body)
+    hashes = [hashlib.sha256(body.encode('utf-8')).hexdigest()] #Revision 1 is the body the first edit replaces
+    snip = {"snipid": snipId, "snipname": "revised", "sniplanguage": "python", "snipdescription": "", "collectionid": 1, "sharedwith": []}
+    changed = 0
+    editTimes = []
+
+    for _ in range(edits):
+        while ((change := editLines(generator, lines)) == 0):
+            pass
+
+        changed += change
+        body = "".join(lines)
+        start = time.perf_counter()
+        response = await client.patch("/editSnip", json={**snip, "snipcontent": body, "lastmodified": datetime.now(timezone.utc).isoformat()}, headers=headers)
+        editTimes.append(time.perf_counter() - start)
+        response.raise_for_status()
+        hashes.append(hashlib.sha256(body.encode('utf-8')).hexdigest())
+
+    stored = await storage(snipId)
+    totalBytes = sum(kind["bytes"] for kind in stored.values())
+    fetchTimes = []
+    mismatches = 0
+
+    for revision in generator.sample(range(1, len(hashes) + 1), min(fetches, len(hashes))):
+        start = time.perf_counter()
+        response = await client.get(f"/getSnipRevision/{snipId}/{revision}", headers=headers)
+        fetchTimes.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+        if (hashlib.sha256(response.json()["snipcontent"].encode('utf-8')).hexdigest() != hashes[revision - 1]):
+            mismatches += 1
+
+    return {
+        "snip_kb": sizeKb,
+        "edits": edits,
+        "mean_change_chars": round(changed / edits, 1),
+        "revisions": len(hashes),
+        "snapshots": stored.get(SNAPSHOT, {}).get("rows", 0),
+        "stored_bytes": totalBytes,
+        #Revision 1 holds the body from before history began, so it isn't counted against the edits
+        "bytes_per_edit": round((totalBytes - await firstSnapshotBytes(snipId)) / edits, 1),
+        "storage": stored,
+        "edit": _milliseconds(editTimes),
+        "rebuild": _milliseconds(fetchTimes),
+        "rebuild_mismatches": mismatches
+    }
+
+async def run(args) -> dict:
+    generator = random.Random(args.seed)
+    document = {"settings": {"edits": args.edits, "fetches": args.fetches, "seed": args.seed, "max_chain": config.SNIP_REVISION_MAX_CHAIN}, "sizes": []}
+
+    try:
+        async with app.router.lifespan_context(app):
+            now = datetime.now(timezone.utc)
+
+            async with config.engine.begin() as connection:
+                await connection.execute(insert(User), [{"userid": OWNER, "email": "revisions@example.com", "password": "x", "firstname": "Revisions", "lastname": "Benchmark", "dataversion": 0, "createdon": now, "lastmodified": now}])
+                await connection.execute(insert(Collection), [{"collectionid": 1, "userid": OWNER, "collectionname": "Revised", "createdon": now, "lastmodified": now}])
+
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://revisions", timeout=60) as client:
+                for sizeKb in args.sizes:
+                    result = await replay(client, auth(), generator, sizeKb, args.edits, args.fetches)
+                    document["sizes"].append(result)
+                    print(f"{sizeKb:>5} KB snip: {result['bytes_per_edit']} bytes stored per edit of {result['mean_change_chars']} characters, {result['snapshots']} snapshots, edit p50 {result['edit']['p50_ms']} ms, rebuild p99 {result['rebuild']['p99_ms']} ms", file=sys.stderr)
+    finally:
+        await config.engine.dispose()
+    return document
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.revisions")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[16, 256], help="snip sizes in KB, comma separated")
+    parser.add_argument("--edits", type=int, default=5000, help="edits replayed per snip")
+    parser.add_argument("--fetches", type=int, default=200, help="random revisions rebuilt per snip")
+    parser.add_argument("--seed", type=int, default=25)
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    document = asyncio.run(run(args))
+    print(json.dumps(document, indent=2))
+
+    if (args.out):
+        writeResults(document, args.out)
+
+    return 0 if all(result["rebuild_mismatches"] == 0 for result in document["sizes"]) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
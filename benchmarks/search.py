@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#/searchSnips latency over a library seeded by benchmarks/datagen.py, 100k snips by default. Searches one at a time as
+#random users, weighted like the load test so heavy libraries are searched most, plus the heaviest user on their own
+#since their searches have the most candidates ("(top)" in the results). Query kinds: common, a word in most snips so
+#ranking sees the most hits, two words, rare, a word and a number (few hits), prefix, three letters of a word, and
+#miss, a word no snip has. The app runs in its own uvicorn process. Uses BENCH_DATABASE_URL if set (e.g. a local
+#postgres), otherwise a temporary sqlite file.
+#Run with: python -m benchmarks.search [--users 1000] [--snipsperuser 100] [--queries 200] [--out search.json]
+os.environ.setdefault("JWT_SECRET", "search-benchmark-secret-0123456789abcdef0123456789") #Shared with the server
+
+import httpx
+from benchmarks.async_db import freePort, seed
+from benchmarks.datagen import WORDS, BenchmarkScale, benchEmail, snipCounts
+from benchmarks.library import startServer
+from benchmarks.report import formatSummary, summarize, writeResults
+from benchmarks.workload import OperationResult
+from utils.security import issueTokens
+
+def queries(rng: random.Random) -> dict:
+    first, second = rng.sample(WORDS, 2)
+
+    return {
+        "common": first,
+        "two words": f"{first} {second}",
+        "rare": f"{first} {rng.randrange(1000)}",
+        "prefix": first[:3],
+        "miss": "zqxjv"
+    }
+
+def auth(userId: int, index: int) -> dict:
+    csrf, jwtToken = issueTokens(userId, benchEmail(index), datetime.now(timezone.utc) + timedelta(hours=2))
+    return {"snipsnap_csrf": csrf, "Cookie": f"snipsnap_jwt={jwtToken}"}
+
+async def drive(baseUrl: str, userIds: list, scale: BenchmarkScale, args) -> list:
+    rng = random.Random(scale.seed)
+    weights = snipCounts(scale)
+    headers = [auth(userId, index) for index, userId in enumerate(userIds)]
+    results = []
+
+    async with httpx.AsyncClient(base_url=baseUrl, timeout=120) as client:
+        for _ in range(100):
+            try:
+                await client.get("/docs")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        for i in range(args.queries):
+            index = 0 if i % 2 == 0 else rng.choices(range(len(userIds)), weights)[0]
+
+            for kind, q in queries(rng).items():
+                name = f"{kind} (top)" if index == 0 else kind
+                start = time.perf_counter()
+                response = await client.get("/searchSnips", params={"q": q}, headers=headers[index])
+                results.append(OperationResult(name, time.perf_counter() - start, response.status_code))
+
+    return results
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.search")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--snipsperuser", type=int, default=100)
+    parser.add_argument("--contentbytes", type=int, default=1000, help="mean snip body size")
+    parser.add_argument("--queries", type=int, default=200, help="rounds of one search of each kind, every other one as the heaviest user")
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    url = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/search.db")
+    scale = BenchmarkScale(users=args.users, snipsperuser=args.snipsperuser, contentbytes=args.contentbytes)
+    start = time.perf_counter()
+    userIds = seed(url, scale)
+    print(f"seeded {args.users * args.snipsperuser} snips in {time.perf_counter() - start:.0f} s, the heaviest user has {snipCounts(scale)[0]}", file=sys.stderr)
+    port = freePort()
+    server = startServer(url, port)
+
+    try:
+        start = time.perf_counter()
+        results = asyncio.run(drive(f"http://127.0.0.1:{port}", userIds, scale, args))
+        duration = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    document = summarize(results, duration, "searchSnips", {"queries": args.queries}, scale.model_dump())
+    print(formatSummary(document))
+
+    if (args.out):
+        writeResults(document, args.out)
+
+    return 0 if document["total"]["errors"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
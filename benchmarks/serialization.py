@@ -0,0 +1,92 @@
+import asyncio
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy import create_engine, insert
+from sqlmodel import SQLModel
+from models.db_models import Collection, Shared, Snip, User
+from models.http.response_models import SnipsResponse
+from utils.pagination import selectSnipList
+from utils.serialization import PreparedJSONResponse, dumpSnipList
+
+#Times turning a page of snip list rows into response bytes, the old way (a SnipsResponse per row, dumped to dicts,
+#then validated and serialised again by FastAPI's response_model) against utils/serialization.py, for cold reads
+#and read cache hits. Rows come from an in-memory sqlite database so they are real SQLAlchemy rows.
+#Run with: python -m benchmarks.serialization [sizes...]
+SIZES = [1000, 10000]
+REPEATS = 7
+SHARE_EVERY = 3 #Every nth snip is shared, so snipshared isn't constant
+
+_responseField = create_model_field("Response_getSnips", List[SnipsResponse], mode="serialization")
+
+#What getSnips sent before: rows to cached dicts, then the response_model pass
+def oldLoad(rows) -> list:
+    return [SnipsResponse(**row._mapping).model_dump(mode="json") for row in rows]
+
+def oldRespond(cached: list) -> bytes:
+    return JSONResponse(asyncio.run(serialize_response(field=_responseField, response_content=cached))).body
+
+def newLoad(rows) -> str:
+    return dumpSnipList(rows).decode('utf-8')
+
+def newRespond(cached: str) -> bytes:
+    return PreparedJSONResponse(cached.encode('utf-8')).body
+
+def seedRows(count: int) -> list:
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    now = datetime.now(timezone.utc)
+
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__).values(userid=1, email="bench@example.com", password="x", firstname="Bench", lastname="Mark", dataversion=0, createdon=now, lastmodified=now))
+        connection.execute(insert(Collection.__table__).values(collectionid=1, userid=1, collectionname="bench", createdon=now, lastmodified=now))
+        connection.execute(insert(Snip.__table__), [
+            {"snipid": i, "userid": 1, "collectionid": 1, "snipname": f"snip {i}", "sniplanguage": "python", "snipdescription": f"benchmark snip number {i}",
+             "snipcontent": "print('hello')", "createdon": now, "lastmodified": now - timedelta(seconds=i)}
+            for i in range(1, count + 1)
+        ])
+        connection.execute(insert(Shared.__table__), [{"snipid": i, "userid": 1, "contactid": 1} for i in range(1, count + 1, SHARE_EVERY)])
+
+    with engine.connect() as connection:
+        return connection.execute(selectSnipList().order_by(Snip.lastmodified.desc(), Snip.snipid.desc())).all()
+
+#Median milliseconds of func()
+def timeIt(func) -> float:
+    samples = []
+
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(samples)
+
+def main(sizes: list) -> int:
+    print(f"{'rows':>6} {'path':<10} {'old ms':>9} {'new ms':>9} {'speedup':>8}")
+
+    for size in sizes:
+        rows = seedRows(size)
+        oldCached = oldLoad(rows)
+        newCached = newLoad(rows)
+
+        if (oldRespond(oldCached) != newRespond(newCached)):
+            print(f"Old and new bodies differ for {size} rows")
+            return 1
+
+        for path, old, new in (
+            ("cold", lambda: oldRespond(oldLoad(rows)), lambda: newRespond(newLoad(rows))),
+            ("cache hit", lambda: oldRespond(oldCached), lambda: newRespond(newCached)),
+        ):
+            oldMs = timeIt(old)
+            newMs = timeIt(new)
+            print(f"{size:>6} {path:<10} {oldMs:>9.2f} {newMs:>9.2f} {oldMs / newMs:>7.1f}x")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main([int(size) for size in sys.argv[1:]] or SIZES))
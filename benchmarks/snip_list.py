@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, select
+from benchmarks.async_db import syncUrl
+from benchmarks.datagen import BenchmarkScale, seedLibrary, snipCounts
+from benchmarks.report import percentile, writeResults
+from migrations.migrate import runMigrations
+from models.db_models import Snip
+from models.http.response_models import SnipsResponse
+from utils.pagination import selectSnipList
+from utils.serialization import _snipListAdapter, dumpSnipList
+
+#Snip list page cost by snip body size: a page of --page snips read the way the list endpoints did before they were
+#projected (whole Snip rows, snipcontent included, with every share row selectinloaded to work out snipshared) against
+#selectSnipList() (the five listed columns and an EXISTS on shared), both serialized to the same JSON, which is checked.
+#A library is seeded with benchmarks/datagen.py for each of --sizes (mean body bytes) and --pages random pages are
+#read per user picked like the load test. Sessions are sync, only the query and what it loads differ.
+#Uses BENCH_DATABASE_URL if set (e.g. a local postgres, an empty one for each size), otherwise temporary sqlite files.
+#Run with: python -m benchmarks.snip_list [--sizes 2000,20000,100000] [--pages 200] [--out snip_list.json]
+
+def entityPage(session: Session, userId: int, limit: int) -> bytes:
+    snips = session.exec(select(Snip).where(Snip.userid == userId).order_by(Snip.lastmodified.desc(), Snip.snipid.desc()).limit(limit).options(selectinload(Snip.sharedwith))).all()
+    page = [SnipsResponse(snipid=snip.snipid, snipname=snip.snipname, sniplanguage=snip.sniplanguage, snipdescription=snip.snipdescription, lastmodified=snip.lastmodified, snipshared=len(snip.sharedwith) > 0) for snip in snips]
+    session.expunge_all() #The old handlers ran one request per session, nothing stayed in the identity map
+    return _snipListAdapter.dump_json(page)
+
+def projectedPage(session: Session, userId: int, limit: int) -> bytes:
+    return dumpSnipList(session.exec(selectSnipList().where(Snip.userid == userId).order_by(Snip.lastmodified.desc(), Snip.snipid.desc()).limit(limit)).all())
+
+def _milliseconds(seconds: list) -> dict:
+    seconds = sorted(seconds)
+    return {f"p{p}_ms": round(percentile(seconds, p) * 1000, 2) for p in (50, 90, 99)} | {"max_ms": round(seconds[-1] * 1000, 2)}
+
+def measure(url: str, contentBytes: int, args) -> dict:
+    engine = create_engine(syncUrl(url))
+    scale = BenchmarkScale(users=args.users, snipsperuser=args.snipsperuser, contentbytes=contentBytes)
+
+    with engine.begin() as connection:
+        runMigrations(connection)
+        userIds = seedLibrary(connection, scale)
+
+    rng = random.Random(scale.seed)
+    picks = rng.choices(userIds, snipCounts(scale), k=args.pages)
+    result = {"contentbytes": contentBytes, "mismatches": 0}
+
+    with Session(engine) as session:
+        for userId in set(picks):
+            if (entityPage(session, userId, args.page) != projectedPage(session, userId, args.page)):
+                result["mismatches"] += 1
+
+        for name, readPage in (("entities", entityPage), ("projected", projectedPage)):
+            times = []
+
+            for userId in picks:
+                start = time.perf_counter()
+                readPage(session, userId, args.page)
+                times.append(time.perf_counter() - start)
+                session.rollback() #Each page in its own transaction, like a request
+
+            result[name] = _milliseconds(times)
+
+    engine.dispose()
+    return result
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.snip_list")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[2000, 20000, 100000], help="mean snip body bytes, comma separated, a library for each")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--snipsperuser", type=int, default=100)
+    parser.add_argument("--page", type=int, default=100, help="snips per page")
+    parser.add_argument("--pages", type=int, default=200, help="pages read per size and query")
+    parser.add_argument("--out", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    document = {"settings": {"users": args.users, "snipsperuser": args.snipsperuser, "page": args.page, "pages": args.pages}, "results": []}
+
+    for contentBytes in args.sizes:
+        url = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/snip_list.db")
+        result = measure(url, contentBytes, args)
+        document["results"].append(result)
+        print(f"{contentBytes:>7} byte bodies: entities p50 {result['entities']['p50_ms']} ms p99 {result['entities']['p99_ms']} ms, projected p50 {result['projected']['p50_ms']} ms p99 {result['projected']['p99_ms']} ms", file=sys.stderr)
+
+    print(json.dumps(document, indent=2))
+
+    if (args.out):
+        writeResults(document, args.out)
+
+    return 0 if all(result["mismatches"] == 0 for result in document["results"]) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,144 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+import httpx
+from benchmarks.datagen import BENCH_PASSWORD, BenchmarkScale, benchEmail, snipCounts
+
+#Scripted traffic for the load test. Each virtual user plays one benchmark user at a time the way the SPA does:
+#log in, then poll and open snips, with the occasional save. Operations are drawn from MIX by weight. Which user a
+#virtual user plays follows the seeded skew, so heavy libraries get the most traffic. Works against any httpx
+#client, the app in process (ASGITransport) or a server over HTTP
+
+#Relative weight of each operation
+MIX = {
+    "login": 2,
+    "getSnips": 35,
+    "getSnipDetails": 30,
+    "getSharedWithMe": 20,
+    "editSnip": 13,
+}
+
+SESSION_LENGTH = 50 #Operations before a virtual user logs out and picks another user
+
+class OperationResult:
+    __slots__ = ("op", "seconds", "status")
+
+    def __init__(self, op: str, seconds: float, status: int):
+        self.op = op
+        self.seconds = seconds
+        self.status = status
+
+#Cookies come back with the production domain, which httpx won't send to a test host, so the session keeps the
+#tokens itself and sends them on every request
+class BenchSession:
+    def __init__(self, client: httpx.AsyncClient, email: str):
+        self.client = client
+        self.email = email
+        self.headers = {}
+        self.etags = {} #url -> ETag of the last response, sent back in If-None-Match like the browser would
+        self.snipIds = []
+
+    async def login(self) -> int:
+        response = await self.client.post("/login", json={"email": self.email, "password": BENCH_PASSWORD})
+        cookies = dict(header.split(";", 1)[0].split("=", 1) for header in response.headers.get_list("set-cookie"))
+
+        if (response.status_code == 200):
+            self.headers = {"Cookie": f"snipsnap_jwt={cookies['snipsnap_jwt']}", "snipsnap_csrf": cookies["snipsnap_csrf"]}
+
+        return response.status_code
+
+    async def get(self, url: str) -> httpx.Response:
+        headers = dict(self.headers)
+
+        if (url in self.etags):
+            headers["If-None-Match"] = self.etags[url]
+
+        response = await self.client.get(url, headers=headers)
+
+        if ("etag" in response.headers):
+            self.etags[url] = response.headers["etag"]
+
+        return response
+
+    async def getSnips(self) -> int:
+        response = await self.get("/getSnips")
+
+        if (response.status_code == 200):
+            self.snipIds = [snip["snipid"] for snip in response.json()]
+
+        return response.status_code
+
+    async def getSharedWithMe(self) -> int:
+        return (await self.get("/getSharedWithMe")).status_code
+
+    async def getSnipDetails(self, rng: random.Random) -> int:
+        if (len(self.snipIds) == 0):
+            return await self.getSnips()
+
+        return (await self.get(f"/getSnipDetails/{rng.choice(self.snipIds)}")).status_code
+
+    #Open a snip and save it with a small change, as the editor does
+    async def editSnip(self, rng: random.Random) -> int:
+        if (len(self.snipIds) == 0):
+            return await self.getSnips()
+
+        snipId = rng.choice(self.snipIds)
+        response = await self.client.get(f"/getSnipDetails/{snipId}", headers=self.headers)
+
+        if (response.status_code != 200):
+            return response.status_code
+
+        details = response.json()
+        snip = {
+            "snipid": snipId,
+            "snipname": details["snipname"],
+            "sniplanguage": details["sniplanguage"],
+            "snipdescription": details["snipdescription"],
+            "snipcontent": details["snipcontent"] + f"\n# edited {rng.randrange(1_000_000)}",
+            "collectionid": details["collectionid"],
+            "lastmodified": datetime.now(timezone.utc).isoformat(),
+            "sharedwith": details["sharedwith"]
+        }
+
+        return (await self.client.patch("/editSnip", json=snip, headers=self.headers)).status_code
+
+#One virtual user. Runs until stopAt (time.perf_counter() based) and appends an OperationResult per operation.
+#Results before recordFrom are the warm up and are dropped
+async def virtualUser(client: httpx.AsyncClient, scale: BenchmarkScale, rng: random.Random, recordFrom: float, stopAt: float, results: list):
+    userWeights = snipCounts(scale)
+    ops = list(MIX)
+    opWeights = list(MIX.values())
+
+    while (time.perf_counter() < stopAt):
+        session = BenchSession(client, benchEmail(rng.choices(range(scale.users), weights=userWeights)[0]))
+        plan = ["login", "getSnips"] + rng.choices(ops, weights=opWeights, k=SESSION_LENGTH)
+
+        for op in plan:
+            if (time.perf_counter() >= stopAt):
+                return
+
+            start = time.perf_counter()
+
+            try:
+                if (op == "login"):
+                    status = await session.login()
+                elif (op in ("getSnipDetails", "editSnip")):
+                    status = await getattr(session, op)(rng)
+                else:
+                    status = await getattr(session, op)()
+            except httpx.HTTPError:
+                status = 0 #Connection failures and timeouts
+
+            if (start >= recordFrom):
+                results.append(OperationResult(op, time.perf_counter() - start, status))
+
+#Run concurrency virtual users for warmup + duration seconds and return the results recorded after the warm up
+async def runWorkload(client: httpx.AsyncClient, scale: BenchmarkScale, concurrency: int, duration: float, warmup: float, seed: int) -> list:
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        virtualUser(client, scale, random.Random(seed * 1000 + i), start + warmup, start + warmup + duration, results)
+        for i in range(concurrency)
+    ))
+    return results
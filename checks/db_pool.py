@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+#Checks the engine options built from the DB_POOL_* settings and the pool telemetry. The telemetry part exhausts a
+#tiny pool and checks the gauges, wait time and timeout counters. Run with: python -m checks.db_pool
+#Uses POOL_CHECK_DATABASE_URL if set (e.g. a local postgres, or PgBouncer with DB_POOL_MODE=transaction), otherwise
+#a temporary sqlite file. Never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = os.getenv("POOL_CHECK_DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/db_pool.db")
+
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from config import DATABASE_URL, DB_POOL_MODE, get_async_url, get_engine_options
+from utils.db_pool import InstrumentedQueuePool, getPoolStats
+
+POOL_SIZE = 2
+MAX_OVERFLOW = 1
+POOL_TIMEOUT = 0.2
+
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+def checkOptions():
+    asyncpgOptions = get_engine_options("postgresql+asyncpg://user@localhost/SnipSnap", "transaction")
+    connectArgs = asyncpgOptions.get("connect_args", {})
+    expect("asyncpg transaction mode turns statement caches off", connectArgs.get("statement_cache_size") == 0 and connectArgs.get("prepared_statement_cache_size") == 0)
+    expect("asyncpg transaction mode names statements uniquely", connectArgs["prepared_statement_name_func"]() != connectArgs["prepared_statement_name_func"]())
+    expect("psycopg transaction mode turns prepared statements off", get_engine_options("postgresql+psycopg://user@localhost/SnipSnap", "transaction")["connect_args"] == {"prepare_threshold": None})
+    expect("session mode keeps prepared statements", "connect_args" not in get_engine_options("postgresql+asyncpg://user@localhost/SnipSnap", "session"))
+    expect("postgres gets the instrumented pool", asyncpgOptions.get("poolclass") is InstrumentedQueuePool)
+    expect("sqlite in memory keeps its static pool", "poolclass" not in get_engine_options("sqlite+aiosqlite://"))
+
+async def checkTelemetry():
+    url = get_async_url(DATABASE_URL)
+    options = {**get_engine_options(url), "pool_size": POOL_SIZE, "max_overflow": MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT}
+    engine = create_async_engine(url, **options)
+    held = []
+
+    try:
+        #Statements go through the configured mode, so against PgBouncer this also checks prepared statements are off
+        for _ in range(POOL_SIZE + MAX_OVERFLOW):
+            connection = await engine.connect()
+            await connection.execute(text("SELECT 1"))
+            await connection.execute(text("SELECT 1"))
+            held.append(connection)
+
+        stats = getPoolStats(engine)
+        expect("checked out gauge", stats["checkedout"] == POOL_SIZE + MAX_OVERFLOW, stats["checkedout"])
+        expect("overflow gauge", stats["overflow"] == MAX_OVERFLOW, stats["overflow"])
+
+        try:
+            await engine.connect()
+            expect("exhausted pool times out", False)
+        except PoolTimeoutError:
+            pass
+
+        stats = getPoolStats(engine)
+        expect("timeouts counted", stats["timeouts"] == 1, stats["timeouts"])
+        expect("wait time includes the timed out checkout", stats["maxwaitseconds"] >= POOL_TIMEOUT, f"{stats['maxwaitseconds']:.3f}s")
+
+        for connection in held:
+            await connection.close()
+
+        held = []
+        stats = getPoolStats(engine)
+        expect("connections returned", stats["checkedout"] == 0 and stats["checkedin"] == POOL_SIZE, stats)
+        expect("checkouts counted", stats["checkouts"] == POOL_SIZE + MAX_OVERFLOW, stats["checkouts"])
+    finally:
+        for connection in held:
+            await connection.close()
+
+        await engine.dispose()
+
+def main() -> int:
+    print(f"Checking against {get_async_url(DATABASE_URL).split('://')[0]} with DB_POOL_MODE={DB_POOL_MODE}")
+    checkOptions()
+    asyncio.run(checkTelemetry())
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
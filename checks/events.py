@@ -0,0 +1,195 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#Checks push events: which streams hear about shares, unshares, edits and deletes, that the session making a change
+#doesn't hear about it, and how a stream authenticates, keeps alive and ends. The redis backend runs against a local
+#stand-in (checks/fake_redis.py) as two workers, across a dropped connection. Run with: python -m checks.events
+#Uses a temporary sqlite file, never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/events.db"
+os.environ["NOTIFY_BACKEND"] = "memory"
+os.environ["NOTIFY_MAX_EVENTS"] = "5"
+os.environ.setdefault("JWT_SECRET", "events-check-secret-0123456789abcdef0123456789")
+
+from fastapi.testclient import TestClient
+from checks.fake_redis import FakeRedis
+from main import app
+import utils.notifications as notifications
+import utils.security as security
+from utils.notifications import RESYNC, RedisPubSub, eventStream
+from utils.security import authenticate, issueTokens, redeemStreamTicket
+
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+def authArgs(userId: int, email: str) -> dict:
+    csrf, jwtToken = issueTokens(userId, email, datetime.now(timezone.utc) + timedelta(hours=1))
+    return {"headers": {"snipsnap_csrf": csrf}, "cookies": {"snipsnap_jwt": jwtToken}, "user": authenticate(csrf, jwtToken)}
+
+#Everything delivered to subscriber so far, as (type, snipid)
+def drain(subscriber) -> list:
+    events = []
+
+    while (not subscriber.queue.empty()):
+        event = subscriber.queue.get_nowait()
+        events.append((event["type"], event.get("snipid")))
+
+    return events
+
+async def readStream(stream, count: int) -> list:
+    return [await anext(stream) for _ in range(count)]
+
+def checkStream():
+    async def run():
+        stream = eventStream(1, "stream", time.time() + 0.3)
+        first = await readStream(stream, 1)
+        expect("stream opens without a retry delay, reconnects need a new ticket", first == [b": subscribed\n\n"], first)
+        expect("stream subscribed", notifications.notifyStats["connections"] == before + 1)
+
+        await notifications.notifier.publish([[1, {"type": "edited", "snipid": 7}, "other"]])
+        event = await anext(stream)
+        expect("event sent as SSE", event == b'event: edited\ndata: {"type": "edited", "snipid": 7}\n\n', event)
+
+        rest = [chunk async for chunk in stream]
+        expect("stream ends when the JWT expires", rest[-1].startswith(b"event: expired"), rest)
+        expect("ended stream unsubscribed", notifications.notifyStats["connections"] == before)
+
+    before = notifications.notifyStats["connections"]
+    notifications.NOTIFY_HEARTBEAT = 0.05
+    asyncio.run(run())
+
+#Wait for condition() to hold, as listener tasks deliver in the background
+async def until(condition, timeout: float = 3) -> bool:
+    deadline = time.monotonic() + timeout
+
+    while (not condition()):
+        if (time.monotonic() > deadline):
+            return False
+
+        await asyncio.sleep(0.01)
+
+    return True
+
+def checkRedisPubSub():
+    async def run():
+        client = FakeRedis()
+        workers = [RedisPubSub(client), RedisPubSub(client)] #Two processes sharing one redis
+        remote = workers[1].subscribe(1, "remote")
+        origin = workers[1].subscribe(1, "origin")
+        expect("listener subscribed to the channel", await until(lambda: len(client.pubsubs) == 1))
+
+        await workers[0].publish([[1, {"type": "edited", "snipid": 7}, "origin"]])
+        expect("event reaches a stream on another worker", await until(lambda: not remote.queue.empty()) and drain(remote) == [("edited", 7)])
+        expect("session that made the change hears nothing", drain(origin) == [])
+
+        broken = next(iter(client.pubsubs))
+        client.disconnect()
+        expect("dropped connection makes streams resync", await until(lambda: not remote.queue.empty() and not origin.queue.empty()) and drain(remote) == drain(origin) == [(RESYNC["type"], None)])
+        expect("listener closed the old pubsub and reconnected", await until(lambda: broken not in client.pubsubs) and await until(lambda: len(client.pubsubs) == 1 and next(iter(client.pubsubs)).channels == {RedisPubSub.CHANNEL}, 5), len(client.pubsubs))
+
+        await workers[0].publish([[1, {"type": "deleted", "snipid": 7}, "other"]])
+        expect("events flow again after reconnecting", await until(lambda: not origin.queue.empty()) and drain(origin) == [("deleted", 7)])
+
+        workers[1].listener.cancel()
+        await asyncio.gather(workers[1].listener, return_exceptions=True)
+        expect("stopped listener closed its pubsub", len(client.pubsubs) == 0, len(client.pubsubs))
+
+        for subscriber in (remote, origin):
+            workers[1].unsubscribe(subscriber)
+
+    asyncio.run(run())
+
+def main() -> int:
+    pubsub = notifications.notifier
+
+    with TestClient(app) as client:
+        def call(method: str, url: str, auth: dict, **kwargs):
+            client.cookies.clear()
+            client.cookies.update(auth["cookies"])
+            response = client.request(method, url, headers=auth["headers"], **kwargs)
+
+            if (response.status_code >= 400):
+                raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.text}")
+
+            return response
+
+        for email in ("owner@example.com", "friend@example.com", "other@example.com"):
+            client.post("/createUser", json={"email": email, "password": "password", "firstname": "Events", "lastname": "Check"})
+
+        owner = authArgs(1, "owner@example.com")
+        ownerElsewhere = authArgs(1, "owner@example.com") #The same user logged in on another device
+        friend = authArgs(2, "friend@example.com")
+        other = authArgs(3, "other@example.com")
+
+        for contact in ("friend@example.com", "other@example.com"):
+            call("POST", "/createContact", owner, json={"email": contact, "displayname": contact})
+
+        collectionId = call("POST", "/createCollection/Events", owner).json()
+        snip = {"snipid": 0, "snipname": "pushed", "sniplanguage": "python", "snipdescription": "", "snipcontent": "x", "collectionid": collectionId, "lastmodified": datetime.now(timezone.utc).isoformat(), "sharedwith": [2]}
+
+        streams = {name: pubsub.subscribe(auth["user"].userid, auth["user"].sessionid) for name, auth in (("owner", owner), ("ownerElsewhere", ownerElsewhere), ("friend", friend), ("other", other))}
+
+        snipId = call("POST", "/createSnip", owner, json=snip).json()
+        expect("recipient hears about the share", drain(streams["friend"]) == [("shared", snipId)])
+        expect("owner's other session hears about the new snip", sorted(drain(streams["ownerElsewhere"])) == [("edited", snipId), ("shared", snipId)])
+        expect("session that made the change hears nothing", drain(streams["owner"]) == [])
+        expect("unrelated user hears nothing", drain(streams["other"]) == [])
+
+        call("PATCH", "/editSnip", owner, json={**snip, "snipid": snipId, "snipname": "edited"})
+        expect("recipient hears about the edit", drain(streams["friend"]) == [("edited", snipId)])
+        expect("owner's other session hears about the edit", drain(streams["ownerElsewhere"]) == [("edited", snipId)])
+
+        call("PATCH", "/editSnip", owner, json={**snip, "snipid": snipId, "sharedwith": [3]})
+        expect("removed recipient hears about the unshare", drain(streams["friend"]) == [("unshared", snipId)])
+        expect("new recipient hears about the share", drain(streams["other"]) == [("shared", snipId)])
+        drain(streams["ownerElsewhere"])
+
+        call("DELETE", f"/deleteSnip/{snipId}", owner)
+        expect("recipient of a deleted snip loses it", drain(streams["other"]) == [("unshared", snipId)])
+        expect("owner's other session hears about the delete", drain(streams["ownerElsewhere"]) == [("deleted", snipId)])
+
+        call("POST", "/batch", owner, json={"operations": [{"op": "createSnip", "snip": {**snip, "sharedwith": [2]}} for _ in range(6)]})
+        expect("a flood of events becomes one resync", drain(streams["friend"]) == [(RESYNC["type"], None)])
+
+        for _ in range(notifications.NOTIFY_QUEUE_SIZE + 1):
+            streams["other"].deliver({"type": "edited", "snipid": 1})
+
+        expect("a stream too far behind is told to resync", drain(streams["other"]) == [(RESYNC["type"], None)])
+
+        client.cookies.clear()
+        client.cookies.update(friend["cookies"])
+        expect("ticket needs the csrf header", client.post("/events/ticket").status_code == 401)
+        ticket = call("POST", "/events/ticket", friend).json()["ticket"]
+        client.cookies.clear()
+        client.cookies.update(other["cookies"])
+        expect("stream rejects a ticket issued for another login", client.get("/events", params={"ticket": ticket}).status_code == 401)
+        friendJwt = friend["cookies"]["snipsnap_jwt"]
+        expect("ticket opens a stream for its login", redeemStreamTicket(ticket, friendJwt) == friend["user"])
+        expect("ticket is single use", redeemStreamTicket(ticket, friendJwt) is None)
+        client.cookies.clear()
+        client.cookies.update(friend["cookies"])
+        expect("stream rejects a used ticket", client.get("/events", params={"ticket": ticket}).status_code == 401)
+        expect("stream rejects a login JWT as a ticket", client.get("/events", params={"ticket": friendJwt}).status_code == 401)
+        expect("stream rejects the csrf token in the query", client.get("/events", params={"csrf": friend["headers"]["snipsnap_csrf"]}).status_code == 401)
+        expect("stream rejects a wrong csrf token", client.get("/events", headers={"snipsnap_csrf": "wrong"}).status_code == 401)
+        expect("stream rejects a missing csrf token", client.get("/events").status_code == 401)
+        security.STREAM_TICKET_TTL = -1
+        expect("stream rejects an expired ticket", redeemStreamTicket(call("POST", "/events/ticket", friend).json()["ticket"], friendJwt) is None)
+
+        for subscriber in streams.values():
+            pubsub.unsubscribe(subscriber)
+
+    checkStream()
+    checkRedisPubSub()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
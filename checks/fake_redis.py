@@ -0,0 +1,81 @@
+import asyncio
+
+#In memory stand-in for the parts of the redis.asyncio client the redis backends use (utils/read_cache.py,
+#utils/notifications.py), so checks can run them without a server. Values come back as bytes like from redis.
+#disconnect() breaks every open pubsub the way a dropped connection would
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.ttls = {}
+        self.pubsubs = set() #Open, not yet closed
+        self.commands = []
+
+    async def get(self, key: str):
+        self.commands.append(("get", key))
+        return self.values.get(key)
+
+    async def incr(self, key: str) -> int:
+        self.commands.append(("incr", key))
+        value = int(self.values.get(key, b"0")) + 1
+        self.values[key] = str(value).encode('utf-8')
+        return value
+
+    async def hget(self, key: str, field: str):
+        self.commands.append(("hget", key))
+        return self.hashes.get(key, {}).get(field)
+
+    async def hset(self, key: str, field: str, value: str):
+        self.commands.append(("hset", key))
+        self.hashes.setdefault(key, {})[field] = value.encode('utf-8')
+
+    async def expire(self, key: str, seconds: int):
+        self.ttls[key] = seconds
+
+    async def delete(self, *keys: str):
+        self.commands.append(("delete", *keys))
+
+        for key in keys:
+            self.values.pop(key, None)
+            self.hashes.pop(key, None)
+
+    async def publish(self, channel: str, message: str) -> int:
+        receivers = [pubsub for pubsub in self.pubsubs if channel in pubsub.channels]
+
+        for pubsub in receivers:
+            pubsub.messages.put_nowait({"type": "message", "channel": channel.encode('utf-8'), "data": message.encode('utf-8')})
+
+        return len(receivers)
+
+    def pubsub(self):
+        pubsub = FakePubSub(self)
+        self.pubsubs.add(pubsub)
+        return pubsub
+
+    def disconnect(self):
+        for pubsub in list(self.pubsubs):
+            pubsub.messages.put_nowait(ConnectionError("Connection closed by server."))
+
+class FakePubSub:
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.channels = set()
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, *channels: str):
+        self.channels.update(channels)
+
+    async def unsubscribe(self, *channels: str):
+        self.channels.difference_update(channels or set(self.channels))
+
+    async def listen(self):
+        while (True):
+            message = await self.messages.get()
+
+            if (isinstance(message, Exception)):
+                raise message
+
+            yield message
+
+    async def aclose(self):
+        self.client.pubsubs.discard(self)
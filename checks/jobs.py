@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#Checks background deletion jobs: a collection deletion, an account deletion of a heavy user (--snips, 100000 by
+#default) with shares and contacts in both directions, retries and failure, and taking over a job whose worker died.
+#Reports how long the account took and the longest chunk transaction. Run with: python -m checks.jobs [--snips N]
+#Uses JOBS_CHECK_DATABASE_URL if set, otherwise a temporary sqlite file with foreign keys enforced like postgres, so
+#a deletion step out of dependency order fails here too. Never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = os.getenv("JOBS_CHECK_DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/jobs.db")
+os.environ["JOB_WORKER"] = "false" #Jobs run when the check says so, through its own worker
+os.environ["JOB_RETRY_SECONDS"] = "0"
+os.environ["JOB_MAX_ATTEMPTS"] = "3"
+os.environ.setdefault("JWT_SECRET", "jobs-check-secret-0123456789abcdef0123456789")
+
+import httpx
+from sqlalchemy import event, func, insert, select
+from config import engine, sessions
+from main import app
+from models.db_models import Collection, Contact, Job, ShareFeed, Shared, Snip, Tombstone, User
+from utils.deletion import DELETE_ACCOUNT, DELETE_COLLECTION
+from utils.jobs import DONE, FAILED, JOB_HANDLERS, RUNNING, JobWorker, enqueueJob, jobHandler
+from utils.security import hashPassword, issueTokens
+from utils.snip_content import packSnipContent
+
+if (engine.dialect.name == "sqlite"):
+    @event.listens_for(engine.sync_engine, "connect")
+    def enforceForeignKeys(connection, record):
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+OWNER, FRIEND, OTHER = 1, 2, 3
+SHARE_EVERY = 10 #Every tenth of the owner's snips is shared with the friend
+FRIEND_SNIPS = 20 #The friend's snips, all shared with the owner
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+def authArgs(userId: int) -> dict:
+    csrf, jwtToken = issueTokens(userId, f"user{userId}@example.com", datetime.now(timezone.utc) + timedelta(hours=1))
+    return {"headers": {"snipsnap_csrf": csrf, "Cookie": f"snipsnap_jwt={jwtToken}"}}
+
+#The owner has snipCount snips in collection 1, 500 in collection 2 and 5 in collection 3, every tenth shared with
+#the friend, and both other users as contacts. The friend has the owner as a contact and shares their snips with them
+async def seed(snipCount: int):
+    now = datetime.now(timezone.utc)
+    password = hashPassword("password")
+
+    async with engine.begin() as connection:
+        await connection.execute(insert(User), [{"userid": userId, "email": f"user{userId}@example.com", "password": password, "firstname": "Jobs", "lastname": "Check", "dataversion": 0, "createdon": now, "lastmodified": now} for userId in (OWNER, FRIEND, OTHER)])
+        await connection.execute(insert(Contact), [{"userid": OWNER, "contactid": FRIEND, "displayname": "Friend"}, {"userid": OWNER, "contactid": OTHER, "displayname": "Other"}, {"userid": FRIEND, "contactid": OWNER, "displayname": "Owner"}])
+        await connection.execute(insert(Collection), [{"collectionid": c, "userid": OWNER, "collectionname": f"Collection {c}", "createdon": now, "lastmodified": now} for c in (1, 2, 3)] + [{"collectionid": 4, "userid": FRIEND, "collectionname": "Friend's", "createdon": now, "lastmodified": now}])
+        content = packSnipContent("print('jobs')")
+        snips = [(OWNER, 1)] * snipCount + [(OWNER, 2)] * 500 + [(OWNER, 3)] * 5 + [(FRIEND, 4)] * FRIEND_SNIPS
+
+        for start in range(0, len(snips), 10000):
+            await connection.execute(insert(Snip), [
+                {"snipid": start + i + 1, "userid": userId, "collectionid": collectionId, "snipname": f"snip {start + i + 1}", "sniplanguage": "python", "snipdescription": "", **content, "createdon": now, "lastmodified": now}
+                for i, (userId, collectionId) in enumerate(snips[start:start + 10000])
+            ])
+
+        shares = [{"snipid": snipId, "userid": OWNER, "contactid": FRIEND} for snipId in range(1, snipCount + 506, SHARE_EVERY)]
+        shares += [{"snipid": snipId, "userid": FRIEND, "contactid": OWNER} for snipId in range(snipCount + 506, snipCount + 506 + FRIEND_SNIPS)]
+
+        for start in range(0, len(shares), 10000):
+            await connection.execute(insert(Shared), shares[start:start + 10000])
+
+async def count(model, *conditions) -> int:
+    async with engine.connect() as connection:
+        return (await connection.execute(select(func.count()).select_from(model).where(*conditions))).scalar()
+
+async def waitForJob(client: httpx.AsyncClient, auth: dict, jobId: int) -> dict:
+    return (await client.get(f"/jobs/{jobId}", headers=auth["headers"])).json()
+
+#Count chunks and time the slowest, by wrapping the registered handlers
+chunkTimes = []
+
+def timeChunks(kind: str):
+    handler = JOB_HANDLERS[kind]
+
+    async def timed(session, job):
+        start = time.perf_counter()
+        result = await handler(session, job)
+        chunkTimes.append(time.perf_counter() - start)
+        return result
+
+    JOB_HANDLERS[kind] = timed
+
+async def checkCollection(client: httpx.AsyncClient, worker: JobWorker, owner: dict):
+    response = await client.delete("/deleteCollection/2", headers=owner["headers"])
+    expect("collection deletion accepted", response.status_code == 202, response.text)
+    job = response.json()
+    again = (await client.delete("/deleteCollection/2", headers=owner["headers"])).json()
+    expect("repeated request returns the queued job", again["jobid"] == job["jobid"])
+    expect("missing collection is a 404", (await client.delete("/deleteCollection/999", headers=owner["headers"])).status_code == 404)
+
+    await worker.runPending()
+    job = await waitForJob(client, owner, job["jobid"])
+    expect("collection job done", job["status"] == DONE, job)
+    expect("collection's snips and shares counted", job["progress"] == 500 + 50 + 1, job["progress"])
+    expect("collection deleted", await count(Collection, Collection.collectionid == 2) == 0)
+    expect("collection's snips deleted", await count(Snip, Snip.collectionid == 2) == 0)
+    expect("collection's snips tombstoned", await count(Tombstone, Tombstone.userid == OWNER, Tombstone.kind == "snips") == 500)
+    expect("other users can't see someone else's job", (await client.get(f"/jobs/{job['jobid']}", headers=authArgs(FRIEND)["headers"])).status_code == 404)
+
+#/batch can only delete empty collections, the snips of others need the /deleteCollection job
+async def checkBatchDeleteCollection(client: httpx.AsyncClient, owner: dict):
+    snips = await count(Snip, Snip.collectionid == 1)
+    response = await client.post("/batch", json={"operations": [{"op": "deleteCollection", "collectionid": 1}]}, headers=owner["headers"])
+    expect("batch refuses to delete a collection with snips", response.status_code == 409 and "isn't empty" in response.text, response.text)
+    expect("refused batch kept the collection and its snips", await count(Collection, Collection.collectionid == 1) == 1 and await count(Snip, Snip.collectionid == 1) == snips)
+
+    created = (await client.post("/batch", json={"operations": [{"op": "createCollection", "collectionname": "Empty"}]}, headers=owner["headers"])).json()[0]["id"]
+    response = await client.post("/batch", json={"operations": [{"op": "deleteCollection", "collectionid": created}]}, headers=owner["headers"])
+    expect("batch deletes an empty collection", response.status_code == 200 and response.json()[0]["applied"], response.text)
+    expect("empty collection deleted", await count(Collection, Collection.collectionid == created) == 0)
+
+async def checkRetries(client: httpx.AsyncClient, worker: JobWorker, owner: dict):
+    logging.getLogger("utils.jobs").setLevel(logging.CRITICAL) #The failures here are on purpose
+    handler = JOB_HANDLERS[DELETE_COLLECTION]
+    calls = []
+
+    async def failOnce(session, job):
+        calls.append(job.jobid)
+
+        if (len(calls) == 1):
+            raise RuntimeError("database went away")
+
+        return await handler(session, job)
+
+    JOB_HANDLERS[DELETE_COLLECTION] = failOnce
+
+    try:
+        job = (await client.delete("/deleteCollection/3", headers=owner["headers"])).json()
+        await worker.runPending()
+        job = await waitForJob(client, owner, job["jobid"])
+        expect("failed chunk retried", job["status"] == DONE and job["attempts"] == 1, job)
+        expect("failure recorded", job["error"] == "database went away", job["error"])
+        expect("retried job finished the collection", await count(Snip, Snip.collectionid == 3) == 0 and await count(Collection, Collection.collectionid == 3) == 0)
+    finally:
+        JOB_HANDLERS[DELETE_COLLECTION] = handler
+
+    @jobHandler("checkAlwaysFails")
+    async def alwaysFails(session, job):
+        raise RuntimeError("always fails")
+
+    async with sessions() as session:
+        jobId = (await enqueueJob(session, OTHER, "checkAlwaysFails", 0)).jobid
+        await session.commit()
+
+    await worker.runPending()
+
+    async with sessions() as session:
+        job = await session.get(Job, jobId)
+        expect("job fails for good after JOB_MAX_ATTEMPTS", job.status == FAILED and job.attempts == 3, (job.status, job.attempts))
+
+async def checkTakeover(worker: JobWorker):
+    async with sessions() as session:
+        job = Job(userid=OWNER, kind=DELETE_COLLECTION, target=999, status=RUNNING, workerid="crashed", leaseduntil=datetime.now(timezone.utc) - timedelta(seconds=1))
+        session.add(job)
+        await session.commit()
+        jobId = job.jobid
+
+    await worker.runPending()
+
+    async with sessions() as session:
+        job = await session.get(Job, jobId)
+        expect("job of a dead worker taken over", job.status == DONE and job.attempts == 1 and job.workerid is None, (job.status, job.attempts, job.workerid))
+
+#A deletion that failed for good doesn't lock the account out
+async def checkFailedAccountJob(client: httpx.AsyncClient):
+    async with sessions() as session:
+        session.add(Job(userid=OTHER, kind=DELETE_ACCOUNT, target=OTHER, status=FAILED, attempts=3, error="always fails"))
+        await session.commit()
+
+    login = await client.post("/login", json={"email": f"user{OTHER}@example.com", "password": "password"})
+    expect("account whose deletion failed can log in", login.status_code == 200, login.status_code)
+
+async def checkAccount(client: httpx.AsyncClient, worker: JobWorker, owner: dict, snipCount: int):
+    timeChunks(DELETE_ACCOUNT)
+    start = time.perf_counter()
+    response = await client.delete("/deleteAccount", headers=owner["headers"])
+    requestTime = time.perf_counter() - start
+    expect("account deletion accepted", response.status_code == 202, response.text)
+    expect("account deletion request is quick", requestTime < 1, f"{requestTime * 1000:.1f} ms")
+    expect("cookies cleared", 'snipsnap_jwt=""' in response.headers.get("set-cookie", ""))
+
+    login = await client.post("/login", json={"email": f"user{OWNER}@example.com", "password": "password"})
+    expect("account being deleted can't log in", login.status_code == 401, login.status_code)
+
+    start = time.perf_counter()
+    await worker.runPending()
+    elapsed = time.perf_counter() - start
+    job = await waitForJob(client, owner, response.json()["jobid"])
+    expect("account job done", job["status"] == DONE, job)
+    print(f"     deleted {snipCount} snips in {elapsed:.1f} s, {len(chunkTimes)} chunks, longest {max(chunkTimes) * 1000:.0f} ms")
+
+    expect("account's rows deleted", all([
+        await count(User, User.userid == OWNER) == 0,
+        await count(Snip, Snip.userid == OWNER) == 0,
+        await count(Collection, Collection.userid == OWNER) == 0,
+        await count(Contact, Contact.userid == OWNER) == 0,
+        await count(Shared, Shared.userid == OWNER) == 0,
+        await count(Tombstone, Tombstone.userid == OWNER) == 0,
+        await count(ShareFeed, ShareFeed.userid == OWNER) == 0
+    ]))
+    expect("others' contacts and shares to the account deleted", await count(Contact, Contact.contactid == OWNER) == 0 and await count(Shared, Shared.contactid == OWNER) == 0)
+    expect("others' snips kept", await count(Snip, Snip.userid == FRIEND) == FRIEND_SNIPS)
+    expect("recipient's shared with me tombstoned", await count(Tombstone, Tombstone.userid == FRIEND, Tombstone.kind == "sharedwithme") == len(range(1, snipCount + 506, SHARE_EVERY)))
+
+    changes = (await client.get("/sync", headers=authArgs(FRIEND)["headers"])).json()
+    expect("recipient's full sync has nothing from the account", changes["sharedwithme"] == [] and changes["contacts"] == [])
+
+async def main(snipCount: int) -> int:
+    async with app.router.lifespan_context(app):
+        await seed(snipCount)
+        owner = authArgs(OWNER)
+        worker = JobWorker()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://jobs", timeout=600) as client:
+            await checkCollection(client, worker, owner)
+            await checkBatchDeleteCollection(client, owner)
+            await checkRetries(client, worker, owner)
+            await checkTakeover(worker)
+            await checkFailedAccountJob(client)
+            await checkAccount(client, worker, owner, snipCount)
+
+    await engine.dispose()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    snipCount = int(sys.argv[sys.argv.index("--snips") + 1]) if "--snips" in sys.argv else 100000
+    sys.exit(asyncio.run(main(snipCount)))
@@ -0,0 +1,116 @@
+import base64
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+#Checks snip list paging and filters through /getSnips and /getCollectionSnips: walking every page by cursor returns
+#each snip once in (lastmodified, snipid) order, ties included, cursors round trip, bad cursors and limits are
+#rejected, and the language and name prefix filters hold, with % and _ in a prefix matched literally.
+#Run with: python -m checks.pagination
+#Uses a temporary sqlite file, never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/pagination.db"
+os.environ["JOB_WORKER"] = "false"
+os.environ.setdefault("JWT_SECRET", "pagination-check-secret-0123456789abcdef0123456789")
+
+import asyncio
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from config import SNIP_PAGE_MAX, engine
+from main import app
+from models.db_models import Collection, Snip
+from utils.pagination import decodeCursor, encodeCursor
+from utils.security import issueTokens
+from utils.snip_content import packSnipContent
+
+OWNER = 1
+SNIPS = 40
+TIED = 6 #Snips sharing one lastmodified, so only snipid orders them
+PREFIXED = ["100%_done", "100%xdone", "100x_done", "a_b", "axb", "a%b"] #Names that look like LIKE wildcards
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+#SNIPS snips over two collections, every third in sql, the first TIED modified at the same moment, the last few
+#named like wildcards. Returns every snip as (lastmodified, snipid, name, language, collection)
+async def seed() -> list:
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    snips = []
+
+    for snipId in range(1, SNIPS + 1):
+        name = PREFIXED[snipId - SNIPS + len(PREFIXED) - 1] if snipId > SNIPS - len(PREFIXED) else f"snip {snipId}"
+        lastmodified = now if snipId <= TIED else now - timedelta(minutes=snipId)
+        snips.append((lastmodified, snipId, name, "sql" if snipId % 3 == 0 else "python", 1 + snipId % 2))
+
+    async with engine.begin() as connection:
+        await connection.execute(insert(Collection), [{"collectionid": c, "userid": OWNER, "collectionname": f"Collection {c}", "createdon": now, "lastmodified": now} for c in (1, 2)])
+        await connection.execute(insert(Snip), [
+            {"snipid": snipId, "userid": OWNER, "collectionid": collectionId, "snipname": name, "sniplanguage": language, "snipdescription": "", **packSnipContent("x"), "createdon": now, "lastmodified": lastmodified}
+            for lastmodified, snipId, name, language, collectionId in snips
+        ])
+
+    return sorted(snips, reverse=True)
+
+def main() -> int:
+    with TestClient(app) as client:
+        client.post("/createUser", json={"email": "pages@example.com", "password": "password", "firstname": "Pagination", "lastname": "Check"})
+        csrf, jwtToken = issueTokens(OWNER, "pages@example.com", datetime.now(timezone.utc) + timedelta(hours=1))
+        client.cookies.update({"snipsnap_jwt": jwtToken})
+        headers = {"snipsnap_csrf": csrf}
+        snips = asyncio.run(seed())
+
+        #Snip ids of every page of url, following X-Next-Cursor. Also returns how many pages it took
+        def walk(url: str, **params) -> tuple:
+            ids, pages, cursor = [], 0, None
+
+            while (True):
+                response = client.get(url, params={**params, **({"cursor": cursor} if cursor else {})}, headers=headers)
+
+                if (response.status_code != 200):
+                    raise RuntimeError(f"{url} returned {response.status_code}: {response.text}")
+
+                ids.extend(snip["snipid"] for snip in response.json())
+                pages += 1
+                cursor = response.headers.get("X-Next-Cursor")
+
+                if (cursor is None):
+                    return ids, pages
+
+        ids, pages = walk("/getSnips", limit=7)
+        expect("pages cover every snip once, newest first", ids == [snip[1] for snip in snips], ids)
+        expect("last page has no next cursor", pages == -(-SNIPS // 7), pages)
+        ids, pages = walk("/getSnips", limit=SNIPS)
+        expect("exactly one full page has no next cursor", pages == 1 and len(ids) == SNIPS, (pages, len(ids)))
+        ids, _ = walk("/getSnips", limit=4)
+        expect("snips with the same lastmodified split across pages by snipid", ids[:TIED] == list(range(TIED, 0, -1)), ids[:TIED])
+
+        lastmodified, snipId = snips[9][:2]
+        expect("cursor round trips", decodeCursor(encodeCursor(lastmodified, snipId)) == (lastmodified, snipId))
+        after = client.get("/getSnips", params={"cursor": encodeCursor(lastmodified, snipId), "limit": 3}, headers=headers).json()
+        expect("cursor continues after its snip", [snip["snipid"] for snip in after] == [snip[1] for snip in snips[10:13]], after)
+
+        for name, cursor in (("garbage", "not a cursor"), ("wrong shape", base64.urlsafe_b64encode(b'{"a": 1}').decode('utf-8')), ("bad date", base64.urlsafe_b64encode(b'["yesterday", 1]').decode('utf-8'))):
+            response = client.get("/getSnips", params={"cursor": cursor}, headers=headers)
+            expect(f"invalid cursor ({name}) is a 400", response.status_code == 400, response.status_code)
+
+        for limit in (0, SNIP_PAGE_MAX + 1):
+            expect(f"limit {limit} rejected", client.get("/getSnips", params={"limit": limit}, headers=headers).status_code == 422)
+
+        ids, _ = walk("/getSnips", limit=5, sniplanguage="sql")
+        expect("language filter across pages", ids == [snip[1] for snip in snips if snip[3] == "sql"], ids)
+        ids, _ = walk("/getCollectionSnips/2", limit=5, sniplanguage="python")
+        expect("collection and language filters together", ids == [snip[1] for snip in snips if snip[4] == 2 and snip[3] == "python"], ids)
+
+        for prefix, expected in (("100%", ["100%_done", "100%xdone"]), ("100%_", ["100%_done"]), ("a_", ["a_b"]), ("a%", ["a%b"]), ("snip 1", [f"snip {i}" for i in range(1, 20) if str(i).startswith("1")])):
+            names = [snip["snipname"] for snip in client.get("/getSnips", params={"nameprefix": prefix, "limit": SNIPS}, headers=headers).json()]
+            expect(f"prefix {prefix!r} matches literally", sorted(names) == sorted(expected), names)
+
+    asyncio.run(engine.dispose())
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
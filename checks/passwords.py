@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+#Checks the bcrypt pool with each PASSWORD_POOL (thread and process): work past the workers waits, past
+#PASSWORD_MAX_QUEUE waiting callers it's shed with a 503, /login included, and logging in with a hash made at an older
+#cost upgrades the stored hash to BCRYPT_ROUNDS. Runs at low costs so it's quick. Run with: python -m checks.passwords
+#Uses a temporary sqlite file, never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/passwords.db"
+os.environ["JOB_WORKER"] = "false"
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["PASSWORD_POOL_WORKERS"] = "1"
+os.environ["PASSWORD_MAX_QUEUE"] = "2"
+os.environ.setdefault("JWT_SECRET", "passwords-check-secret-0123456789abcdef0123456789")
+
+import httpx
+from fastapi import HTTPException
+from sqlmodel import select
+from config import engine, sessions
+from main import app
+from models.db_models import User
+import utils.security as security
+
+HOLD_SECONDS = 0.5 #How long each stand-in task keeps the only worker busy
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+async def storedHash(email: str) -> str:
+    async with sessions() as session:
+        return (await session.exec(select(User.password).where(User.email == email))).one()
+
+#Fill the one worker and the queue with tasks that just sleep (picklable, so they run in the process pool too), then
+#one more task and a login are turned away while they wait
+async def checkShedding(client: httpx.AsyncClient, mode: str, email: str):
+    rejected = security.passwordPoolStats["rejected"]
+    held = [asyncio.create_task(security._runPasswordTask(time.sleep, HOLD_SECONDS)) for _ in range(1 + security.PASSWORD_MAX_QUEUE)]
+
+    while (security.passwordPoolStats["running"] < 1 or security.passwordPoolStats["queued"] < security.PASSWORD_MAX_QUEUE):
+        await asyncio.sleep(0.01)
+
+    try:
+        await security._runPasswordTask(time.sleep, 0)
+        expect(f"{mode}: task past the queue shed", False)
+    except HTTPException as e:
+        expect(f"{mode}: task past the queue shed", e.status_code == 503, e.status_code)
+
+    response = await client.post("/login", json={"email": email, "password": "password"})
+    expect(f"{mode}: login while the queue is full gets a 503", response.status_code == 503, response.status_code)
+    expect(f"{mode}: rejections counted", security.passwordPoolStats["rejected"] == rejected + 2, security.passwordPoolStats)
+
+    results = await asyncio.gather(*held, return_exceptions=True)
+    expect(f"{mode}: queued tasks all ran", all(result is None for result in results), results)
+    expect(f"{mode}: pool idle again", security.passwordPoolStats["running"] == 0 and security.passwordPoolStats["queued"] == 0, security.passwordPoolStats)
+    response = await client.post("/login", json={"email": email, "password": "password"})
+    expect(f"{mode}: login works once the queue drains", response.status_code == 200, response.status_code)
+
+#A hash from before BCRYPT_ROUNDS went up is replaced on the next login
+async def checkRehash(client: httpx.AsyncClient, mode: str, email: str):
+    oldCost = security.BCRYPT_ROUNDS
+    before = await storedHash(email)
+    expect(f"{mode}: hash stored at the old cost", before.startswith(f"$2b${oldCost:02d}$"), before[:7])
+
+    security.BCRYPT_ROUNDS = oldCost + 1
+    security.shutdownPasswordPool() #Process workers copy the module when they start, so start new ones
+
+    try:
+        response = await client.post("/login", json={"email": email, "password": "password"})
+        after = await storedHash(email)
+        expect(f"{mode}: login with an old cost hash succeeds", response.status_code == 200, response.status_code)
+        expect(f"{mode}: stored hash upgraded to the new cost", after.startswith(f"$2b${oldCost + 1:02d}$") and after != before, after[:7])
+        expect(f"{mode}: upgraded hash still checks", (await client.post("/login", json={"email": email, "password": "password"})).status_code == 200)
+        expect(f"{mode}: a wrong password still fails", (await client.post("/login", json={"email": email, "password": "wrong"})).status_code == 401)
+    finally:
+        security.BCRYPT_ROUNDS = oldCost
+        security.shutdownPasswordPool()
+
+async def main() -> int:
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://passwords", timeout=60) as client:
+            for mode in ("thread", "process"):
+                security.PASSWORD_POOL = mode
+                security.shutdownPasswordPool()
+                email = f"{mode}@example.com"
+                response = await client.post("/createUser", json={"email": email, "password": "password", "firstname": "Password", "lastname": "Check"})
+                expect(f"{mode}: user created through the pool", response.status_code == 200, response.text)
+                expect(f"{mode}: pool is a {mode} pool", type(security._getPasswordExecutor()).__name__.lower().startswith(mode))
+
+                await checkShedding(client, mode, email)
+                await checkRehash(client, mode, email)
+
+    await engine.dispose()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
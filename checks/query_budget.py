@@ -0,0 +1,170 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+#Runs every endpoint against a scratch database seeded with a collection of many shared snips and fails if any
+#endpoint sends more statements than its budget. Budgets do not depend on library size, so an N+1 relationship
+#load blows straight through them. Run with: python -m checks.query_budget
+#Uses QUERY_BUDGET_DATABASE_URL if set, otherwise a temporary sqlite file. Never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = os.getenv("QUERY_BUDGET_DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/query_budget.db")
+os.environ.setdefault("JWT_SECRET", "query-budget-check-secret-0123456789abcdef")
+os.environ["JOB_WORKER"] = "false" #Queued deletions stay queued, so background chunks never count against a request
+
+from fastapi.testclient import TestClient
+from config import engine
+from main import app
+from utils.query_counter import countStatements
+from utils.security import issueTokens
+
+SEED_SNIPS = 40 #Enough that one query per snip can't hide inside a budget
+
+#Most statements each endpoint may send, whatever the size of the library
+QUERY_BUDGETS = {
+    "createUser": 2,
+    "login": 1,
+    "createContact": 4,
+    "createCollection": 3,
+    "createSnip": 5, #Sharing it bumps the recipients' share feeds and stamps the shares for /sync
+    "getSnips": 2,
+    "getSnips (not modified)": 1,
+    "getSnips (cached)": 1,
+    "getSharedWithMe": 1,
+    "getCollectionSnips": 1,
+    "getCollections": 2,
+    "searchSnips": 2, #The first search on postgres also looks up whether pg_trgm is installed
+    "getSettings": 3,
+    "getSnipInit": 3,
+    "getSnipDetails": 6,
+    "getSnipDetails (shared)": 7,
+    "getSnipDetails (not modified)": 1,
+    "editSnip": 8, #Changing the body also records a revision, see utils/revisions.py
+    "editSnip (sharing changed)": 11,
+    "getSnipRevisions": 1,
+    "getSnipRevision": 1,
+    "editCollectionName": 2,
+    "saveUserInfo": 2,
+    "batch": 19,
+    "deleteSnip": 6,
+    "deleteContact": 2,
+    "deleteCollection": 3, #Queues a background job, see utils/deletion.py
+    "deleteAccount": 2,
+    "jobs": 1,
+    "sync": 5,
+    "sync (no changes)": 1,
+    "sync (changes)": 6,
+}
+
+BATCH_CREATES = 3 + SEED_SNIPS #Rows the checked /batch call creates
+
+#SQLite can't hand back generated ids in insert order from one multi-row INSERT, so SQLAlchemy sends an INSERT per
+#created row there. Postgres gets them from a single statement
+if (engine.dialect.name == "sqlite"):
+    QUERY_BUDGETS["batch"] += BATCH_CREATES - 2
+
+def authArgs(userId: int, email: str) -> dict:
+    csrf, jwtToken = issueTokens(userId, email, datetime.now(timezone.utc) + timedelta(hours=1))
+    return {"headers": {"snipsnap_csrf": csrf}, "cookies": {"snipsnap_jwt": jwtToken}}
+
+def main() -> int:
+    worst = {} #name -> most statements seen and the statements sent that time
+
+    with TestClient(app) as client:
+        def call(name: str, method: str, url: str, auth: dict = None, **kwargs):
+            client.cookies.clear()
+
+            if (auth is not None):
+                client.cookies.update(auth["cookies"])
+                kwargs["headers"] = {**kwargs.get("headers", {}), **auth["headers"]}
+
+            with countStatements(engine) as counter:
+                response = client.request(method, url, **kwargs)
+
+            if (response.status_code >= 400):
+                raise RuntimeError(f"{name} returned {response.status_code}: {response.text}")
+
+            if (counter.count > worst.get(name, (-1, []))[0]):
+                worst[name] = (counter.count, counter.statements)
+
+            return response
+
+        now = datetime.now(timezone.utc).isoformat()
+
+        for email in ("owner@example.com", "friend@example.com", "other@example.com"):
+            call("createUser", "POST", "/createUser", json={"email": email, "password": "password", "firstname": "Query", "lastname": "Budget"})
+
+        call("login", "POST", "/login", json={"email": "owner@example.com", "password": "password"})
+        owner = authArgs(1, "owner@example.com")
+        friend = authArgs(2, "friend@example.com")
+
+        call("createContact", "POST", "/createContact", owner, json={"email": "friend@example.com", "displayname": "Friend"})
+        call("createContact", "POST", "/createContact", owner, json={"email": "other@example.com", "displayname": "Other"})
+        collectionId = call("createCollection", "POST", "/createCollection/Budget", owner).json()
+        snip = {
+            "snipid": 0,
+            "snipname": "budget",
+            "sniplanguage": "python",
+            "snipdescription": "query budget",
+            "snipcontent": "print('hello')",
+            "collectionid": collectionId,
+            "lastmodified": now,
+            "sharedwith": [2]
+        }
+
+        for _ in range(SEED_SNIPS):
+            call("createSnip", "POST", "/createSnip", owner, json=snip)
+
+        ownerToken = call("sync", "GET", "/sync", owner).json()["token"]
+        friendToken = call("sync", "GET", "/sync", friend).json()["token"]
+        call("sync (no changes)", "GET", f"/sync?since={ownerToken}", owner)
+        etag = call("getSnips", "GET", "/getSnips", owner).headers["ETag"]
+        call("getSnips (not modified)", "GET", "/getSnips", owner, headers={"If-None-Match": etag})
+        call("getSnips (cached)", "GET", "/getSnips", owner)
+        call("getSharedWithMe", "GET", "/getSharedWithMe", friend)
+        call("getCollectionSnips", "GET", f"/getCollectionSnips/{collectionId}", owner)
+        call("getCollections", "GET", "/getCollections", owner)
+        call("searchSnips", "GET", "/searchSnips?q=budget", owner)
+        call("searchSnips", "GET", "/searchSnips?q=budget", friend)
+        call("getSettings", "GET", "/getSettings", owner)
+        call("getSnipInit", "GET", "/getSnipInit", owner)
+        etag = call("getSnipDetails", "GET", "/getSnipDetails/1", owner).headers["ETag"]
+        call("getSnipDetails (not modified)", "GET", "/getSnipDetails/1", owner, headers={"If-None-Match": etag})
+        call("getSnipDetails (shared)", "GET", "/getSnipDetails/1", friend)
+        call("editSnip", "PATCH", "/editSnip", owner, json={**snip, "snipid": 1, "snipname": "edited"})
+        call("editSnip", "PATCH", "/editSnip", owner, json={**snip, "snipid": 1, "snipname": "edited", "snipcontent": "print('edited')"})
+        call("editSnip (sharing changed)", "PATCH", "/editSnip", owner, json={**snip, "snipid": 1, "sharedwith": [3]})
+        call("getSnipRevisions", "GET", "/getSnipRevisions/1", owner)
+        call("getSnipRevision", "GET", "/getSnipRevision/1/2", owner)
+        call("editCollectionName", "PATCH", "/editCollectionName", owner, json={"collectionid": collectionId, "collectionname": "Renamed", "lastmodified": now})
+        call("saveUserInfo", "PATCH", "/saveUserInfo", owner, json={"email": "owner@example.com", "firstname": "Query", "lastname": "Budget", "lastmodified": now})
+        call("batch", "POST", "/batch", owner, json={"operations": [
+            *({"op": "createCollection", "collectionname": f"Batch {i}"} for i in range(BATCH_CREATES - SEED_SNIPS)),
+            *({"op": "createSnip", "snip": {**snip, "sharedwith": [2, 3]}} for _ in range(SEED_SNIPS)),
+            *({"op": "editSnip", "snip": {**snip, "snipid": snipId, "sharedwith": [3]}} for snipId in range(3, SEED_SNIPS)),
+            *({"op": "deleteSnip", "snipid": snipId} for snipId in range(SEED_SNIPS - 5, SEED_SNIPS)),
+            {"op": "editCollectionName", "collection": {"collectionid": collectionId, "collectionname": "Batched", "lastmodified": now}}
+        ]})
+        call("deleteSnip", "DELETE", "/deleteSnip/2", owner)
+        call("deleteContact", "DELETE", "/deleteContact/2", friend)
+        job = call("deleteCollection", "DELETE", f"/deleteCollection/{collectionId}", owner).json()
+        call("jobs", "GET", f"/jobs/{job['jobid']}", owner)
+        call("sync (changes)", "GET", f"/sync?since={ownerToken}", owner)
+        call("sync (changes)", "GET", f"/sync?since={friendToken}", friend)
+        call("deleteAccount", "DELETE", "/deleteAccount", friend)
+
+    failures = []
+
+    for name, budget in QUERY_BUDGETS.items():
+        count, statements = worst[name]
+        print(f"{'FAIL' if count > budget else 'ok  '} {name}: {count} statements (budget {budget})")
+
+        if (count > budget):
+            failures.append(name)
+
+            for statement in statements:
+                print("       " + " ".join(statement.split())[:160])
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
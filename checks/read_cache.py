@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+#Checks the read cache with each backend, the in process one and the redis one against a local stand-in
+#(checks/fake_redis.py): reads are served from the cache, writes drop exactly the resources they change, for the writer
+#and for the contacts a snip is shared with, every drop bumps that key's generation, and a read that loaded before a
+#write can't store what it loaded. Run with: python -m checks.read_cache
+#Uses a temporary sqlite file, never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/read_cache.db"
+os.environ["JOB_WORKER"] = "false"
+os.environ.setdefault("JWT_SECRET", "read-cache-check-secret-0123456789abcdef0123456789")
+
+from fastapi.testclient import TestClient
+from checks.fake_redis import FakeRedis
+from config import READ_CACHE_SIZE, READ_CACHE_TTL
+from main import app
+from utils.query_counter import countStatements
+from utils.read_cache import COLLECTIONS, SHARED_WITH_ME, SNIPS, MemoryCacheBackend, RedisCacheBackend, _cacheKey, setReadCacheBackend
+from utils.security import issueTokens
+import config
+
+OWNER, FRIEND = 1, 2
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+def authArgs(userId: int, email: str) -> dict:
+    csrf, jwtToken = issueTokens(userId, email, datetime.now(timezone.utc) + timedelta(hours=1))
+    return {"headers": {"snipsnap_csrf": csrf}, "cookies": {"snipsnap_jwt": jwtToken}}
+
+#Whether anything is cached under the key, and its generation. Both backends behind the same questions
+def cached(backend, userid: int, resource: str) -> bool:
+    key = _cacheKey(userid, resource)
+    return key in backend.entries if isinstance(backend, MemoryCacheBackend) else key in backend.client.hashes
+
+def generation(backend, userid: int, resource: str) -> int:
+    key = _cacheKey(userid, resource)
+
+    if (isinstance(backend, MemoryCacheBackend)):
+        return backend.invalidated.get(key, backend.invalidatedBefore)
+
+    return int(backend.client.values.get(f"{key}:gen", b"0"))
+
+def checkBackend(name: str, backend, client: TestClient, call, owner: dict, friend: dict, collectionId: int, snipId: int, snip: dict):
+    setReadCacheBackend(backend)
+    first = call("GET", "/getSharedWithMe", friend).json()
+
+    with countStatements(config.engine) as counter:
+        again = call("GET", "/getSharedWithMe", friend).json()
+
+    expect(f"{name}: repeated read served from the cache", again == first and counter.count == 0, counter.count)
+    call("GET", "/getSnips", owner)
+    call("GET", "/getCollections", owner)
+    expect(f"{name}: reads cached", all(cached(backend, *entry) for entry in ((FRIEND, SHARED_WITH_ME), (OWNER, SNIPS), (OWNER, COLLECTIONS))))
+
+    generations = {entry: generation(backend, *entry) for entry in ((FRIEND, SHARED_WITH_ME), (OWNER, SNIPS), (OWNER, COLLECTIONS))}
+    renamed = f"edited through {name}"
+    call("PATCH", "/editSnip", owner, json={**snip, "snipid": snipId, "snipname": renamed, "collectionid": collectionId, "lastmodified": datetime.now(timezone.utc).isoformat()})
+
+    expect(f"{name}: owner's edit drops the contact's shared with me", not cached(backend, FRIEND, SHARED_WITH_ME))
+    expect(f"{name}: owner's edit drops the owner's snips", not cached(backend, OWNER, SNIPS))
+    expect(f"{name}: resources the edit didn't touch stay cached", cached(backend, OWNER, COLLECTIONS))
+    expect(f"{name}: dropped resources' generations bumped", generation(backend, FRIEND, SHARED_WITH_ME) > generations[(FRIEND, SHARED_WITH_ME)] and generation(backend, OWNER, SNIPS) > generations[(OWNER, SNIPS)])
+    expect(f"{name}: untouched resource's generation kept", generation(backend, OWNER, COLLECTIONS) == generations[(OWNER, COLLECTIONS)])
+    expect(f"{name}: contact reads the edit", [row["snipname"] for row in call("GET", "/getSharedWithMe", friend).json()] == [renamed])
+
+    async def race():
+        key = _cacheKey(FRIEND, SHARED_WITH_ME)
+        started = await backend.getGeneration(key)
+        await backend.delete([key])
+        await backend.set(key, "race", ["stale"], started)
+        return await backend.get(key, "race")
+
+    expect(f"{name}: a read that started before a write doesn't store", asyncio.run(race()) is None)
+
+def main() -> int:
+    with TestClient(app) as client:
+        def call(method: str, url: str, auth: dict, **kwargs):
+            client.cookies.clear()
+            client.cookies.update(auth["cookies"])
+            response = client.request(method, url, headers=auth["headers"], **kwargs)
+
+            if (response.status_code >= 400):
+                raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.text}")
+
+            return response
+
+        for email in ("owner@example.com", "friend@example.com"):
+            client.post("/createUser", json={"email": email, "password": "password", "firstname": "Cache", "lastname": "Check"})
+
+        owner = authArgs(OWNER, "owner@example.com")
+        friend = authArgs(FRIEND, "friend@example.com")
+        call("POST", "/createContact", owner, json={"email": "friend@example.com", "displayname": "Friend"})
+        collectionId = call("POST", "/createCollection/Cached", owner).json()
+        snip = {"snipid": 0, "snipname": "cached", "sniplanguage": "python", "snipdescription": "", "snipcontent": "x", "collectionid": collectionId, "lastmodified": datetime.now(timezone.utc).isoformat(), "sharedwith": [FRIEND]}
+        snipId = call("POST", "/createSnip", owner, json=snip).json()
+
+        try:
+            checkBackend("memory", MemoryCacheBackend(READ_CACHE_SIZE, READ_CACHE_TTL), client, call, owner, friend, collectionId, snipId, snip)
+            checkBackend("redis", RedisCacheBackend(FakeRedis(), READ_CACHE_TTL), client, call, owner, friend, collectionId, snipId, snip)
+        finally:
+            setReadCacheBackend(None)
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
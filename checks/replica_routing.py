@@ -0,0 +1,174 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#Checks read replica routing with three sqlite files standing in for a primary and two replicas. Each replica holds a
+#snip the others don't, so the snip a read returns shows which database served it. Covers round robin, least
+#connections, writes staying on the primary and read-your-writes stickiness, for the writer and for a contact whose
+#cached shared with me list the writer's edit dropped, read back through the read cache while the replicas lag.
+#Run with: python -m checks.replica_routing
+#Always uses temporary files, never the configured databases
+STICKY_SECONDS = 1
+_directory = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_directory}/primary.db"
+os.environ["DATABASE_REPLICA_URLS"] = f"sqlite+aiosqlite:///{_directory}/replica0.db,sqlite+aiosqlite:///{_directory}/replica1.db"
+os.environ["REPLICA_SELECTION"] = "round_robin"
+os.environ["READ_YOUR_WRITES_SECONDS"] = str(STICKY_SECONDS)
+os.environ["READ_CACHE_BACKEND"] = "none" #Cached pages would hide which database answered
+os.environ.setdefault("JWT_SECRET", "replica-routing-check-secret-0123456789abcdef")
+
+from fastapi.testclient import TestClient
+from sqlmodel import delete, insert, select
+from config import engine, readRouter, replicaEngines, sessions
+from main import app
+from migrations.migrate import runMigrations
+from config import READ_CACHE_SIZE, READ_CACHE_TTL
+from models.db_models import Collection, Shared, Snip, User
+from utils.db_routing import LEAST_CONNECTIONS, ReplicaRouter
+from utils.read_cache import MemoryCacheBackend, setReadCacheBackend
+from utils.security import issueTokens
+
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+def authArgs(userId: int, email: str) -> dict:
+    csrf, jwtToken = issueTokens(userId, email, datetime.now(timezone.utc) + timedelta(hours=1))
+    return {"headers": {"snipsnap_csrf": csrf}, "cookies": {"snipsnap_jwt": jwtToken}}
+
+def snipRow(userId: int, name: str) -> dict:
+    now = datetime.now(timezone.utc)
+    return {"userid": userId, "collectionid": 1, "snipname": name, "sniplanguage": "python", "snipdescription": "", "snipcontent": "", "createdon": now, "lastmodified": now}
+
+#Stand in for replication: the replicas get the schema, both users and a snip of their own
+async def prepareReplicas():
+    for i, replica in enumerate(replicaEngines):
+        async with replica.begin() as connection:
+            await connection.run_sync(runMigrations)
+
+            for userId in (1, 2):
+                await connection.execute(insert(User).values(userid=userId, email=f"user{userId}@example.com", password="x", firstname="Replica", lastname="Check"))
+                await connection.execute(insert(Collection).values(collectionid=userId, userid=userId, collectionname="replicated"))
+                await connection.execute(insert(Snip).values(**snipRow(userId, f"replica{i}")))
+
+#Stand in for replication catching up with the primary's snip named name and its shares. The primary's row replaces
+#whatever the replica held under that id
+async def replicateSnip(name: str):
+    async with engine.connect() as connection:
+        snip = (await connection.execute(select(Snip.__table__).where(Snip.snipname == name))).mappings().one()
+        shares = (await connection.execute(select(Shared.__table__).where(Shared.snipid == snip["snipid"]))).mappings().all()
+
+    for replica in replicaEngines:
+        async with replica.begin() as connection:
+            await connection.execute(delete(Snip.__table__).where(Snip.snipid == snip["snipid"]))
+            await connection.execute(insert(Snip.__table__).values(**snip))
+            await connection.execute(insert(Shared.__table__), [dict(share) for share in shares])
+
+async def countSnips(target, name: str) -> int:
+    async with target.connect() as connection:
+        return len((await connection.execute(select(Snip.snipid).where(Snip.snipname == name))).all())
+
+async def checkLeastConnections():
+    router = ReplicaRouter(sessions, replicaEngines, LEAST_CONNECTIONS, STICKY_SECONDS)
+    held = await replicaEngines[0].connect()
+
+    try:
+        picks = [router.sessionsFor(1).kw["bind"] for _ in range(4)]
+        expect("least connections avoids the busy replica", all(pick is replicaEngines[1] for pick in picks))
+    finally:
+        await held.close()
+
+    picks = {router.sessionsFor(1).kw["bind"] for _ in range(4)}
+    expect("least connections takes turns on a tie", picks == set(replicaEngines))
+
+async def disposeEngines():
+    for disposed in (engine, *replicaEngines):
+        await disposed.dispose()
+
+def main() -> int:
+    with TestClient(app) as client:
+        def get(auth: dict) -> list:
+            client.cookies.clear()
+            client.cookies.update(auth["cookies"])
+            response = client.get("/getSnips", headers=auth["headers"])
+            return [snip["snipname"] for snip in response.json()] if response.status_code == 200 else [f"status {response.status_code}"]
+
+        for email in ("user1@example.com", "user2@example.com"):
+            client.post("/createUser", json={"email": email, "password": "password", "firstname": "Replica", "lastname": "Check"})
+
+        owner = authArgs(1, "user1@example.com")
+        other = authArgs(2, "user2@example.com")
+        client.cookies.update(owner["cookies"])
+        client.post("/createCollection/primary", headers=owner["headers"])
+        asyncio.run(prepareReplicas())
+        time.sleep(STICKY_SECONDS + 0.2) #Creating the collection was a write
+
+        served = [get(owner) for _ in range(4)]
+        expect("reads go to the replicas in turn", served == [["replica0"], ["replica1"], ["replica0"], ["replica1"]], served)
+
+        client.cookies.update(owner["cookies"])
+        response = client.post("/createSnip", headers=owner["headers"], json={
+            "snipid": 0, "snipname": "primary", "sniplanguage": "python", "snipdescription": "", "snipcontent": "",
+            "collectionid": 1, "lastmodified": datetime.now(timezone.utc).isoformat(), "sharedwith": []
+        })
+        expect("write succeeds", response.status_code == 200, response.text)
+        expect("write went to the primary", asyncio.run(countSnips(engine, "primary")) == 1)
+        expect("write didn't touch the replicas", all(asyncio.run(countSnips(replica, "primary")) == 0 for replica in replicaEngines))
+
+        served = [get(owner) for _ in range(2)]
+        expect("writer reads from the primary right after writing", served == [["primary"], ["primary"]], served)
+        expect("other users still read from replicas", get(other)[0].startswith("replica"))
+
+        time.sleep(STICKY_SECONDS + 0.2)
+        expect("writer is back on the replicas after the window", get(owner)[0].startswith("replica"))
+
+        #A contact's cached list dropped by someone else's write. The replicas never see the edit, like replicas lagging
+        #behind for longer than the check runs
+        setReadCacheBackend(MemoryCacheBackend(READ_CACHE_SIZE, READ_CACHE_TTL))
+
+        def sharedWithMe(auth: dict) -> list:
+            client.cookies.clear()
+            client.cookies.update(auth["cookies"])
+            return [snip["snipname"] for snip in client.get("/getSharedWithMe", headers=auth["headers"]).json()]
+
+        def call(method: str, url: str, auth: dict, **kwargs):
+            client.cookies.clear()
+            client.cookies.update(auth["cookies"])
+            response = client.request(method, url, headers=auth["headers"], **kwargs)
+
+            if (response.status_code >= 400):
+                raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.text}")
+
+            return response
+
+        try:
+            call("POST", "/createContact", owner, json={"email": "user2@example.com", "displayname": "Other"})
+            shared = {"snipid": 0, "snipname": "shared", "sniplanguage": "python", "snipdescription": "", "snipcontent": "", "collectionid": 1, "lastmodified": datetime.now(timezone.utc).isoformat(), "sharedwith": [2]}
+            shared["snipid"] = call("POST", "/createSnip", owner, json=shared).json()
+            asyncio.run(replicateSnip("shared"))
+            time.sleep(STICKY_SECONDS + 0.2)
+            expect("contact's list read from a replica and cached", sharedWithMe(other) == ["shared"])
+
+            call("PATCH", "/editSnip", owner, json={**shared, "snipname": "edited", "lastmodified": datetime.now(timezone.utc).isoformat()})
+            before = dict(readRouter.stats)
+            expect("contact refetching after the edit reads it from the primary", sharedWithMe(other) == ["edited"])
+            expect("contact's refetch was sticky", readRouter.stats["sticky"] == before["sticky"] + 1, readRouter.stats)
+
+            time.sleep(STICKY_SECONDS + 0.2)
+            expect("contact's cached list has the edit once back on the lagging replicas", sharedWithMe(other) == ["edited"])
+        finally:
+            setReadCacheBackend(None)
+
+    asyncio.run(checkLeastConnections())
+    asyncio.run(disposeEngines())
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+#Checks snip revision history: deltas rebuild the body they were made from, edits record revisions through /editSnip
+#and /batch, snapshots keep delta chains bounded, revisions are private to the snip's owner and go with the snip, and
+#the migration adds history to an existing database. Run with: python -m checks.revisions
+#Uses REVISIONS_CHECK_DATABASE_URL if set, otherwise a temporary sqlite file. Never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = os.getenv("REVISIONS_CHECK_DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/revisions.db")
+os.environ["SNIP_REVISION_MAX_CHAIN"] = "5" #Short, so the check sees several snapshots
+os.environ.setdefault("JWT_SECRET", "revisions-check-secret-0123456789abcdef0123456789")
+
+import httpx
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from config import engine
+from main import app
+from migrations.helpers import columnExists
+from migrations.migrate import runMigrations
+from models.db_models import Collection, Snip, SnipRevision, User
+from utils.revisions import DELTA, SNAPSHOT, applyDelta, makeDelta
+from utils.security import issueTokens
+from utils.snip_content import packSnipContent
+
+OWNER, OTHER = 1, 2
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+def authArgs(userId: int) -> dict:
+    csrf, jwtToken = issueTokens(userId, f"user{userId}@example.com", datetime.now(timezone.utc) + timedelta(hours=1))
+    return {"headers": {"snipsnap_csrf": csrf, "Cookie": f"snipsnap_jwt={jwtToken}"}}
+
+#Random edits to random text, from one character to most of it, in one place or spread out
+def checkDeltas():
+    generator = random.Random(25)
+    lines = [f"line {i} {'x' * generator.randrange(80)}\n" for i in range(400)]
+    mismatches = 0
+
+    for _ in range(500):
+        old = "".join(generator.sample(lines, generator.randrange(1, len(lines))))
+        new = list(old)
+
+        for _ in range(generator.randrange(1, 20)):
+            at = generator.randrange(len(new) + 1)
+            new[at:at + generator.randrange(300)] = generator.choice(lines) * generator.randrange(3)
+
+        new = "".join(new)
+
+        if (applyDelta(old, makeDelta(old, new)) != new):
+            mismatches += 1
+
+    expect("deltas rebuild what they were made from", mismatches == 0, f"{mismatches} of 500")
+    expect("unchanged body is one copy", makeDelta("same", "same") == [4])
+
+    try:
+        applyDelta("short", makeDelta("longer text", "longer texts"))
+        expect("delta applied to the wrong body is refused", False)
+    except ValueError:
+        expect("delta applied to the wrong body is refused", True)
+
+async def seed():
+    now = datetime.now(timezone.utc) - timedelta(days=1)
+
+    async with engine.begin() as connection:
+        await connection.execute(insert(User), [{"userid": userId, "email": f"user{userId}@example.com", "password": "x", "firstname": "Revisions", "lastname": "Check", "dataversion": 0, "createdon": now, "lastmodified": now} for userId in (OWNER, OTHER)])
+        await connection.execute(insert(Collection), [{"collectionid": 1, "userid": OWNER, "collectionname": "Revised", "createdon": now, "lastmodified": now}])
+        await connection.execute(insert(Snip), [
+            {"snipid": snipId, "userid": OWNER, "collectionid": 1, "snipname": f"snip {snipId}", "sniplanguage": "python", "snipdescription": "", **packSnipContent(f"original {snipId}\n" * 50), "createdon": now, "lastmodified": now}
+            for snipId in (1, 2, 3)
+        ])
+
+async def revisionRows(snipId: int) -> list:
+    async with engine.connect() as connection:
+        return (await connection.execute(select(SnipRevision.revision, SnipRevision.kind, SnipRevision.chainlength).where(SnipRevision.snipid == snipId).order_by(SnipRevision.revision))).all()
+
+def snipJson(snipId: int, content: str, **changes) -> dict:
+    return {"snipid": snipId, "snipname": f"snip {snipId}", "sniplanguage": "python", "snipdescription": "", "snipcontent": content, "collectionid": 1, "lastmodified": datetime.now(timezone.utc).isoformat(), "sharedwith": [], **changes}
+
+async def checkEdits(client: httpx.AsyncClient, owner: dict):
+    original = "original 1\n" * 50
+    bodies = [original]
+    response = await client.patch("/editSnip", json=snipJson(1, original, snipname="renamed"), headers=owner["headers"])
+    expect("metadata edit accepted", response.status_code == 200, response.text)
+    expect("metadata edit records no revision", await revisionRows(1) == [])
+
+    #Small edits, then two replacing the whole body with text that barely compresses, then small ones again
+    generator = random.Random(6)
+
+    for i in range(12):
+        if (i in (6, 7)):
+            body = "".join(base64.b64encode(generator.randbytes(30)).decode() + "\n" for _ in range(40))
+        else:
+            lines = bodies[-1].splitlines(keepends=True)
+            lines[i] = f"edit {i}\n"
+            body = "".join(lines)
+
+        response = await client.patch("/editSnip", json=snipJson(1, body), headers=owner["headers"])
+        expect(f"edit {i} accepted", response.status_code == 200, response.text)
+        bodies.append(body)
+
+    rows = await revisionRows(1)
+    expect("first edit keeps the original as revision 1", [row.revision for row in rows] == list(range(1, len(bodies) + 1)) and rows[0].kind == SNAPSHOT, rows)
+    expect("delta chains stay within SNIP_REVISION_MAX_CHAIN", all(row.chainlength <= 5 for row in rows) and sum(row.kind == DELTA for row in rows) > 0, [tuple(row) for row in rows])
+    expect("second rewrite in a row takes a snapshot", rows[7].kind == DELTA and rows[8].kind == SNAPSHOT, rows[7:9])
+
+    page = (await client.get("/getSnipRevisions/1", params={"limit": 5}, headers=owner["headers"])).json()
+    expect("revisions listed newest first", [revision["revision"] for revision in page] == [13, 12, 11, 10, 9], page)
+    expect("listed revisions carry their length", page[0]["contentlength"] == len(bodies[-1]), page[0])
+    page = (await client.get("/getSnipRevisions/1", params={"before": 9, "limit": 5}, headers=owner["headers"])).json()
+    expect("revision pages continue below before", [revision["revision"] for revision in page] == [8, 7, 6, 5, 4], page)
+
+    rebuilt = [(await client.get(f"/getSnipRevision/1/{revision}", headers=owner["headers"])).json()["snipcontent"] for revision in range(1, len(bodies) + 1)]
+    expect("every revision rebuilds its body", rebuilt == bodies)
+    expect("missing revision is a 404", (await client.get("/getSnipRevision/1/99", headers=owner["headers"])).status_code == 404)
+
+async def checkBatch(client: httpx.AsyncClient, owner: dict):
+    response = await client.post("/batch", json={"operations": [
+        {"op": "editSnip", "snip": snipJson(2, "batched once\n")},
+        {"op": "editSnip", "snip": snipJson(2, "batched twice\n")},
+        {"op": "editSnip", "snip": snipJson(3, "batched\n")}
+    ]}, headers=owner["headers"])
+    expect("batch accepted", response.status_code == 200, response.text)
+    expect("batch records each edit", [row.revision for row in await revisionRows(2)] == [1, 2, 3] and [row.revision for row in await revisionRows(3)] == [1, 2])
+    latest = (await client.get("/getSnipRevision/2/3", headers=owner["headers"])).json()
+    expect("batch's last edit is the latest revision", latest.get("snipcontent") == "batched twice\n", latest)
+
+async def checkPrivacy(client: httpx.AsyncClient):
+    other = authArgs(OTHER)
+    expect("others can't list a snip's revisions", (await client.get("/getSnipRevisions/1", headers=other["headers"])).json() == [])
+    expect("others can't fetch a snip's revisions", (await client.get("/getSnipRevision/1/1", headers=other["headers"])).status_code == 404)
+    response = await client.patch("/editSnip", json=snipJson(1, "not mine\n"), headers=other["headers"])
+    expect("others' edits record nothing", len(await revisionRows(1)) == 13, response.status_code)
+
+async def checkDelete(client: httpx.AsyncClient, owner: dict):
+    response = await client.delete("/deleteSnip/1", headers=owner["headers"])
+    expect("snip with history deleted", response.status_code == 200, response.text)
+    expect("its revisions go with it", await revisionRows(1) == [])
+
+#An existing database, with snips but from before revisions, upgrades in place
+async def checkMigration():
+    legacy = create_async_engine(f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/legacy.db")
+
+    async with legacy.begin() as connection:
+        await connection.run_sync(runMigrations)
+        await connection.execute(text("DROP TABLE sniprevisions"))
+        await connection.execute(text("ALTER TABLE snips DROP COLUMN revision"))
+        await connection.execute(text("DELETE FROM schema_migrations WHERE version = 8"))
+
+    async with legacy.begin() as connection:
+        applied = await connection.run_sync(runMigrations)
+        hasColumn = await connection.run_sync(lambda sync: columnExists(sync, "snips", "revision"))
+        revisions = (await connection.execute(select(func.count()).select_from(SnipRevision))).scalar()
+
+    await legacy.dispose()
+    expect("migration adds revisions to an existing database", applied == [8] and hasColumn and revisions == 0, applied)
+
+async def main() -> int:
+    checkDeltas()
+
+    async with app.router.lifespan_context(app):
+        await seed()
+        owner = authArgs(OWNER)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://revisions") as client:
+            await checkEdits(client, owner)
+            await checkBatch(client, owner)
+            await checkPrivacy(client)
+            await checkDelete(client, owner)
+
+    await checkMigration()
+    await engine.dispose()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
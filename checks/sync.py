@@ -0,0 +1,156 @@
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+#Checks /sync against a scratch database: a full sync, then that every kind of write (own and by someone sharing with
+#the user) shows up in the next delta, deletes as tombstones, and that an empty delta costs one statement.
+#Run with: python -m checks.sync
+#Uses SYNC_CHECK_DATABASE_URL if set, otherwise a temporary sqlite file. Never the configured DATABASE_URL
+os.environ["DATABASE_URL"] = os.getenv("SYNC_CHECK_DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/sync.db")
+os.environ.setdefault("JWT_SECRET", "sync-check-secret-0123456789abcdef0123456789")
+
+from fastapi.testclient import TestClient
+from config import SYNC_TOMBSTONE_DAYS, engine
+from main import app
+from utils.query_counter import countStatements
+from utils.security import issueTokens
+
+failures = []
+
+def expect(name: str, condition: bool, detail=""):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}{f': {detail}' if detail != '' else ''}")
+
+    if (not condition):
+        failures.append(name)
+
+def authArgs(userId: int, email: str) -> dict:
+    csrf, jwtToken = issueTokens(userId, email, datetime.now(timezone.utc) + timedelta(hours=1))
+    return {"headers": {"snipsnap_csrf": csrf}, "cookies": {"snipsnap_jwt": jwtToken}}
+
+def names(rows: list) -> list:
+    return sorted(row.get("snipname") or row.get("collectionname") or row.get("displayname") for row in rows)
+
+def main() -> int:
+    with TestClient(app) as client:
+        def call(method: str, url: str, auth: dict, **kwargs):
+            client.cookies.clear()
+            client.cookies.update(auth["cookies"])
+            response = client.request(method, url, headers=auth["headers"], **kwargs)
+
+            if (response.status_code >= 400 and not url.startswith("/sync")):
+                raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.text}")
+
+            return response
+
+        #Sync since the token, return the changes and move the token on
+        tokens = {}
+
+        def sync(name: str, auth: dict) -> dict:
+            changes = call("GET", "/sync", auth, params={"since": tokens[name]} if name in tokens else {}).json()
+            tokens[name] = changes["token"]
+            return changes
+
+        for email in ("owner@example.com", "friend@example.com"):
+            client.post("/createUser", json={"email": email, "password": "password", "firstname": "Sync", "lastname": "Check"})
+
+        owner = authArgs(1, "owner@example.com")
+        friend = authArgs(2, "friend@example.com")
+        now = datetime.now(timezone.utc).isoformat()
+        snip = {"snipid": 0, "snipname": "first", "sniplanguage": "python", "snipdescription": "", "snipcontent": "x", "collectionid": 0, "lastmodified": now, "sharedwith": []}
+
+        call("POST", "/createContact", owner, json={"email": "friend@example.com", "displayname": "Friend"})
+        collectionId = call("POST", "/createCollection/Work", owner).json()
+        snip["collectionid"] = collectionId
+        firstId = call("POST", "/createSnip", owner, json=snip).json()
+
+        full = sync("owner", owner)
+        expect("first sync is full", full["full"] is True)
+        expect("full sync has the snips", names(full["snips"]) == ["first"], names(full["snips"]))
+        expect("full sync has the collections", names(full["collections"]) == ["Work"], names(full["collections"]))
+        expect("full sync has the contacts", names(full["contacts"]) == ["Friend"], names(full["contacts"]))
+        sync("friend", friend)
+
+        with countStatements(engine) as counter:
+            empty = sync("owner", owner)
+
+        expect("no changes, nothing sent", not empty["full"] and all(empty[kind] == [] and empty["deleted"][kind] == [] for kind in ("snips", "collections", "contacts", "sharedwithme")), empty)
+        expect("no changes costs one statement", counter.count == 1, counter.count)
+
+        secondId = call("POST", "/createSnip", owner, json={**snip, "snipname": "second", "sharedwith": [2]}).json()
+        changes = sync("owner", owner)
+        expect("new snip in the owner's delta", names(changes["snips"]) == ["second"], names(changes["snips"]))
+        expect("unchanged rows left out", changes["collections"] == [] and changes["contacts"] == [])
+        changes = sync("friend", friend)
+        expect("snip shared with the friend in their delta", names(changes["sharedwithme"]) == ["second"], changes["sharedwithme"])
+
+        call("PATCH", "/editSnip", owner, json={**snip, "snipid": secondId, "snipname": "second edited", "sharedwith": [2]})
+        expect("owner's edit reaches the recipient", names(sync("friend", friend)["sharedwithme"]) == ["second edited"])
+        expect("owner sees their own edit", names(sync("owner", owner)["snips"]) == ["second edited"])
+
+        call("PATCH", "/editSnip", owner, json={**snip, "snipid": secondId, "snipname": "second edited", "sharedwith": []})
+        changes = sync("friend", friend)
+        expect("unsharing tombstones the recipient's copy", changes["deleted"]["sharedwithme"] == [secondId] and changes["sharedwithme"] == [], changes)
+
+        call("PATCH", "/editSnip", owner, json={**snip, "snipid": secondId, "snipname": "second edited", "sharedwith": [2]})
+        call("DELETE", f"/deleteSnip/{secondId}", owner)
+        changes = sync("owner", owner)
+        expect("deleted snip tombstoned", changes["deleted"]["snips"] == [secondId] and changes["snips"] == [], changes)
+        expect("recipient drops a deleted shared snip", sync("friend", friend)["deleted"]["sharedwithme"] == [secondId])
+
+        call("PATCH", "/editCollectionName", owner, json={"collectionid": collectionId, "collectionname": "Renamed", "lastmodified": now})
+        expect("renamed collection in the delta", names(sync("owner", owner)["collections"]) == ["Renamed"])
+
+        call("DELETE", "/deleteContact/2", owner)
+        call("POST", "/createContact", owner, json={"email": "friend@example.com", "displayname": "Friend again"})
+        changes = sync("owner", owner)
+        expect("contact deleted and added again is live", names(changes["contacts"]) == ["Friend again"] and changes["deleted"]["contacts"] == [], changes)
+
+        results = call("POST", "/batch", owner, json={"operations": [
+            {"op": "createSnip", "snip": {**snip, "snipname": "batched", "sharedwith": [2]}},
+            {"op": "deleteSnip", "snipid": firstId},
+            {"op": "createCollection", "collectionname": "Batched"},
+        ]}).json()
+        changes = sync("owner", owner)
+        expect("batch writes in the delta", names(changes["snips"]) == ["batched"] and names(changes["collections"]) == ["Batched"], changes)
+        expect("batch deletes in the delta", changes["deleted"]["snips"] == [firstId], changes["deleted"])
+        expect("batch shares reach the recipient", names(sync("friend", friend)["sharedwithme"]) == ["batched"])
+
+        library = "\n".join(json.dumps(record) for record in (
+            {"type": "header", "version": 1},
+            {"type": "collection", "collectionid": 1, "collectionname": "Imported"},
+            {"type": "contact", "email": "friend@example.com", "displayname": "Friend"},
+            {"type": "snip", "snipid": 1, "collectionid": 1, "snipname": "imported", "sniplanguage": "python", "snipdescription": "", "snipcontent": "y"},
+            {"type": "share", "snipid": 1, "email": "friend@example.com"},
+        ))
+        call("POST", "/import", owner, content=library.encode('utf-8'))
+        changes = sync("owner", owner)
+        expect("imported rows in the delta", names(changes["snips"]) == ["imported"] and names(changes["collections"]) == ["Imported"], changes)
+        expect("imported snip marked shared", changes["snips"][0]["snipshared"] is True if changes["snips"] else False)
+        changes = sync("friend", friend)
+        expect("imported shares reach the recipient", names(changes["sharedwithme"]) == ["imported"])
+        stillShared = sorted([results[0]["id"], *(row["snipid"] for row in changes["sharedwithme"])])
+
+        dataversion, shareversion, _ = json.loads(base64.urlsafe_b64decode(tokens["owner"]))
+        oldToken = base64.urlsafe_b64encode(json.dumps([dataversion, shareversion, int(time.time()) - SYNC_TOMBSTONE_DAYS * 86400 - 60]).encode('utf-8')).decode('utf-8')
+        expect("token older than the tombstones gets a full sync", call("GET", "/sync", owner, params={"since": oldToken}).json()["full"] is True)
+        expect("bad token rejected", call("GET", "/sync", owner, params={"since": "not a token"}).status_code == 400)
+
+        job = call("DELETE", "/deleteAccount", owner).json()
+        deadline = time.time() + 30
+
+        while (job["status"] not in ("done", "failed") and time.time() < deadline):
+            time.sleep(0.05)
+            job = call("GET", f"/jobs/{job['jobid']}", owner).json()
+
+        expect("account deletion job finished", job["status"] == "done", job)
+        changes = sync("friend", friend)
+        expect("deleted account's shares tombstoned", changes["deleted"]["sharedwithme"] == stillShared, changes["deleted"])
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
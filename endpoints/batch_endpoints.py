@@ -0,0 +1,227 @@
+from itertools import groupby
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import bindparam, delete, insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from models.db_models import Collection, Contact, Shared, Snip, SnipRevision, User
+from models.http.request_models import *
+from models.http.response_models import *
+from config import get_session
+from utils.security import *
+from utils.etag import bumpDataVersion
+from utils.read_cache import *
+from utils.sharing import reconcileSharesBulk
+from utils.snip_content import packSnipContent
+from utils.revisions import recordRevisions
+from utils.sync import SyncChanges
+from utils.notifications import publishChanges
+
+batch_router = APIRouter(prefix="")
+
+#Each handler below applies a run of consecutive operations of one kind, as [(index, operation)], with as few
+#statements as the kind allows. It records the read cache entries the run makes stale in changes, stamps what it
+#writes with changes["sync"].changeseq and returns one BatchResult per operation. Handlers never commit, /batch
+#commits once at the end
+
+#Raise a 404 naming the first operation that refers to something not in found
+def _requireFound(ops: list, getId, found: set, detail: str):
+    for index, op in ops:
+        if (getId(op) is not None and getId(op) not in found):
+            raise HTTPException(404, f"Operation {index}: {detail}")
+
+async def _ownedCollections(session: AsyncSession, userid: int, ops: list) -> set:
+    collectionIds = {op.snip.collectionid for _, op in ops if op.snip.collectionid is not None}
+
+    if (len(collectionIds) == 0):
+        return set()
+
+    return set((await session.exec(select(Collection.collectionid).where((Collection.userid == userid) & (Collection.collectionid.in_(collectionIds))))).all())
+
+async def _createSnips(session: AsyncSession, user: UserContext, ops: list, changes: dict) -> list:
+    _requireFound(ops, lambda op: op.snip.collectionid, await _ownedCollections(session, user.userid, ops), "Collection not found")
+
+    rows = [Snip(
+        userid=user.userid,
+        snipname=op.snip.snipname,
+        snipdescription=op.snip.snipdescription,
+        sniplanguage=op.snip.sniplanguage,
+        **packSnipContent(op.snip.snipcontent),
+        collectionid=op.snip.collectionid,
+        changeseq=changes["sync"].changeseq
+    ).model_dump(exclude={"snipid"}) for _, op in ops]
+    snipIds = (await session.exec(insert(Snip.__table__).returning(Snip.__table__.c.snipid, sort_by_parameter_order=True), params=rows)).scalars().all()
+
+    shares = [
+        {"snipid": snipId, "userid": user.userid, "contactid": contactid}
+        for snipId, (_, op) in zip(snipIds, ops) for contactid in dict.fromkeys(op.snip.sharedwith)
+    ]
+
+    if (len(shares) > 0):
+        await session.exec(insert(Shared).values(shares))
+
+    changes["sync"].edited.update(snipIds)
+    changes["sync"].added.update((share["snipid"], share["contactid"]) for share in shares)
+    changes["resources"].add(SNIPS)
+    changes["sharedwithme"].update(share["contactid"] for share in shares)
+    return [BatchResult(op=op.op, id=snipId, applied=True) for snipId, (_, op) in zip(snipIds, ops)]
+
+async def _editSnips(session: AsyncSession, user: UserContext, ops: list, changes: dict) -> list:
+    _requireFound(ops, lambda op: op.snip.collectionid, await _ownedCollections(session, user.userid, ops), "Collection not found")
+    revisions = await recordRevisions(session, user.userid, [(op.snip.snipid, op.snip.snipcontent) for _, op in ops])
+    _requireFound(ops, lambda op: op.snip.snipid, set(revisions), "Snip not found")
+
+    snips = Snip.__table__
+    await session.exec(update(snips).where(snips.c.snipid == bindparam("b_snipid")).values(
+        snipname=bindparam("snipname"),
+        snipdescription=bindparam("snipdescription"),
+        sniplanguage=bindparam("sniplanguage"),
+        snipcontent=bindparam("snipcontent"),
+        snipcontentz=bindparam("snipcontentz"),
+        collectionid=bindparam("collectionid"),
+        lastmodified=bindparam("lastmodified"),
+        changeseq=bindparam("changeseq"),
+        revision=bindparam("revision")
+    ), params=[{
+        "b_snipid": op.snip.snipid,
+        "snipname": op.snip.snipname,
+        "snipdescription": op.snip.snipdescription,
+        "sniplanguage": op.snip.sniplanguage,
+        **packSnipContent(op.snip.snipcontent),
+        "collectionid": op.snip.collectionid,
+        "lastmodified": op.snip.lastmodified,
+        "changeseq": changes["sync"].changeseq,
+        "revision": revisions[op.snip.snipid] #The latest, when a run edits a snip more than once
+    } for _, op in ops])
+
+    #The last edit of a snip in the run decides its shares
+    shareChanges = await reconcileSharesBulk(session, user.userid, {op.snip.snipid: op.snip.sharedwith for _, op in ops})
+
+    changes["resources"].add(SNIPS)
+
+    for snipid, (previous, added, removed) in shareChanges.items():
+        changes["sharedwithme"].update(previous | added)
+        changes["sync"].edited.add(snipid)
+        changes["sync"].added.update((snipid, contactid) for contactid in added)
+        changes["sync"].shared.update((snipid, contactid) for contactid in previous - removed)
+        changes["sync"].unshared.update((snipid, contactid) for contactid in removed)
+
+    return [BatchResult(op=op.op, id=op.snip.snipid, applied=True) for _, op in ops]
+
+async def _deleteSnips(session: AsyncSession, user: UserContext, ops: list, changes: dict) -> list:
+    snipIds = {op.snipid for _, op in ops}
+    shares = (await session.exec(delete(Shared).where((Shared.userid == user.userid) & (Shared.snipid.in_(snipIds))).returning(Shared.snipid, Shared.contactid))).all()
+    await session.exec(delete(SnipRevision).where((SnipRevision.userid == user.userid) & (SnipRevision.snipid.in_(snipIds))))
+    deleted = set((await session.exec(delete(Snip).where((Snip.userid == user.userid) & (Snip.snipid.in_(snipIds))).returning(Snip.snipid))).scalars().all())
+
+    changes["sync"].delete(SNIPS, deleted)
+    changes["sync"].unshared.update((share.snipid, share.contactid) for share in shares)
+    changes["resources"].add(SNIPS)
+    changes["sharedwithme"].update(share.contactid for share in shares)
+    return [BatchResult(op=op.op, id=op.snipid, applied=op.snipid in deleted) for _, op in ops]
+
+async def _createCollections(session: AsyncSession, user: UserContext, ops: list, changes: dict) -> list:
+    rows = [Collection(userid=user.userid, collectionname=op.collectionname, changeseq=changes["sync"].changeseq).model_dump(exclude={"collectionid"}) for _, op in ops]
+    collectionIds = (await session.exec(insert(Collection.__table__).returning(Collection.__table__.c.collectionid, sort_by_parameter_order=True), params=rows)).scalars().all()
+
+    changes["resources"].add(COLLECTIONS)
+    return [BatchResult(op=op.op, id=collectionId, applied=True) for collectionId, (_, op) in zip(collectionIds, ops)]
+
+async def _editCollectionNames(session: AsyncSession, user: UserContext, ops: list, changes: dict) -> list:
+    #Like /editCollectionName, a collection the user doesn't own is skipped rather than failing the batch
+    owned = set((await session.exec(select(Collection.collectionid).where((Collection.userid == user.userid) & (Collection.collectionid.in_({op.collection.collectionid for _, op in ops}))))).all())
+    params = [{
+        "b_collectionid": op.collection.collectionid,
+        "collectionname": op.collection.collectionname,
+        "lastmodified": op.collection.lastmodified,
+        "changeseq": changes["sync"].changeseq
+    } for _, op in ops if op.collection.collectionid in owned]
+
+    if (len(params) > 0):
+        collections = Collection.__table__
+        await session.exec(update(collections).where(collections.c.collectionid == bindparam("b_collectionid")).values(
+            collectionname=bindparam("collectionname"),
+            lastmodified=bindparam("lastmodified"),
+            changeseq=bindparam("changeseq")
+        ), params=params)
+
+    changes["resources"].add(COLLECTIONS)
+    return [BatchResult(op=op.op, id=op.collection.collectionid, applied=op.collection.collectionid in owned) for _, op in ops]
+
+#Only empty collections. Emptying one means deleting its snips, shares and revisions, which /deleteCollection does as a
+#background job (utils/deletion.py), too much for one transaction. Deleting just the row would orphan the snips
+async def _deleteCollections(session: AsyncSession, user: UserContext, ops: list, changes: dict) -> list:
+    collectionIds = {op.collectionid for _, op in ops}
+    nonEmpty = set((await session.exec(select(Snip.collectionid).where((Snip.userid == user.userid) & (Snip.collectionid.in_(collectionIds))).distinct())).all())
+
+    for index, op in ops:
+        if (op.collectionid in nonEmpty):
+            raise HTTPException(409, f"Operation {index}: Collection isn't empty, delete it with /deleteCollection")
+
+    deleted = set((await session.exec(delete(Collection).where((Collection.userid == user.userid) & (Collection.collectionid.in_(collectionIds))).returning(Collection.collectionid))).scalars().all())
+
+    changes["sync"].delete(COLLECTIONS, deleted)
+    changes["resources"].add(COLLECTIONS)
+    return [BatchResult(op=op.op, id=op.collectionid, applied=op.collectionid in deleted) for _, op in ops]
+
+async def _createContacts(session: AsyncSession, user: UserContext, ops: list, changes: dict) -> list:
+    userIds = dict((await session.exec(select(User.email, User.userid).where(User.email.in_({op.contact.email for _, op in ops})))).all())
+    _requireFound(ops, lambda op: op.contact.email, set(userIds), "No users found with this email address")
+
+    await session.exec(insert(Contact).values([
+        {"userid": user.userid, "contactid": userIds[op.contact.email], "displayname": op.contact.displayname, "changeseq": changes["sync"].changeseq} for _, op in ops
+    ]))
+
+    changes["resources"].add(CONTACTS)
+    return [BatchResult(op=op.op, id=userIds[op.contact.email], applied=True) for _, op in ops]
+
+async def _deleteContacts(session: AsyncSession, user: UserContext, ops: list, changes: dict) -> list:
+    deleted = set((await session.exec(delete(Contact).where((Contact.userid == user.userid) & (Contact.contactid.in_({op.contactid for _, op in ops}))).returning(Contact.contactid))).scalars().all())
+
+    changes["sync"].delete(CONTACTS, deleted)
+    changes["resources"].add(CONTACTS)
+    return [BatchResult(op=op.op, id=op.contactid, applied=op.contactid in deleted) for _, op in ops]
+
+_BATCH_HANDLERS = {
+    "createSnip": _createSnips,
+    "editSnip": _editSnips,
+    "deleteSnip": _deleteSnips,
+    "createCollection": _createCollections,
+    "editCollectionName": _editCollectionNames,
+    "deleteCollection": _deleteCollections,
+    "createContact": _createContacts,
+    "deleteContact": _deleteContacts,
+}
+
+#Apply a list of snip, collection and contact operations in order, in one transaction. Either every operation is
+#applied or none is. Consecutive operations of the same kind are applied together with bulk statements
+@batch_router.post('/batch', response_model=List[BatchResult])
+async def batch(batchReq: BatchRequest, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)) -> List[BatchResult]:
+    results = []
+    changes = {"resources": set(), "sharedwithme": set()}
+
+    try:
+        changes["sync"] = SyncChanges(user.userid, await bumpDataVersion(session, user.userid))
+
+        for op, run in groupby(enumerate(batchReq.operations), key=lambda item: item[1].op):
+            run = list(run)
+
+            try:
+                results.extend(await _BATCH_HANDLERS[op](session, user, run, changes))
+            except IntegrityError as e:
+                raise HTTPException(409, f"Operations {run[0][0]}-{run[-1][0]} ({op}): {e.orig}")
+
+        await changes["sync"].write(session)
+        await session.commit()
+        await invalidateReadCache(user.userid, *changes["resources"])
+        await invalidateSharedWithMe(changes["sharedwithme"])
+        await publishChanges(changes["sync"], user.sessionid)
+
+        return results
+    except HTTPException as e:
+        await session.rollback()
+        raise
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(500, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
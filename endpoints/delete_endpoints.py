@@ -1,26 +1,29 @@
-from fastapi import APIRouter, Cookie, Depends, HTTPException, Response, Request
-from sqlmodel import Session, delete
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from models.db_models import Collection, Contact, Snip, User
+from models.db_models import Collection, Contact, Shared, Snip, SnipRevision
 from models.http.request_models import *
 from models.http.response_models import *
 from config import get_session
 from utils.security import *
+from utils.etag import bumpDataVersion
+from utils.read_cache import *
+from utils.sync import SyncChanges
+from utils.notifications import publishChanges
+from utils.jobs import enqueueJob, wakeJobs
+from utils.deletion import DELETE_ACCOUNT, DELETE_COLLECTION
 
 delete_router = APIRouter(prefix="")
 
-#Delete the account. Unvalidates tokens to ensure logout on delete
-@delete_router.delete('/deleteAccount')
-async def deleteAccount(response: Response, request: Request, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)):
+#Delete the account. Unvalidates tokens to ensure logout on delete. The data goes in the background, returns the job
+#to follow with /jobs/{jobId}. Login turns the account away from now on, unless the job fails for good
+@delete_router.delete('/deleteAccount', status_code=202, response_model=JobResponse)
+async def deleteAccount(response: Response, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)) -> JobResponse:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        session.exec(delete(User).where(User.userid == userid))
-        session.commit()
+        job = await enqueueJob(session, user.userid, DELETE_ACCOUNT, user.userid)
+        await session.commit()
+        wakeJobs()
 
         response.set_cookie(
             key="snipsnap_jwt",
@@ -41,70 +44,77 @@ async def deleteAccount(response: Response, request: Request, snipsnap_jwt: str
             samesite="None",
             domain="snip-snap.org"
         )
+
+        return job
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
 #Delete a contact
 @delete_router.delete('/deleteContact/{contactId}')
-async def deleteContact(request: Request, contactId: int, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)):
+async def deleteContact(contactId: int, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)):
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        session.exec(delete(Contact).where((Contact.userid == userid) & (Contact.contactid == contactId)))
-        session.commit()
+        sync = SyncChanges(user.userid, await bumpDataVersion(session, user.userid))
+        sync.delete(CONTACTS, (await session.exec(delete(Contact).where((Contact.userid == user.userid) & (Contact.contactid == contactId)).returning(Contact.contactid))).scalars().all())
+        await sync.write(session)
+        await session.commit()
+        await invalidateReadCache(user.userid, CONTACTS)
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
 #Delete a snip
 @delete_router.delete('/deleteSnip/{snipId}')
-async def deleteSnip(request: Request, snipId: int, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)):
+async def deleteSnip(snipId: int, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)):
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
+        sync = SyncChanges(user.userid, await bumpDataVersion(session, user.userid))
 
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        session.exec(delete(Snip).where((Snip.userid == userid) & (Snip.snipid == snipId)))
-        session.commit()
+        #Shares and revisions go first so the snip's foreign keys don't block the delete. The shares tell us whose shared-with-me lists to drop
+        shares = (await session.exec(delete(Shared).where((Shared.userid == user.userid) & (Shared.snipid == snipId)).returning(Shared.snipid, Shared.contactid))).all()
+        await session.exec(delete(SnipRevision).where((SnipRevision.userid == user.userid) & (SnipRevision.snipid == snipId)))
+        sync.delete(SNIPS, (await session.exec(delete(Snip).where((Snip.userid == user.userid) & (Snip.snipid == snipId)).returning(Snip.snipid))).scalars().all())
+        sync.unshared.update((share.snipid, share.contactid) for share in shares)
+        await sync.write(session)
+        await session.commit()
+        await invalidateReadCache(user.userid, SNIPS)
+        await invalidateSharedWithMe([share.contactid for share in shares])
+        await publishChanges(sync, user.sessionid)
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
-#Delete a collection
-@delete_router.delete('/deleteCollection/{collId}')
-async def deleteCollection(request: Request, collId: int, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)):
+#Delete a collection and the snips in it. They go in the background, returns the job to follow with /jobs/{jobId}.
+#Before the job queue only the collection row was deleted, which foreign keys refused while it still held snips
+@delete_router.delete('/deleteCollection/{collId}', status_code=202, response_model=JobResponse, description=(
+    "Deletes the collection together with every snip in it, their shares and their revision history. "
+    "The deletion runs in the background: the 202 response is the job, follow it with GET /jobs/{jobId}. "
+    "404 if the collection doesn't exist or isn't yours."
+))
+async def deleteCollection(collId: int, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)) -> JobResponse:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
+        if ((await session.exec(select(Collection.collectionid).where((Collection.userid == user.userid) & (Collection.collectionid == collId)))).first() is None):
+            raise HTTPException(404, "Collection not found")
 
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        session.exec(delete(Collection).where((Collection.userid == userid) & (Collection.collectionid == collId)))
-        session.commit()
+        job = await enqueueJob(session, user.userid, DELETE_COLLECTION, collId)
+        await session.commit()
+        wakeJobs()
+        return job
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
-        raise HTTPException(500, str(e))
\ No newline at end of file
+        raise HTTPException(500, str(e))
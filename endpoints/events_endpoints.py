@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from config import STREAM_TICKET_TTL
+from models.http.response_models import StreamTicketResponse
+from utils.security import UserContext, getCurrentUser, getStreamUser, issueStreamTicket
+import utils.notifications as notifications
+
+events_router = APIRouter(prefix="")
+
+#Push events for the user as Server-Sent Events: shared, unshared, edited and deleted snips (see utils/notifications.py).
+#Get a ticket from /events/ticket, open with new EventSource("/events?ticket=<ticket>", {withCredentials: true}) and
+#call /sync on each event. A ticket opens one stream, so EventSource's own reconnect fails with 401 and closes it: on
+#error, close the EventSource, wait a few seconds, take a new ticket, open a new one and /sync for what was missed
+@events_router.get("/events")
+async def events(user: UserContext = Depends(getStreamUser)) -> StreamingResponse:
+    if (notifications.notifier is None):
+        raise HTTPException(404, "Push events are turned off")
+
+    return StreamingResponse(
+        notifications.eventStream(user.userid, user.sessionid, user.expires),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} #No buffering in nginx, events go out as they happen
+    )
+
+#Single use, short lived ticket for opening /events, since EventSource can't send the csrf header (see utils/security.py)
+@events_router.post("/events/ticket", response_model=StreamTicketResponse)
+async def eventsTicket(user: UserContext = Depends(getCurrentUser)) -> StreamTicketResponse:
+    if (notifications.notifier is None):
+        raise HTTPException(404, "Push events are turned off")
+
+    return StreamTicketResponse(ticket=issueStreamTicket(user), expires=STREAM_TICKET_TTL)
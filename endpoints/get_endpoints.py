@@ -1,234 +1,321 @@
-from fastapi import APIRouter, Cookie, Depends, HTTPException, Request
-from sqlmodel import Session, select
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import selectinload
-from models.db_models import Collection, Shared, Snip, User
+from models.db_models import Collection, Contact, Shared, Snip, User
 from models.http.request_models import *
 from models.http.response_models import *
-from config import get_session
+from config import get_session, readRouter
 from utils.security import *
+from utils.pagination import getSnipPage, selectSnipList
+from utils.search import searchSnipPage
+from utils.snip_content import unpackSnipContent
+from utils.library import streamLibrary
+from utils.sync import getChangesSince
+from utils.jobs import getJob
+from utils.revisions import getRevision, listRevisions
+from utils.etag import checkNotModified, getDataVersion, makeETag
+from utils.serialization import jsonResponse, rowListAdapter
+from utils.read_cache import *
 
 get_router = APIRouter(prefix="")
 
-#Get list of snips for user
+_revisionRows = rowListAdapter(SnipRevisionResponse)
+
+#get_router reads go to a read replica unless the user has just written, see utils/db_routing.py
+async def get_read_session(user: UserContext = Depends(getCurrentUser)):
+    async with readRouter.sessionsFor(user.userid)() as session:
+        yield session
+
+#Load a page of snips in the form kept in the read cache. snips is the page's JSON body, ready to send
+async def _loadSnipPage(session: AsyncSession, snipQuery, page: SnipPageRequest) -> dict:
+    snips, nextCursor = await getSnipPage(session, snipQuery, page)
+    return {"snips": snips.decode('utf-8'), "nextCursor": nextCursor}
+
+async def _loadContacts(session: AsyncSession, userid: int) -> list:
+    contacts = await session.exec(select(Contact).where(Contact.userid == userid))
+    return [ContactsResponse.model_validate(c, from_attributes=True).model_dump(mode="json") for c in contacts]
+
+async def _loadCollections(session: AsyncSession, userid: int) -> list:
+    collections = await session.exec(select(Collection).where(Collection.userid == userid))
+    return [CollectionResponse(collectionid=c.collectionid, collectionname=c.collectionname).model_dump(mode="json") for c in collections]
+
+#Get a page of snips for user. The cursor for the next page is returned in the X-Next-Cursor header
 @get_router.get("/getSnips", response_model=List[SnipsResponse])
-async def getSnips(request: Request, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> List[SnipsResponse]:
+async def getSnips(request: Request, response: Response, page: Annotated[SnipPageRequest, Query()], user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> List[SnipsResponse]:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        #Had to execute the query first THEN build the object. Previously had used a subquery with
-        #exists() to determine if a record for the snip was in the shared table. SQL alchemy was appending
-        #the snips table to the FROM clause, causing snipshared to be true for all snips for a user
-        query = session.exec(select(Snip)
-                    .where(Snip.userid == userid)
-                    .options(selectinload(Snip.sharedwith)))
-        
-        snips = (SnipsResponse(
-            snipid=snip.snipid,
-            sniplanguage=snip.sniplanguage,
-            snipname=snip.snipname,
-            snipdescription=snip.snipdescription,
-            lastmodified=snip.lastmodified,
-            snipshared=True if len(snip.sharedwith) > 0 else False
-         ) for snip in query)
-
-        return snips
+        etag = makeETag("getSnips", user.userid, await getDataVersion(session, user.userid), page.model_dump_json())
+        notModified = checkNotModified(request, response, etag)
+
+        if (notModified is not None):
+            return notModified
+
+        snipPage = await cachedRead(user.userid, SNIPS, page.model_dump_json(), lambda: _loadSnipPage(session, selectSnipList().where(Snip.userid == user.userid), page))
+
+        if (snipPage["nextCursor"] is not None):
+            response.headers["X-Next-Cursor"] = snipPage["nextCursor"]
+
+        return jsonResponse(response, snipPage["snips"].encode('utf-8'))
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
+        raise HTTPException(500, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+    
+#Earlier versions of one of the user's snips, newest first. History starts at the first edit, so a snip never edited
+#has none. Page back with before set to the last revision received
+@get_router.get('/getSnipRevisions/{snipId}', response_model=List[SnipRevisionResponse])
+async def getSnipRevisions(response: Response, snipId: int, page: Annotated[RevisionPageRequest, Query()], user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> List[SnipRevisionResponse]:
+    try:
+        return jsonResponse(response, _revisionRows.validate_python(await listRevisions(session, user.userid, snipId, page.before, page.limit)))
+    except HTTPException as e:
+        raise
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(500, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+#The body of one of the user's snips as it was at revision. Only the owner sees a snip's history
+@get_router.get('/getSnipRevision/{snipId}/{revision}', response_model=SnipRevisionDetailsResponse)
+async def getSnipRevision(response: Response, snipId: int, revision: int, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> SnipRevisionDetailsResponse:
+    try:
+        snipRevision = await getRevision(session, user.userid, snipId, revision)
+
+        if (snipRevision is None):
+            raise HTTPException(404, "Revision not found")
+
+        return jsonResponse(response, SnipRevisionDetailsResponse(**snipRevision))
+    except HTTPException as e:
+        raise
+    except SQLAlchemyError as e:
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
 #Get information needed to create a new snip
 @get_router.get("/getSnipInit", response_model=SnipInitResponse)
-async def getSnipInit(request: Request, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> SnipInitResponse:
+async def getSnipInit(request: Request, response: Response, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> SnipInitResponse:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        userinfo = session.exec(select(User).where(User.userid == userid)).first()
-
-        return SnipInitResponse(
-            contacts=userinfo.contacts,
-            collections=userinfo.collections
-        )
+        etag = makeETag("getSnipInit", user.userid, await getDataVersion(session, user.userid))
+        notModified = checkNotModified(request, response, etag)
+
+        if (notModified is not None):
+            return notModified
+
+        return jsonResponse(response, {
+            "contacts": await cachedRead(user.userid, CONTACTS, "all", lambda: _loadContacts(session, user.userid)),
+            "collections": await cachedRead(user.userid, COLLECTIONS, "all", lambda: _loadCollections(session, user.userid))
+        })
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
 #Get details about a snip
 @get_router.get('/getSnipDetails/{snipId}', response_model=SnipDetailsResponse)
-async def getSnipDetails(request: Request, snipId: int, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> SnipDetailsResponse:
+async def getSnipDetails(request: Request, response: Response, snipId: int, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> SnipDetailsResponse:
     try:
         sharedSnip: bool = False
 
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
+        #Everything in the response belongs to the snip's owner, so the owner's data version tags it
+        owner = (await session.exec(select(Snip.userid, User.dataversion).join(User, User.userid == Snip.userid).where(Snip.snipid == snipId))).first()
 
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        snipDetails = session.exec(select(Snip)
-                                .where(Snip.snipid == snipId)
-                                .options(
-                                    selectinload(Snip.sharedwith),
-                                    selectinload(Snip.user).selectinload(User.collections),
-                                    selectinload(Snip.user).selectinload(User.contacts) #selectinload gets attributes for this snip and user as defined in db model relationships
-                                )).first()
+        if (owner is None):
+            raise HTTPException(404, "Snip not found")
 
-        if (snipDetails.userid != userid):
-            shared = session.exec(select(Shared).where((Shared.contactid == userid) & (Shared.snipid == snipDetails.snipid))).first()
+        if (owner.userid != user.userid):
+            shared = (await session.exec(select(Shared).where((Shared.contactid == user.userid) & (Shared.snipid == snipId)))).first()
 
             if (shared is None):
                 raise HTTPException(401, "Unauthorized")
             else:
                 sharedSnip = True
 
-        return SnipDetailsResponse(
+        etag = makeETag("getSnipDetails", snipId, user.userid, owner.dataversion)
+        notModified = checkNotModified(request, response, etag)
+
+        if (notModified is not None):
+            return notModified
+
+        snipDetails = (await session.exec(select(Snip)
+                                .where(Snip.snipid == snipId)
+                                .options(
+                                    selectinload(Snip.sharedwith),
+                                    selectinload(Snip.user).selectinload(User.collections),
+                                    selectinload(Snip.user).selectinload(User.contacts) #selectinload gets attributes for this snip and user as defined in db model relationships
+                                ))).first()
+
+        return jsonResponse(response, SnipDetailsResponse(
             snipid=snipDetails.snipid,
             snipname=snipDetails.snipname,
             snipdescription=snipDetails.snipdescription,
             sniplanguage=snipDetails.sniplanguage,
-            snipcontent=snipDetails.snipcontent,
+            snipcontent=unpackSnipContent(snipDetails.snipcontent, snipDetails.snipcontentz),
             collectionid=snipDetails.collectionid,
             lastmodified=snipDetails.lastmodified,
             snipshared=(True if len(snipDetails.sharedwith) > 0 else False),
             collections=(snipDetails.user.collections if not sharedSnip else []),
             contacts=(snipDetails.user.contacts if not sharedSnip else []),
             sharedwith=([c.contactid for c in snipDetails.sharedwith] if not sharedSnip else [])
-        )
+        ))
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
 #Get the object to populate the settings page
 @get_router.get('/getSettings', response_model=SettingsResponse)
-async def getSettings(request: Request, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> SettingsResponse:
+async def getSettings(request: Request, response: Response, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> SettingsResponse:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        settings = session.exec(select(User).where(User.userid == userid).options(selectinload(User.contacts))).first() #selectinload gets the contacts for this user as defined in db model relationships
-
-        return SettingsResponse(
-            email=settings.email,
-            firstname=settings.firstname,
-            lastname=settings.lastname,
-            contacts=settings.contacts
-        )
+        etag = makeETag("getSettings", user.userid, await getDataVersion(session, user.userid))
+        notModified = checkNotModified(request, response, etag)
+
+        if (notModified is not None):
+            return notModified
+
+        async def loadSettings():
+            settings = (await session.exec(select(User.email, User.firstname, User.lastname).where(User.userid == user.userid))).first()
+            return {"email": settings.email, "firstname": settings.firstname, "lastname": settings.lastname}
+
+        return jsonResponse(response, {
+            **(await cachedRead(user.userid, SETTINGS, "all", loadSettings)),
+            "contacts": await cachedRead(user.userid, CONTACTS, "all", lambda: _loadContacts(session, user.userid))
+        })
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
-#Get list of snips shared with the user
+#Get a page of snips shared with the user. The cursor for the next page is returned in the X-Next-Cursor header
 @get_router.get("/getSharedWithMe", response_model=List[SnipsResponse])
-async def getSharedWithMe(request: Request, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> List[SnipsResponse]:
+async def getSharedWithMe(response: Response, page: Annotated[SnipPageRequest, Query()], user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> List[SnipsResponse]:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        shared = session.exec(select(Shared).where(Shared.contactid == userid).options(
-            selectinload(Shared.snip)
-        )).all()
-
-        snips = (SnipsResponse(
-            snipid=s.snip.snipid,
-            snipname=s.snip.snipname,
-            snipdescription= s.snip.snipdescription,
-            sniplanguage=s.snip.sniplanguage,
-            lastmodified=s.snip.lastmodified,
-            snipshared=True
-        ) for s in shared)
-
-        return snips
+        snipPage = await cachedRead(user.userid, SHARED_WITH_ME, page.model_dump_json(), lambda: _loadSnipPage(session, selectSnipList().join(Shared, Shared.snipid == Snip.snipid).where(Shared.contactid == user.userid), page))
+
+        if (snipPage["nextCursor"] is not None):
+            response.headers["X-Next-Cursor"] = snipPage["nextCursor"]
+
+        return jsonResponse(response, snipPage["snips"].encode('utf-8'))
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
 #Get collections for user
 @get_router.get("/getCollections", response_model=List[CollectionResponse])
-async def getCollections(request: Request, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> List[CollectionResponse]:
+async def getCollections(request: Request, response: Response, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> List[CollectionResponse]:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        query = session.exec(select(Collection).where(Collection.userid == userid))
-        collections = (CollectionResponse(
-            collectionid=c.collectionid,
-            collectionname=c.collectionname
-        ) for c in query)
-
-        return collections
+        etag = makeETag("getCollections", user.userid, await getDataVersion(session, user.userid))
+        notModified = checkNotModified(request, response, etag)
+
+        if (notModified is not None):
+            return notModified
+
+        return jsonResponse(response, await cachedRead(user.userid, COLLECTIONS, "all", lambda: _loadCollections(session, user.userid)))
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
-#Get list of snips that belong to the specified collection
+#Get a page of snips that belong to the specified collection. The cursor for the next page is returned in the X-Next-Cursor header
 @get_router.get("/getCollectionSnips/{collId}", response_model=List[SnipsResponse])
-async def getCollectionSnips(request: Request, collId: int, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> List[SnipsResponse]:
+async def getCollectionSnips(response: Response, collId: int, page: Annotated[SnipPageRequest, Query()], user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> List[SnipsResponse]:
+    try:
+        #Filtering on the owner as well as the collection keeps users out of collections that aren't theirs
+        snipPage = await cachedRead(user.userid, SNIPS, f"collection:{collId}:{page.model_dump_json()}", lambda: _loadSnipPage(session, selectSnipList().where((Snip.userid == user.userid) & (Snip.collectionid == collId)), page))
+
+        if (snipPage["nextCursor"] is not None):
+            response.headers["X-Next-Cursor"] = snipPage["nextCursor"]
+
+        return jsonResponse(response, snipPage["snips"].encode('utf-8'))
+    except HTTPException as e:
+        raise
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(500, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+    
+#Search the names, descriptions and content of the user's snips and snips shared with them, best match first.
+#The cursor for the next page is returned in the X-Next-Cursor header
+@get_router.get("/searchSnips", response_model=List[SnipsResponse])
+async def searchSnips(response: Response, search: Annotated[SnipSearchRequest, Query()], user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> List[SnipsResponse]:
+    try:
+        snips, nextCursor = await searchSnipPage(session, user.userid, search)
+
+        if (nextCursor is not None):
+            response.headers["X-Next-Cursor"] = nextCursor
+
+        return jsonResponse(response, snips)
+    except HTTPException as e:
+        raise
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(500, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+    
+#Snips, collections, contacts and snips shared with the user created, changed or deleted since the token from their
+#last sync. Polling it in place of the list endpoints costs one lookup while nothing changes. Without since, or with a
+#token older than SYNC_TOMBSTONE_DAYS, it returns everything with full set
+@get_router.get("/sync", response_model=SyncResponse)
+async def sync(response: Response, since: str | None = None, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_read_session)) -> SyncResponse:
+    try:
+        return jsonResponse(response, await getChangesSince(session, user.userid, since))
+    except HTTPException as e:
+        raise
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise HTTPException(500, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+#Progress of a background job the user started, e.g. a collection deletion. Read from the primary, the job was queued
+#moments ago and its progress is what the client is polling for
+@get_router.get("/jobs/{jobId}", response_model=JobResponse)
+async def getJobStatus(jobId: int, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)) -> JobResponse:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        collection = session.exec(select(Collection).where((Collection.userid == userid) & (Collection.collectionid == collId)).options(
-            selectinload(Collection.snips)
-        )).first()
-
-        snips = (SnipsResponse(
-            snipid=s.snipid,
-            snipname=s.snipname,
-            snipdescription= s.snipdescription,
-            sniplanguage=s.sniplanguage,
-            lastmodified=s.lastmodified,
-            snipshared=True if len(s.sharedwith) > 0 else False
-        ) for s in collection.snips)
-
-        return snips
+        job = await getJob(session, user.userid, jobId)
+
+        if (job is None):
+            raise HTTPException(404, "Job not found")
+
+        return job
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
-        raise HTTPException(500, str(e))
\ No newline at end of file
+        raise HTTPException(500, str(e))
+
+#Download the user's whole library (collections, contacts, snips and shares) as NDJSON, in the format /import reads
+@get_router.get("/export")
+async def exportLibrary(user: UserContext = Depends(getCurrentUser)) -> StreamingResponse:
+    return StreamingResponse(
+        streamLibrary(user.userid),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="snipsnap-library.ndjson"'}
+    )
\ No newline at end of file
@@ -0,0 +1,42 @@
+import hmac
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from config import METRICS_TOKEN, engine, readRouter, replicaEngines
+from utils.db_pool import getPoolStats
+from utils.metrics import METRICS, renderMetric, renderStats
+from utils.notifications import notifyStats
+from utils.read_cache import readCacheStats
+from utils.security import passwordPoolStats, tokenCacheStats
+
+metrics_router = APIRouter(prefix="")
+
+DB_POOL_KINDS = {"size": "gauge", "checkedout": "gauge", "checkedin": "gauge", "overflow": "gauge", "checkouts": "counter", "timeouts": "counter", "waitseconds": "counter", "maxwaitseconds": "gauge"}
+PASSWORD_POOL_KINDS = {"running": "gauge", "queued": "gauge", "completed": "counter", "rejected": "counter"}
+CACHE_KINDS = {"hits": "counter", "misses": "counter", "evictions": "counter", "invalidations": "counter"}
+READ_ROUTING_KINDS = {"replica": "counter", "primary": "counter", "sticky": "counter"}
+NOTIFY_KINDS = {"connections": "gauge", "published": "counter", "delivered": "counter", "overflows": "counter"}
+
+#Prometheus scrape endpoint: per-route request metrics plus the connection pool (per engine), read routing,
+#password pool, cache and push event stats.
+#The scraper has to send METRICS_TOKEN as a bearer token. Without METRICS_TOKEN every scrape is refused, the stats
+#(user activity, pool and cache behaviour) aren't for the public internet
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics(authorization: str = Header(None)) -> PlainTextResponse:
+    if (not METRICS_TOKEN or not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}")):
+        raise HTTPException(401, "Unauthorized")
+
+    lines = []
+
+    for metric in METRICS:
+        lines.extend(renderMetric(metric))
+
+    lines.extend(renderStats("snipsnap_db_pool", DB_POOL_KINDS, ({"engine": "primary"}, getPoolStats(engine)), *(
+        ({"engine": f"replica{i}"}, getPoolStats(replica)) for i, replica in enumerate(replicaEngines)
+    )))
+    lines.extend(renderStats("snipsnap_read_routing", READ_ROUTING_KINDS, ({}, readRouter.stats)))
+    lines.extend(renderStats("snipsnap_password_pool", PASSWORD_POOL_KINDS, ({}, passwordPoolStats)))
+    lines.extend(renderStats("snipsnap_token_cache", CACHE_KINDS, ({}, tokenCacheStats)))
+    lines.extend(renderStats("snipsnap_read_cache", CACHE_KINDS, ({}, readCacheStats)))
+    lines.extend(renderStats("snipsnap_events", NOTIFY_KINDS, ({}, notifyStats)))
+
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
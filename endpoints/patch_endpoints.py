@@ -1,99 +1,102 @@
-from fastapi import APIRouter, Cookie, Depends, HTTPException, Request
-from sqlmodel import Session, delete, select, update
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from models.db_models import Collection, Shared, Snip, User
+from models.db_models import Collection, Snip, User
 from models.http.request_models import *
 from models.http.response_models import *
 from config import get_session
 from utils.security import *
+from utils.etag import bumpDataVersion
+from utils.read_cache import *
+from utils.sharing import reconcileShares
+from utils.snip_content import packSnipContent
+from utils.revisions import recordRevisions
+from utils.sync import SyncChanges
+from utils.notifications import publishChanges
 
 patch_router = APIRouter(prefix="")
 
 #Save user info editable on the settings page
 @patch_router.patch('/saveUserInfo')
-async def saveUserInfo(request: Request, updateReq: UpdateUserRequest, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)):
+async def saveUserInfo(updateReq: UpdateUserRequest, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)):
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        session.exec(update(User).where(User.userid == userid).values(
+        await session.exec(update(User).where(User.userid == user.userid).values(
             email=updateReq.email, 
             firstname=updateReq.firstname, 
             lastname=updateReq.lastname, 
             lastmodified=updateReq.lastmodified
         ))
-        session.commit()
+        await bumpDataVersion(session, user.userid)
+        await session.commit()
+        await invalidateReadCache(user.userid, SETTINGS)
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
 #Create snip endpoint
 @patch_router.patch('/editSnip')
-async def editSnip(request: Request, snip: SaveSnipRequest, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)):
+async def editSnip(snip: SaveSnipRequest, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)):
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-
-        collection = session.exec(select(Collection.collectionid).where((Collection.userid == userid) & (Collection.collectionid == snip.collectionid))).first()
+        sync = SyncChanges(user.userid, await bumpDataVersion(session, user.userid))
+        collection = (await session.exec(select(Collection.collectionid).where((Collection.userid == user.userid) & (Collection.collectionid == snip.collectionid)))).first()
 
         if (snip.collectionid is not None and collection is None):
             raise HTTPException(500, "Unable to edit snip")
-        
-        updateResult = session.exec(update(Snip).where((Snip.userid == userid) & (Snip.snipid == snip.snipid)).values(
-            userid=userid,
+
+        revisions = await recordRevisions(session, user.userid, [(snip.snipid, snip.snipcontent)])
+        updateResult = await session.exec(update(Snip).where((Snip.userid == user.userid) & (Snip.snipid == snip.snipid)).values(
+            userid=user.userid,
             snipname=snip.snipname,
             snipdescription=snip.snipdescription,
             sniplanguage=snip.sniplanguage,
-            snipcontent=snip.snipcontent,
+            **packSnipContent(snip.snipcontent),
             collectionid=snip.collectionid,
-            lastmodified=snip.lastmodified
+            lastmodified=snip.lastmodified,
+            changeseq=sync.changeseq,
+            revision=revisions.get(snip.snipid, 0)
         ))
 
         if (updateResult.rowcount > 0):
-            session.exec(delete(Shared).where((Shared.userid == userid) & (Shared.snipid == snip.snipid)))
-        
-            if len(snip.sharedwith) > 0:
-                sharedwith: List[Shared] = [Shared(snipid=snip.snipid, userid=userid, contactid=contactid) for contactid in snip.sharedwith]
-                session.add_all(sharedwith)
+            previouslyShared, added, removed = await reconcileShares(session, user.userid, snip.snipid, snip.sharedwith)
         else:
             raise HTTPException(500, "There was a problem updating the snip")
-        
-        session.commit()
+
+        sync.edited.add(snip.snipid)
+        sync.added.update((snip.snipid, contactid) for contactid in added)
+        sync.shared.update((snip.snipid, contactid) for contactid in previouslyShared - removed)
+        sync.unshared.update((snip.snipid, contactid) for contactid in removed)
+        await sync.write(session)
+        await session.commit()
+        await invalidateReadCache(user.userid, SNIPS)
+        await invalidateSharedWithMe(previouslyShared | set(snip.sharedwith)) #Current recipients see the edit, removed ones lose the snip
+        await publishChanges(sync, user.sessionid)
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
     
 #Edit collection name
 @patch_router.patch('/editCollectionName')
-async def editCollectionName(request: Request, updateReq: UpdateCollectionRequest, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)):
+async def editCollectionName(updateReq: UpdateCollectionRequest, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)):
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        session.exec(update(Collection).where((Collection.userid == userid) & (Collection.collectionid == updateReq.collectionid)).values(
+        changeSeq = await bumpDataVersion(session, user.userid)
+        await session.exec(update(Collection).where((Collection.userid == user.userid) & (Collection.collectionid == updateReq.collectionid)).values(
             collectionname=updateReq.collectionname, 
-            lastmodified=updateReq.lastmodified
+            lastmodified=updateReq.lastmodified,
+            changeseq=changeSeq
         ))
-        session.commit()
+        await session.commit()
+        await invalidateReadCache(user.userid, COLLECTIONS)
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
\ No newline at end of file
@@ -1,27 +1,38 @@
 from datetime import timedelta
-from fastapi import APIRouter, Cookie, Depends, HTTPException, Response, Request
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlmodel import exists, insert, literal, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from models.db_models import Collection, Contact, Shared, Snip, User
+from models.db_models import Collection, Contact, Job, Shared, Snip, User
 from models.http.request_models import *
 from models.http.response_models import *
-from config import get_session
+from config import PASSWORD_REHASH, get_session
 from utils.security import *
+from utils.etag import bumpDataVersion
+from utils.read_cache import *
+from utils.snip_content import packSnipContent
+from utils.library import LibraryImport, readLines
+from utils.sync import SyncChanges
+from utils.notifications import publishChanges
+from utils.deletion import DELETE_ACCOUNT
+from utils.jobs import DONE, QUEUED, RUNNING
 
 post_router = APIRouter(prefix="")
 
 #Sign up form endpoint
 @post_router.post('/createUser')
-async def createUser(user: CreateUserRequest, session: Session = Depends(get_session)):
+async def createUser(user: CreateUserRequest, session: AsyncSession = Depends(get_session)):
     try:
         #Dump user to model, reset password to hashed version, and insert to db
         user = User(**user.model_dump())
-        user.password = hashPassword(user.password)
+        user.password = await hashPasswordAsync(user.password)
         session.add(user)
-        session.commit()
-        session.refresh(user)
+        await session.commit()
+        await session.refresh(user)
+    except HTTPException as e:
+        raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
 
         if isinstance(e, IntegrityError):
             raise HTTPException(409, "This email is taken")
@@ -32,15 +43,20 @@ async def createUser(user: CreateUserRequest, session: Session = Depends(get_ses
 
 #Login form endpoint
 @post_router.post('/login')
-async def login(response: Response, login: LoginRequest, session: Session = Depends(get_session)):
+async def login(response: Response, login: LoginRequest, session: AsyncSession = Depends(get_session)):
     try:
-        #Check user with email exists
-        user = session.exec(select(User).where(User.email == login.email)).first()
+        #Check user with email exists and isn't being deleted. A deletion that failed for good leaves the account usable
+        user = (await session.exec(select(User).where((User.email == login.email) & ~exists().where((Job.userid == User.userid) & (Job.kind == DELETE_ACCOUNT) & Job.status.in_((QUEUED, RUNNING, DONE)))))).first()
 
         #Check password is correct for user
-        if (user is None or not checkPassword(login.password, user.password)):
+        if (user is None or not await checkPasswordAsync(login.password, user.password)):
             raise HTTPException(401, "Invalid email or password")
 
+        #Upgrade hashes made with an old cost factor while we have the plaintext password
+        if (PASSWORD_REHASH and needsRehash(user.password)):
+            user.password = await hashPasswordAsync(login.password)
+            await session.commit()
+
         #If validated, issue tokens and return to client
         expDate = datetime.now(timezone.utc) + timedelta(hours=4)
         tokens = issueTokens(user.userid, user.email, expDate)
@@ -74,7 +90,7 @@ async def login(response: Response, login: LoginRequest, session: Session = Depe
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(500, str(e))
     except Exception as e:
         raise HTTPException(500, str(e))
@@ -109,31 +125,27 @@ async def logout(response: Response):
     
 #Create a new contact
 @post_router.post('/createContact')
-async def createContact(request: Request, contactReq: CreateContactRequest, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> int:
+async def createContact(contactReq: CreateContactRequest, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)) -> int:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        contactId = session.exec(select(User.userid).where(User.email == contactReq.email)).first()
+        contactId = (await session.exec(select(User.userid).where(User.email == contactReq.email))).first()
 
         #Create a new contact using the user id associated with the email in the contact request
         if (contactId is not None):
             contact = Contact(**contactReq.model_dump())
-            contact.userid = userid
+            contact.userid = user.userid
             contact.contactid = contactId
+            contact.changeseq = await bumpDataVersion(session, user.userid)
             session.add(contact)
-            session.commit()
-            session.refresh(contact)
+            await session.commit()
+            await invalidateReadCache(user.userid, CONTACTS)
+            await session.refresh(contact)
             return contact.contactid
         else:
             raise HTTPException(404, "No users found with this email address")
     except HTTPException as e:
         raise
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
 
         if isinstance(e, IntegrityError):
             raise HTTPException(409, "This user is already one of your contacts")
@@ -142,78 +154,105 @@ async def createContact(request: Request, contactReq: CreateContactRequest, snip
     except Exception as e:
         raise HTTPException(500, str(e))
     
-#Check the validity of the jwt token and ensure the csrf token matches what is encoded in the jwt
+#Check the validity of the jwt token and ensure the csrf token matches what is encoded in the jwt.
+#getCurrentUser does the checking and raises 401 on failure
 @post_router.post('/checkAuth')
-async def checkAuth(request: Request, snipsnap_jwt: str = Cookie(None)):
-    try:
-        csrf = request.headers.get("snipsnap_csrf")
-
-        if (getAuthenticatedUser(csrf, snipsnap_jwt) <= -1):
-            raise HTTPException(401, "Unauthorized")
-    except HTTPException as e:
-        raise
-    except Exception as e:
-        raise HTTPException(500, str(e))
+async def checkAuth(user: UserContext = Depends(getCurrentUser)):
+    pass
     
-#Create snip endpoint
+#Create snip endpoint. The snip, its shares and the data version bump go out as one transaction
 @post_router.post('/createSnip')
-async def createSnip(request: Request, snipreq: SaveSnipRequest, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)):
-    secondCommit=False
-
+async def createSnip(snipreq: SaveSnipRequest, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)) -> int:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        collection = session.exec(select(Collection.collectionid).where((Collection.userid == userid) & (Collection.collectionid == snipreq.collectionid))).first()
-
-        if (snipreq.collectionid is not None and collection is None):
-            raise HTTPException(500, "Unable to create snip")
-        
+        sync = SyncChanges(user.userid, await bumpDataVersion(session, user.userid))
         snip = Snip(
-            userid=userid,
+            userid=user.userid,
             snipname=snipreq.snipname,
             snipdescription=snipreq.snipdescription,
             sniplanguage=snipreq.sniplanguage,
-            snipcontent=snipreq.snipcontent,
-            collectionid=snipreq.collectionid
+            **packSnipContent(snipreq.snipcontent),
+            collectionid=snipreq.collectionid,
+            changeseq=sync.changeseq
         )
+        values = snip.model_dump(exclude={"snipid"})
+
+        #INSERT ... SELECT so the collection ownership check rides along with the insert instead of costing a query
+        source = select(*(literal(value, type_=Snip.__table__.c[column].type) for column, value in values.items()))
+
+        if (snipreq.collectionid is not None):
+            source = source.where(exists().where((Collection.userid == user.userid) & (Collection.collectionid == snipreq.collectionid)))
+
+        snipId = (await session.exec(insert(Snip).from_select(list(values), source).returning(Snip.snipid))).scalar()
+
+        #Nothing inserted means the collection check failed: it doesn't exist or isn't the caller's. 404, like /batch
+        if (snipId is None):
+            raise HTTPException(404, "Collection not found")
 
-        session.add(snip)
-        session.commit()
-        session.refresh(snip)
+        sharedwith = list(dict.fromkeys(snipreq.sharedwith)) #Drop repeats, they would collide on the primary key
 
-        if len(snipreq.sharedwith) > 0:
-            secondCommit=True
-            sharedwith: List[Shared] = [Shared(snipid=snip.snipid, userid=userid, contactid=contactid) for contactid in snipreq.sharedwith]
-            session.add_all(sharedwith)
-            session.commit()
+        if (len(sharedwith) > 0):
+            #Parameter list rather than values(), so the statement compiles once and is cached whatever the share count
+            await session.exec(insert(Shared), params=[{"snipid": snipId, "userid": user.userid, "contactid": contactid} for contactid in sharedwith])
+            sync.added.update((snipId, contactid) for contactid in sharedwith)
+
+        sync.edited.add(snipId)
+        await sync.write(session)
+        await session.commit()
+        await invalidateReadCache(user.userid, SNIPS)
+        await invalidateSharedWithMe(sharedwith)
+        await publishChanges(sync, user.sessionid)
+
+        return snipId
+    except HTTPException as e:
+        raise
     except SQLAlchemyError as e:
-        session.rollback()
-        raise HTTPException(500, "Snip created, but there was a problem sharing with contacts" if secondCommit else str(e))
+        await session.rollback()
+        raise HTTPException(500, str(e))
     except Exception as e:
-        raise HTTPException(500, "Snip created, but there was a problem sharing with contacts" if secondCommit else str(e))
+        raise HTTPException(500, str(e))
     
 #Add collection
 @post_router.post('/createCollection/{collName}')
-async def createCollection(request: Request, collName: str, snipsnap_jwt: str = Cookie(None), session: Session = Depends(get_session)) -> int:
+async def createCollection(collName: str, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)) -> int:
     try:
-        csrf = request.headers.get("snipsnap_csrf")
-        userid = getAuthenticatedUser(csrf, snipsnap_jwt)
-
-        if (userid <= -1):
-            raise HTTPException(401, "Unauthorized")
-        
-        collection = Collection(userid=userid, collectionname=collName)
+        collection = Collection(userid=user.userid, collectionname=collName, changeseq=await bumpDataVersion(session, user.userid))
         session.add(collection)
-        session.commit()
-        session.refresh(collection)
+        await session.commit()
+        await invalidateReadCache(user.userid, COLLECTIONS)
+        await session.refresh(collection)
         
         return collection.collectionid
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
+        raise HTTPException(500, str(e))
+    except Exception as e:
         raise HTTPException(500, str(e))
+    
+#Add a library exported by /export (NDJSON request body) to the user's account. Records are written in chunks, each
+#its own transaction, so if a line fails the chunks before it stay imported and the error says how far it got
+@post_router.post('/import', response_model=ImportResult)
+async def importLibrary(request: Request, user: UserContext = Depends(getCurrentUser), session: AsyncSession = Depends(get_session)) -> ImportResult:
+    libraryImport = LibraryImport(session, user.userid)
+    imported = lambda: f". Lines up to {libraryImport.committedThrough} were imported" if libraryImport.committedThrough > 0 else ""
+
+    try:
+        async for lineNumber, line in readLines(request.stream()):
+            await libraryImport.add(lineNumber, line)
+
+        await libraryImport.flush()
+        return libraryImport.result
+    except HTTPException as e:
+        await session.rollback()
+        raise HTTPException(e.status_code, f"{e.detail}{imported()}")
+    except SQLAlchemyError as e:
+        await session.rollback()
+
+        if isinstance(e, IntegrityError):
+            raise HTTPException(409, f"{e.orig}{imported()}")
+        else:
+            raise HTTPException(500, f"{e}{imported()}")
     except Exception as e:
-        raise HTTPException(500, str(e))
\ No newline at end of file
+        raise HTTPException(500, str(e))
+    finally:
+        await libraryImport.invalidateCaches()
+        await publishChanges(libraryImport.committed, user.sessionid)
\ No newline at end of file
@@ -1,13 +1,30 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from config import init_db
+from config import JOB_WORKER, METRICS_ENABLED, engine, init_db, replicaEngines
 from endpoints.get_endpoints import get_router
 from endpoints.delete_endpoints import delete_router
 from endpoints.post_endpoints import post_router
 from endpoints.patch_endpoints import patch_router
+from endpoints.batch_endpoints import batch_router
+from endpoints.metrics_endpoints import metrics_router
+from endpoints.events_endpoints import events_router
+from utils.metrics import MetricsMiddleware, instrumentEngine
+from utils.security import shutdownPasswordPool
+from utils.jobs import startJobWorker, stopJobWorker
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+
+    if (JOB_WORKER):
+        startJobWorker()
+
+    yield
+    await stopJobWorker()
+    shutdownPasswordPool()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "https://app.snip-snap.org"
@@ -19,14 +36,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],       
     allow_headers=["*"],       
+    expose_headers=["ETag", "X-Next-Cursor"], #Lets the SPA read the snip list paging cursor and response versions
 )
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    init_db()
-    yield
+#Added last so it wraps everything else and times the whole request
+if (METRICS_ENABLED):
+    for instrumented in (engine, *replicaEngines):
+        instrumentEngine(instrumented)
+
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router)
 
 app.include_router(get_router)
 app.include_router(delete_router)
 app.include_router(post_router)
-app.include_router(patch_router)
\ No newline at end of file
+app.include_router(patch_router)
+app.include_router(batch_router)
+app.include_router(events_router)
\ No newline at end of file
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Connection, insert, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlmodel import select
+from models.db_models import Collection, Contact, Shared, Snip, User
+from models.http.request_models import SnipPageRequest, SnipSearchRequest
+from config import engine, init_db
+from utils.pagination import buildSnipPageQuery, encodeCursor, selectSnipList
+from utils.search import buildSearchQuery
+
+#Seeds a synthetic library, EXPLAINs the query behind each hot endpoint and fails if any of them falls back to a
+#sequential scan of a seeded table. Everything runs in one transaction that is rolled back, so it is safe to point
+#at a dev database. Run with: python -m migrations.check_plans
+SEED_USERS = 2000
+SEED_SNIPS_PER_USER = 25
+SEED_COLLECTIONS_PER_USER = 5
+SEED_CONTACTS_PER_USER = 5
+SEED_SHARE_EVERY = 5 #Every nth snip is shared with the owner's first two contacts
+
+CHECKED_TABLES = {"users", "collections", "snips", "contacts", "shared"}
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain, "postgresql")
+def _explainPostgres(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+@compiles(Explain, "sqlite")
+def _explainSqlite(element, compiler, **kw):
+    return "EXPLAIN QUERY PLAN " + compiler.process(element.statement, **kw)
+
+#Insert the synthetic library and return (ids of users, {userid: collection ids}, {userid: snip ids})
+def seed(connection: Connection) -> tuple:
+    now = datetime.now(timezone.utc)
+    userIds = connection.execute(insert(User.__table__).returning(User.__table__.c.userid, sort_by_parameter_order=True), [
+        {"email": f"plancheck-{i}@example.com", "password": "x", "firstname": "Plan", "lastname": "Check", "createdon": now, "lastmodified": now}
+        for i in range(SEED_USERS)
+    ]).scalars().all()
+
+    connection.execute(insert(Contact.__table__), [
+        {"userid": userId, "contactid": userIds[(i + c + 1) % len(userIds)], "displayname": "contact"}
+        for i, userId in enumerate(userIds) for c in range(SEED_CONTACTS_PER_USER)
+    ])
+
+    collectionRows = connection.execute(insert(Collection.__table__).returning(Collection.__table__.c.userid, Collection.__table__.c.collectionid, sort_by_parameter_order=True), [
+        {"userid": userId, "collectionname": f"collection {c}", "createdon": now, "lastmodified": now}
+        for userId in userIds for c in range(SEED_COLLECTIONS_PER_USER)
+    ]).all()
+    collections = {}
+
+    for userId, collectionId in collectionRows:
+        collections.setdefault(userId, []).append(collectionId)
+
+    snipRows = connection.execute(insert(Snip.__table__).returning(Snip.__table__.c.userid, Snip.__table__.c.snipid, sort_by_parameter_order=True), [
+        {
+            "userid": userId,
+            "collectionid": collections[userId][s % SEED_COLLECTIONS_PER_USER],
+            "snipname": f"snip {s}",
+            "sniplanguage": "python" if s % 2 else "javascript",
+            "snipdescription": "seeded",
+            "snipcontent": "print('hello')",
+            "createdon": now,
+            "lastmodified": now - timedelta(minutes=s)
+        }
+        for userId in userIds for s in range(SEED_SNIPS_PER_USER)
+    ]).all()
+    snips = {}
+
+    for userId, snipId in snipRows:
+        snips.setdefault(userId, []).append(snipId)
+
+    connection.execute(insert(Shared.__table__), [
+        {"snipid": snipId, "userid": userId, "contactid": userIds[(i + c + 1) % len(userIds)]}
+        for i, userId in enumerate(userIds) for s, snipId in enumerate(snips[userId]) if s % SEED_SHARE_EVERY == 0 for c in range(2)
+    ])
+
+    return (userIds, collections, snips)
+
+#The statements behind each endpoint, built the same way the routers build them
+def endpointQueries(dialectName: str, userId: int, collectionId: int, snipIds: list) -> dict:
+    firstPage = SnipPageRequest()
+    secondPage = SnipPageRequest(cursor=encodeCursor(datetime.now(timezone.utc) - timedelta(minutes=10), snipIds[10]))
+
+    return {
+        "login": select(User).where(User.email == "plancheck-7@example.com"),
+        "createContact": select(User.userid).where(User.email == "plancheck-8@example.com"),
+        "getSnips": buildSnipPageQuery(selectSnipList().where(Snip.userid == userId), firstPage),
+        "getSnips (next page)": buildSnipPageQuery(selectSnipList().where(Snip.userid == userId), secondPage),
+        "getSnips (language filter)": buildSnipPageQuery(selectSnipList().where(Snip.userid == userId), SnipPageRequest(sniplanguage="python")),
+        "getSharedWithMe": buildSnipPageQuery(selectSnipList().join(Shared, Shared.snipid == Snip.snipid).where(Shared.contactid == userId), firstPage),
+        "getCollectionSnips": buildSnipPageQuery(selectSnipList().where((Snip.userid == userId) & (Snip.collectionid == collectionId)), firstPage),
+        "getCollections": select(Collection).where(Collection.userid == userId),
+        "getSnipDetails (shared check)": select(Shared).where((Shared.contactid == userId) & (Shared.snipid == snipIds[0])),
+        "getSnipDetails (sharedwith)": select(Shared).where(Shared.snipid.in_(snipIds[:5])),
+        "getSettings (contacts)": select(Contact).where(Contact.userid.in_([userId])),
+        "searchSnips": buildSearchQuery(dialectName, userId, SnipSearchRequest(q="hello")),
+    }
+
+#Return the names of checked tables the plan reads with a full scan
+def findSequentialScans(connection: Connection, plan) -> list:
+    scans = []
+
+    if (connection.dialect.name == "postgresql"):
+        def walk(node):
+            if (node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in CHECKED_TABLES):
+                scans.append(node["Relation Name"])
+
+            for child in node.get("Plans", []):
+                walk(child)
+
+        #asyncpg hands the JSON plan back as text, psycopg2 already decoded
+        document = json.loads(plan[0][0]) if isinstance(plan[0][0], str) else plan[0][0]
+        walk(document[0]["Plan"])
+    else:
+        #sqlite rows are (id, parent, notused, detail). A detail of "SCAN <table>" with no index is a full scan
+        for row in plan:
+            words = row[3].split()
+
+            if (len(words) >= 2 and words[0] == "SCAN" and words[1] in CHECKED_TABLES and "INDEX" not in row[3]):
+                scans.append(words[1])
+
+    return scans
+
+def checkPlans(connection: Connection) -> list:
+    userIds, collections, snips = seed(connection)
+
+    if (connection.dialect.name == "postgresql"):
+        connection.execute(text("ANALYZE users, collections, snips, contacts, shared"))
+    else:
+        connection.execute(text("ANALYZE"))
+
+    userId = userIds[len(userIds) // 2]
+    failures = []
+
+    for name, query in endpointQueries(connection.dialect.name, userId, collections[userId][0], snips[userId]).items():
+        plan = connection.execute(Explain(query)).all()
+        scans = findSequentialScans(connection, plan)
+        print(f"{'FAIL' if scans else 'ok  '} {name}" + (f" (sequential scan on {', '.join(scans)})" if scans else ""))
+
+        if (scans):
+            failures.append(name)
+
+    return failures
+
+async def main() -> int:
+    await init_db()
+
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+
+        try:
+            failures = await conn.run_sync(checkPlans)
+        finally:
+            await trans.rollback()
+
+    await engine.dispose()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,5 @@
+from sqlalchemy import Connection, inspect
+
+#Shared checks for migrations that must be safe to run against databases the old create_all init_db built from the models of its day
+def columnExists(connection: Connection, tableName: str, columnName: str) -> bool:
+    return any(c["name"] == columnName for c in inspect(connection).get_columns(tableName))
@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, Connection, DateTime, Integer, MetaData, String, Table, insert, select, text
+from migrations import v0001_initial_schema, v0002_hot_path_indexes, v0003_user_data_version, v0004_snip_search, v0005_snip_content_compression, v0006_sync_change_sequence, v0007_background_jobs, v0008_snip_revisions, v0009_compressed_snip_search, v0010_search_vector_limits
+
+#Versioned schema migrations, applied in order by init_db at startup. Each migration module has a VERSION,
+#a NAME and an upgrade(connection) function. v0001 builds the tables as they were before migrations, and each later
+#migration adds what it is named for. Databases the old create_all init_db built may already have some of it, so
+#migrations still check for what they add (checkfirst, inspector) rather than assume an old schema
+MIGRATIONS = [
+    v0001_initial_schema,
+    v0002_hot_path_indexes,
+    v0003_user_data_version,
+    v0004_snip_search,
+    v0005_snip_content_compression,
+    v0006_sync_change_sequence,
+    v0007_background_jobs,
+    v0008_snip_revisions,
+    v0009_compressed_snip_search,
+    v0010_search_vector_limits,
+]
+
+MIGRATION_LOCK_KEY = 7231840 #Arbitrary postgres advisory lock id so only one worker migrates at a time
+
+#Kept off SQLModel.metadata so create_all elsewhere never touches it
+schemaMigrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("appliedon", DateTime(timezone=True), nullable=False),
+)
+
+#Apply any migrations not yet recorded in schema_migrations. Runs inside the caller's transaction, so on postgres
+#a failed migration rolls back completely. Returns the versions applied
+def runMigrations(connection: Connection) -> list:
+    if (connection.dialect.name == "postgresql"):
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+    schemaMigrations.create(connection, checkfirst=True)
+    applied = set(connection.execute(select(schemaMigrations.c.version)).scalars())
+    newlyApplied = []
+
+    for migration in MIGRATIONS:
+        if (migration.VERSION in applied):
+            continue
+
+        migration.upgrade(connection)
+        connection.execute(insert(schemaMigrations).values(
+            version=migration.VERSION,
+            name=migration.NAME,
+            appliedon=datetime.now(timezone.utc)
+        ))
+        newlyApplied.append(migration.VERSION)
+
+    return newlyApplied
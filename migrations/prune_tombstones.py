@@ -0,0 +1,17 @@
+import asyncio
+from config import SYNC_TOMBSTONE_DAYS, engine, init_db
+from utils.sync import pruneTombstones
+
+#Delete tombstones older than SYNC_TOMBSTONE_DAYS. Clients whose sync token is older get a full sync instead, so this
+#is safe to run against a live database at any time. Run daily with: python -m migrations.prune_tombstones
+async def main():
+    await init_db()
+
+    async with engine.begin() as conn:
+        pruned = await pruneTombstones(conn)
+
+    await engine.dispose()
+    print(f"Pruned {pruned} tombstones older than {SYNC_TOMBSTONE_DAYS} days")
+
+if __name__ == "__main__":
+    asyncio.run(main())
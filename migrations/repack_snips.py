@@ -0,0 +1,17 @@
+import asyncio
+from config import SNIP_COMPRESSION, engine, init_db
+from utils.snip_content import repackSnips
+
+#Compress or decompress stored snip bodies after SNIP_COMPRESSION or its threshold changes. Commits batch by batch, so
+#it can run against a live database and be stopped and rerun safely. Run with: python -m migrations.repack_snips
+async def main():
+    await init_db()
+
+    async with engine.connect() as conn:
+        repacked = await conn.run_sync(lambda connection: repackSnips(connection, commit=True))
+
+    await engine.dispose()
+    print(f"{'Compressed' if SNIP_COMPRESSION else 'Decompressed'} {repacked} snips")
+
+if __name__ == "__main__":
+    asyncio.run(main())
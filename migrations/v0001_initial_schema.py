@@ -0,0 +1,63 @@
+from sqlalchemy import Column, Connection, DateTime, ForeignKey, ForeignKeyConstraint, Integer, MetaData, PrimaryKeyConstraint, String, Table
+
+VERSION = 1
+NAME = "initial schema"
+
+#The tables as they were before versioned migrations, the same result as the create_all init_db used to run. Frozen
+#here rather than built from models/db_models.py, so a fresh database goes through every later migration just like
+#an existing one, and later columns and indexes only ever come from the migration that added them. Existing databases
+#already have these tables, so this only fills gaps
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("userid", Integer, primary_key=True),
+    Column("email", String, nullable=False),
+    Column("password", String, nullable=False),
+    Column("firstname", String, nullable=False),
+    Column("lastname", String, nullable=False),
+    Column("createdon", DateTime, nullable=False),
+    Column("lastmodified", DateTime, nullable=False),
+)
+
+Table(
+    "collections", metadata,
+    Column("collectionid", Integer, primary_key=True),
+    Column("userid", Integer, ForeignKey("users.userid"), nullable=False),
+    Column("collectionname", String, nullable=False),
+    Column("createdon", DateTime, nullable=False),
+    Column("lastmodified", DateTime, nullable=False),
+)
+
+Table(
+    "snips", metadata,
+    Column("snipid", Integer, primary_key=True),
+    Column("userid", Integer, ForeignKey("users.userid"), nullable=False),
+    Column("collectionid", Integer, ForeignKey("collections.collectionid"), nullable=False),
+    Column("snipname", String, nullable=False),
+    Column("sniplanguage", String, nullable=False),
+    Column("snipdescription", String, nullable=False),
+    Column("snipcontent", String, nullable=False),
+    Column("createdon", DateTime, nullable=False),
+    Column("lastmodified", DateTime, nullable=False),
+)
+
+Table(
+    "contacts", metadata,
+    Column("userid", Integer, ForeignKey("users.userid"), nullable=False),
+    Column("contactid", Integer, ForeignKey("users.userid"), nullable=False),
+    Column("displayname", String, nullable=False),
+    PrimaryKeyConstraint("userid", "contactid"),
+)
+
+Table(
+    "shared", metadata,
+    Column("snipid", Integer, ForeignKey("snips.snipid"), nullable=False),
+    Column("userid", Integer, nullable=False),
+    Column("contactid", Integer, nullable=False),
+    PrimaryKeyConstraint("snipid", "userid", "contactid"),
+    ForeignKeyConstraint(["userid", "contactid"], ["contacts.userid", "contacts.contactid"]),
+)
+
+def upgrade(connection: Connection):
+    metadata.create_all(connection)
@@ -0,0 +1,26 @@
+from sqlalchemy import Connection, func, select
+from models.db_models import Collection, Shared, Snip, User
+
+VERSION = 2
+NAME = "hot path indexes"
+
+INDEXES = [
+    (User, "ix_users_email"),
+    (Collection, "ix_collections_userid"),
+    (Snip, "ix_snips_userid_lastmodified_snipid"),
+    (Snip, "ix_snips_collectionid_lastmodified_snipid"),
+    (Shared, "ix_shared_contactid_snipid"),
+]
+
+#Add the secondary indexes every hot lookup relies on. Tables created before these were declared have none,
+#so lookups by owner, collection, recipient and email were sequential scans
+def upgrade(connection: Connection):
+    #Email was never unique, so refuse to build the unique index over duplicates rather than drop an account
+    duplicates = connection.execute(select(User.email).group_by(User.email).having(func.count() > 1).limit(5)).scalars().all()
+
+    if (len(duplicates) > 0):
+        raise RuntimeError(f"Cannot add unique index on users.email, duplicate emails exist: {duplicates}")
+
+    for model, indexName in INDEXES:
+        index = next(i for i in model.__table__.indexes if i.name == indexName)
+        index.create(connection, checkfirst=True)
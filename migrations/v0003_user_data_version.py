@@ -0,0 +1,10 @@
+from sqlalchemy import Connection, text
+from migrations.helpers import columnExists
+
+VERSION = 3
+NAME = "user data version"
+
+#Per-user counter bumped by every write, used to build ETags for the read endpoints
+def upgrade(connection: Connection):
+    if (not columnExists(connection, "users", "dataversion")):
+        connection.execute(text("ALTER TABLE users ADD COLUMN dataversion INTEGER NOT NULL DEFAULT 0"))
@@ -0,0 +1,65 @@
+from sqlalchemy import Connection, text
+from migrations.helpers import columnExists
+
+VERSION = 4
+NAME = "snip search index"
+
+#Full text search over snipname, snipdescription and snipcontent for /searchSnips. The index is maintained by the
+#database on every write: a generated tsvector column with a GIN index on postgres, an external content FTS5 table
+#kept in step by triggers on sqlite. Neither is part of the Snip model, so ORM selects never load it
+
+#'simple' doesn't stem or drop stop words, which suits code and identifiers better than a natural language config.
+#A tsvector can't pass 1 MB, so only the start of each column is indexed: at most about 5 bytes of tsvector per
+#character even when every word is distinct, well under the limit. Bodies longer than that are found by their first
+#100k characters. v0010 moves databases that built the column without the limits onto this expression
+POSTGRES_SEARCH_VECTOR = """
+    setweight(to_tsvector('simple', left(coalesce(snipname, ''), 1000)), 'A') ||
+    setweight(to_tsvector('simple', left(coalesce(snipdescription, ''), 10000)), 'B') ||
+    setweight(to_tsvector('simple', left(coalesce(snipcontent, ''), 100000)), 'C')
+"""
+
+def _upgradePostgres(connection: Connection):
+    if (not columnExists(connection, "snips", "searchvector")):
+        connection.execute(text(f"ALTER TABLE snips ADD COLUMN searchvector tsvector GENERATED ALWAYS AS ({POSTGRES_SEARCH_VECTOR}) STORED"))
+
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_snips_searchvector ON snips USING gin (searchvector)"))
+
+    #Trigram matching on names catches typos and partial words. pg_trgm ships with postgres contrib but isn't always
+    #installed, so search works without it and only uses it when the extension is there
+    if (connection.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is not None):
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_snips_snipname_trgm ON snips USING gin (snipname gin_trgm_ops)"))
+
+def _upgradeSqlite(connection: Connection):
+    connection.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS snips_fts USING fts5(
+            snipname, snipdescription, snipcontent, content='snips', content_rowid='snipid'
+        )
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS snips_fts_insert AFTER INSERT ON snips BEGIN
+            INSERT INTO snips_fts(rowid, snipname, snipdescription, snipcontent)
+            VALUES (new.snipid, new.snipname, new.snipdescription, new.snipcontent);
+        END
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS snips_fts_delete AFTER DELETE ON snips BEGIN
+            INSERT INTO snips_fts(snips_fts, rowid, snipname, snipdescription, snipcontent)
+            VALUES ('delete', old.snipid, old.snipname, old.snipdescription, old.snipcontent);
+        END
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS snips_fts_update AFTER UPDATE ON snips BEGIN
+            INSERT INTO snips_fts(snips_fts, rowid, snipname, snipdescription, snipcontent)
+            VALUES ('delete', old.snipid, old.snipname, old.snipdescription, old.snipcontent);
+            INSERT INTO snips_fts(rowid, snipname, snipdescription, snipcontent)
+            VALUES (new.snipid, new.snipname, new.snipdescription, new.snipcontent);
+        END
+    """))
+    connection.execute(text("INSERT INTO snips_fts(snips_fts) VALUES ('rebuild')")) #Index the rows that predate the triggers
+
+def upgrade(connection: Connection):
+    if (connection.dialect.name == "postgresql"):
+        _upgradePostgres(connection)
+    elif (connection.dialect.name == "sqlite"):
+        _upgradeSqlite(connection)
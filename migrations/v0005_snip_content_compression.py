@@ -0,0 +1,13 @@
+from sqlalchemy import Connection, text
+from migrations.helpers import columnExists
+
+VERSION = 5
+NAME = "snip content compression"
+
+#Column for compressed snip bodies, then bring existing rows in line with SNIP_COMPRESSION. See utils/snip_content.py
+def upgrade(connection: Connection):
+    if (not columnExists(connection, "snips", "snipcontentz")):
+        connection.execute(text(f"ALTER TABLE snips ADD COLUMN snipcontentz {'BYTEA' if connection.dialect.name == 'postgresql' else 'BLOB'}"))
+
+    from utils.snip_content import repackSnips #Imported here since config imports the migrations
+    repackSnips(connection)
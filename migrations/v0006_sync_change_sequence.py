@@ -0,0 +1,26 @@
+from sqlalchemy import Connection, text
+from migrations.helpers import columnExists
+from models.db_models import Collection, Contact, ShareFeed, Shared, Snip, Tombstone
+
+VERSION = 6
+NAME = "sync change sequence"
+
+INDEXES = [
+    (Snip, "ix_snips_userid_changeseq"),
+    (Collection, "ix_collections_userid_changeseq"),
+    (Contact, "ix_contacts_userid_changeseq"),
+    (Shared, "ix_shared_contactid_changeseq"),
+]
+
+#Change sequence columns, tombstones and share feeds for /sync, see utils/sync.py. Existing rows get changeseq 0, which
+#only a full sync returns
+def upgrade(connection: Connection):
+    for model, indexName in INDEXES:
+        if (not columnExists(connection, model.__tablename__, "changeseq")):
+            connection.execute(text(f"ALTER TABLE {model.__tablename__} ADD COLUMN changeseq INTEGER NOT NULL DEFAULT 0"))
+
+        index = next(i for i in model.__table__.indexes if i.name == indexName)
+        index.create(connection, checkfirst=True)
+
+    Tombstone.__table__.create(connection, checkfirst=True)
+    ShareFeed.__table__.create(connection, checkfirst=True)
@@ -0,0 +1,9 @@
+from sqlalchemy import Connection
+from models.db_models import Job
+
+VERSION = 7
+NAME = "background jobs"
+
+#Job queue table for deletions run in the background, see utils/jobs.py
+def upgrade(connection: Connection):
+    Job.__table__.create(connection, checkfirst=True)
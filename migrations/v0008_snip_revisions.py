@@ -0,0 +1,14 @@
+from sqlalchemy import Connection, text
+from migrations.helpers import columnExists
+from models.db_models import SnipRevision
+
+VERSION = 8
+NAME = "snip revisions"
+
+#Revision history for snip bodies, see utils/revisions.py. Existing snips start at revision 0, their first edit records
+#the body it replaces
+def upgrade(connection: Connection):
+    if (not columnExists(connection, "snips", "revision")):
+        connection.execute(text("ALTER TABLE snips ADD COLUMN revision INTEGER NOT NULL DEFAULT 0"))
+
+    SnipRevision.__table__.create(connection, checkfirst=True)
@@ -0,0 +1,11 @@
+from sqlalchemy import Connection
+
+VERSION = 9
+NAME = "compressed snip search"
+
+#Snips compressed by v0005 or since kept '' in snipcontent, so the search index had nothing of their bodies. Give them
+#their search vocabulary, see utils/snip_content.py. The index triggers (sqlite) and generated column (postgres) pick
+#it up with the update
+def upgrade(connection: Connection):
+    from utils.snip_content import repackSnips #Imported here since config imports the migrations
+    repackSnips(connection)
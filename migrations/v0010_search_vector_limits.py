@@ -0,0 +1,23 @@
+from sqlalchemy import Connection, text
+from migrations.v0004_snip_search import POSTGRES_SEARCH_VECTOR
+
+VERSION = 10
+NAME = "search vector limits"
+
+#v0004 first indexed whole columns, and a snip big enough to pass the 1 MB tsvector limit failed to save. A generated
+#column's expression can't be altered in place, so the column is built again with the limited expression, its index
+#with it. Databases that got v0004 with the limits already, and sqlite, which has no such limit, are left as they are
+def upgrade(connection: Connection):
+    if (connection.dialect.name != "postgresql"):
+        return
+
+    expression = connection.execute(text(
+        "SELECT generation_expression FROM information_schema.columns WHERE table_name = 'snips' AND column_name = 'searchvector'"
+    )).scalar()
+
+    if (expression is not None and "left" in expression): #Deparsed as "left"(...)
+        return
+
+    connection.execute(text("ALTER TABLE snips DROP COLUMN IF EXISTS searchvector"))
+    connection.execute(text(f"ALTER TABLE snips ADD COLUMN searchvector tsvector GENERATED ALWAYS AS ({POSTGRES_SEARCH_VECTOR}) STORED"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_snips_searchvector ON snips USING gin (searchvector)"))
@@ -1,16 +1,30 @@
 from typing import List
-from sqlmodel import Field, ForeignKeyConstraint, PrimaryKeyConstraint, Relationship, SQLModel
+from sqlalchemy import DateTime, LargeBinary, TypeDecorator
+from sqlmodel import Field, ForeignKeyConstraint, Index, PrimaryKeyConstraint, Relationship, SQLModel
 from datetime import datetime, timezone
 
+#asyncpg rejects timezone aware datetimes for TIMESTAMP WITHOUT TIME ZONE columns (psycopg2 quietly dropped the offset).
+#Convert to naive UTC on the way in so existing tables keep their column type
+class UTCDateTime(TypeDecorator):
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if (value is not None and value.tzinfo is not None):
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+        return value
+
 class User(SQLModel, table=True):
     __tablename__ = 'users'
     userid: int = Field(default=None, primary_key=True)
-    email: str
+    email: str = Field(unique=True, index=True) #Unique index. Login and createContact look users up by email
     password: str
     firstname: str
     lastname: str
-    createdon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc)) #since args need to be passed to datetime.now(), lamba delays execution to prevent the funtion being called immediately at runtime
-    lastmodified: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    dataversion: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) #Bumped by every write to the user's data. Read endpoints build ETags from it
+    createdon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime) #since args need to be passed to datetime.now(), lamba delays execution to prevent the funtion being called immediately at runtime
+    lastmodified: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime)
 
     #Non-column ORM relationships
     contacts: List["Contact"] = Relationship(back_populates="user", sa_relationship_kwargs={"foreign_keys": "Contact.userid"})
@@ -19,11 +33,15 @@ class User(SQLModel, table=True):
 
 class Collection(SQLModel, table=True):
     __tablename__ = "collections"
+    __table_args__ = (
+        Index("ix_collections_userid_changeseq", "userid", "changeseq"), #Changes since a sync token
+    )
     collectionid: int = Field(default=None, primary_key=True)
-    userid: int = Field(foreign_key="users.userid")
+    userid: int = Field(foreign_key="users.userid", index=True)
     collectionname: str
-    createdon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    lastmodified: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    changeseq: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) #Owner's dataversion when last written, see utils/sync.py
+    createdon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime)
+    lastmodified: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime)
 
     #Non-column ORM relationships
     user: User = Relationship(back_populates="collections", sa_relationship_kwargs={"foreign_keys": "Collection.userid"})
@@ -31,15 +49,23 @@ class Collection(SQLModel, table=True):
 
 class Snip(SQLModel, table=True):
     __tablename__ = "snips"
+    __table_args__ = (
+        Index("ix_snips_userid_lastmodified_snipid", "userid", "lastmodified", "snipid"), #Keyset pagination for getSnips
+        Index("ix_snips_collectionid_lastmodified_snipid", "collectionid", "lastmodified", "snipid"), #Keyset pagination for getCollectionSnips
+        Index("ix_snips_userid_changeseq", "userid", "changeseq"), #Changes since a sync token
+    ) #The search index (snips.searchvector on postgres, snips_fts on sqlite) lives outside the model, see migrations/v0004_snip_search.py
     snipid: int = Field(default=None, primary_key=True)
     userid: int = Field(foreign_key="users.userid")
     collectionid: int = Field(default=None, foreign_key="collections.collectionid")
     snipname: str
     sniplanguage: str
     snipdescription: str
-    snipcontent: str
-    createdon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc)) 
-    lastmodified: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    snipcontent: str #The body, or when it is stored compressed in snipcontentz its search vocabulary, which keeps it searchable. Never blank it
+    snipcontentz: bytes | None = Field(default=None, sa_type=LargeBinary) #zlib compressed body of large snips, see utils/snip_content.py
+    changeseq: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) #Owner's dataversion when last written, see utils/sync.py
+    revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) #Latest sniprevisions entry, 0 until the first edit. See utils/revisions.py
+    createdon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime) 
+    lastmodified: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime)
 
     #Non-column ORM relationships
     user: User = Relationship(back_populates="snips", sa_relationship_kwargs={"foreign_keys": "Snip.userid"})
@@ -50,10 +76,12 @@ class Contact(SQLModel, table=True):
     __tablename__ = "contacts"
     __table_args__ = (
         PrimaryKeyConstraint("userid", "contactid"), #must have primary key defined. Trailing comma necessary to indicate tuple type
+        Index("ix_contacts_userid_changeseq", "userid", "changeseq"), #Changes since a sync token
     )
     userid: int = Field(foreign_key="users.userid")
     contactid: int = Field(foreign_key="users.userid")
     displayname: str
+    changeseq: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) #Owner's dataversion when last written, see utils/sync.py
 
     #Non-column ORM relationships
     user: User = Relationship(back_populates="contacts", sa_relationship_kwargs={"foreign_keys": "Contact.userid"})
@@ -66,10 +94,77 @@ class Shared(SQLModel, table=True):
             ["userid", "contactid"],
             ["contacts.userid", "contacts.contactid"]
         ),
+        Index("ix_shared_contactid_snipid", "contactid", "snipid"), #getSharedWithMe looks shares up by recipient
+        Index("ix_shared_contactid_changeseq", "contactid", "changeseq"), #Shared with me changes since a sync token
     )
     snipid: int = Field(foreign_key="snips.snipid")
     userid: int
     contactid: int
+    changeseq: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) #Recipient's sharefeeds version when the share or its snip last changed
 
     #Non-column ORM relationships
-    snip: Snip = Relationship(back_populates="sharedwith", sa_relationship_kwargs={"foreign_keys": "Shared.snipid"})
\ No newline at end of file
+    snip: Snip = Relationship(back_populates="sharedwith", sa_relationship_kwargs={"foreign_keys": "Shared.snipid"})
+
+#Left behind by deletes so /sync can tell clients what to drop. kind is the list the object was in (a read cache
+#resource name: snips, collections, contacts or sharedwithme), changeseq is in the same sequence as the list's rows.
+#No foreign keys, a tombstone outlives what it marks. Old ones are pruned, see migrations/prune_tombstones.py
+class Tombstone(SQLModel, table=True):
+    __tablename__ = "tombstones"
+    __table_args__ = (
+        Index("ix_tombstones_userid_changeseq", "userid", "changeseq"),
+    )
+    tombstoneid: int = Field(default=None, primary_key=True)
+    userid: int
+    kind: str
+    objectid: int
+    changeseq: int
+    deletedon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime, index=True)
+
+#Change counter for the snips shared with a user, kept apart from users.dataversion since it is bumped by the
+#sharers' transactions. Locking another user's users row there could deadlock against that user's own writes
+class ShareFeed(SQLModel, table=True):
+    __tablename__ = "sharefeeds"
+    userid: int = Field(primary_key=True)
+    version: int = 0
+
+#Background work queued by a request and carried out by the job worker in small transactions, see utils/jobs.py.
+#target is what the job works on (a userid or collectionid, depending on kind). No foreign keys, an account deletion
+#job outlives the account
+class Job(SQLModel, table=True):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_runafter", "status", "runafter"), #The worker's next job to claim
+        Index("ix_jobs_userid_kind", "userid", "kind"), #Login turns away accounts being deleted
+    )
+    jobid: int = Field(default=None, primary_key=True)
+    userid: int
+    kind: str
+    target: int
+    status: str = "queued" #queued, running, done or failed
+    progress: int = 0 #Rows deleted so far
+    attempts: int = 0 #Failed runs, the job fails for good after JOB_MAX_ATTEMPTS
+    error: str | None = None #Last failure
+    workerid: str | None = None #Worker holding the job while running
+    runafter: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime) #Retries wait until then
+    leaseduntil: datetime | None = Field(default=None, sa_type=UTCDateTime) #Another worker may take over a running job after this
+    createdon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime)
+    lastmodified: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime)
+
+#Earlier versions of a snip's body, see utils/revisions.py. A snapshot holds the whole body zlib compressed, a delta the
+#edit from the revision before it. chainlength and chainbytes count the deltas (and their stored bytes) since the last
+#snapshot, up to and including this one, so the next edit can tell when to take a snapshot again
+class SnipRevision(SQLModel, table=True):
+    __tablename__ = "sniprevisions"
+    __table_args__ = (
+        Index("ix_sniprevisions_snipid_revision", "snipid", "revision", unique=True),
+    )
+    revisionid: int = Field(default=None, primary_key=True)
+    snipid: int = Field(foreign_key="snips.snipid")
+    userid: int = Field(foreign_key="users.userid", index=True) #Account deletion clears revisions by owner
+    revision: int
+    kind: str #snapshot or delta
+    data: bytes = Field(sa_type=LargeBinary)
+    contentlength: int #Characters in this revision's body
+    chainlength: int = 0
+    chainbytes: int = 0
+    createdon: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), sa_type=UTCDateTime)
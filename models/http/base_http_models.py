@@ -1,4 +1,5 @@
 from datetime import datetime
+from pydantic import ConfigDict
 from sqlmodel import SQLModel
 
 class UserBase(SQLModel):
@@ -16,11 +17,9 @@ class CollectionBase(SQLModel):
     collectionid: int
 
 class SnipBase(SQLModel):
+    model_config = ConfigDict(from_attributes=True) #Allow object mapping on select
+
     snipid: int
     snipname: str
     sniplanguage: str
-    snipdescription: str
-
-    #Need this pydantic nested Config class to allow object mapping on select
-    class Config:
-        orm_mode = True
\ No newline at end of file
+    snipdescription: str
\ No newline at end of file
@@ -1,5 +1,7 @@
-from typing import List
+from typing import Annotated, List, Literal, Union
+from sqlmodel import Field
 from models.http.base_http_models import *
+from config import BATCH_MAX_SIZE, SNIP_PAGE_MAX, SNIP_PAGE_SIZE
 
 class UpdateUserRequest(UserBase):
     lastmodified: datetime
@@ -22,4 +24,106 @@ class SaveSnipRequest(SnipBase):
     snipcontent: str
     collectionid: int | None
     lastmodified: datetime
-    sharedwith: List[int]
\ No newline at end of file
+    sharedwith: List[int]
+
+#Query parameters shared by the snip list endpoints. cursor is the opaque X-Next-Cursor value from the previous page
+class SnipPageRequest(SQLModel):
+    cursor: str | None = None
+    limit: int = Field(default=SNIP_PAGE_SIZE, ge=1, le=SNIP_PAGE_MAX)
+    sniplanguage: str | None = None
+    nameprefix: str | None = None
+
+#Query parameters for /getSnipRevisions. before is the oldest revision number on the previous page
+class RevisionPageRequest(SQLModel):
+    before: int | None = None
+    limit: int = Field(default=SNIP_PAGE_SIZE, ge=1, le=SNIP_PAGE_MAX)
+
+#Query parameters for /searchSnips. cursor is the opaque X-Next-Cursor value from the previous page
+class SnipSearchRequest(SQLModel):
+    q: str = Field(min_length=1, max_length=200)
+    cursor: str | None = None
+    limit: int = Field(default=SNIP_PAGE_SIZE, ge=1, le=SNIP_PAGE_MAX)
+
+#Operations accepted by /batch. op names the single endpoint the operation stands in for and the other fields carry
+#what that endpoint takes
+class BatchCreateSnip(SQLModel):
+    op: Literal["createSnip"]
+    snip: SaveSnipRequest
+
+class BatchEditSnip(SQLModel):
+    op: Literal["editSnip"]
+    snip: SaveSnipRequest
+
+class BatchDeleteSnip(SQLModel):
+    op: Literal["deleteSnip"]
+    snipid: int
+
+class BatchCreateCollection(SQLModel):
+    op: Literal["createCollection"]
+    collectionname: str
+
+class BatchEditCollectionName(SQLModel):
+    op: Literal["editCollectionName"]
+    collection: UpdateCollectionRequest
+
+class BatchDeleteCollection(SQLModel):
+    op: Literal["deleteCollection"]
+    collectionid: int
+
+class BatchCreateContact(SQLModel):
+    op: Literal["createContact"]
+    contact: CreateContactRequest
+
+class BatchDeleteContact(SQLModel):
+    op: Literal["deleteContact"]
+    contactid: int
+
+BatchOperation = Annotated[Union[
+    BatchCreateSnip, BatchEditSnip, BatchDeleteSnip,
+    BatchCreateCollection, BatchEditCollectionName, BatchDeleteCollection,
+    BatchCreateContact, BatchDeleteContact
+], Field(discriminator="op")]
+
+class BatchRequest(SQLModel):
+    operations: List[BatchOperation] = Field(min_length=1, max_length=BATCH_MAX_SIZE)
+
+#Records of the NDJSON library format written by /export and read by /import, one JSON object per line. Ids are the
+#ones on the exporting server and only tie records in the same file together. Contacts and shares name users by
+#email so a library can move between servers
+LIBRARY_FORMAT_VERSION = 1
+
+class LibraryHeaderRecord(SQLModel):
+    type: Literal["header"]
+    version: int
+
+class LibraryCollectionRecord(SQLModel):
+    type: Literal["collection"]
+    collectionid: int
+    collectionname: str
+    createdon: datetime | None = None
+    lastmodified: datetime | None = None
+
+class LibraryContactRecord(SQLModel):
+    type: Literal["contact"]
+    email: str
+    displayname: str
+
+class LibrarySnipRecord(SQLModel):
+    type: Literal["snip"]
+    snipid: int
+    collectionid: int | None
+    snipname: str
+    sniplanguage: str
+    snipdescription: str
+    snipcontent: str
+    createdon: datetime | None = None
+    lastmodified: datetime | None = None
+
+class LibraryShareRecord(SQLModel):
+    type: Literal["share"]
+    snipid: int
+    email: str
+
+LibraryRecord = Annotated[Union[
+    LibraryHeaderRecord, LibraryCollectionRecord, LibraryContactRecord, LibrarySnipRecord, LibraryShareRecord
+], Field(discriminator="type")]
@@ -27,4 +27,62 @@ class SnipDetailsResponse(SnipBase):
 
 class SnipInitResponse(BaseModel):
     contacts: List[ContactsResponse]
-    collections: List[CollectionResponse]
\ No newline at end of file
+    collections: List[CollectionResponse]
+
+#One entry of /getSnipRevisions. contentlength is the body's length in characters
+class SnipRevisionResponse(BaseModel):
+    revision: int
+    contentlength: int
+    createdon: datetime
+
+class SnipRevisionDetailsResponse(BaseModel):
+    revision: int
+    createdon: datetime
+    snipcontent: str
+
+#Result of one /batch operation. id is the row created or targeted, applied is False when an edit or delete matched nothing
+class BatchResult(BaseModel):
+    op: str
+    id: int
+    applied: bool
+
+#Rows written by /import. skipped counts contacts and shares naming users that don't exist here
+class ImportResult(BaseModel):
+    collections: int = 0
+    contacts: int = 0
+    snips: int = 0
+    shares: int = 0
+    skipped: int = 0
+
+#Ids dropped from each list since the sync token
+class SyncDeleted(BaseModel):
+    snips: List[int]
+    collections: List[int]
+    contacts: List[int]
+    sharedwithme: List[int]
+
+#Result of /sync. With full set the lists hold every row and replace what the client has, otherwise only the rows
+#created or changed since the token. Send token back on the next call
+class SyncResponse(BaseModel):
+    token: str
+    full: bool
+    snips: List[SnipsResponse]
+    collections: List[CollectionResponse]
+    contacts: List[ContactsResponse]
+    sharedwithme: List[SnipsResponse]
+    deleted: SyncDeleted
+
+class JobResponse(BaseModel):
+    jobid: int
+    kind: str
+    status: str
+    progress: int
+    attempts: int
+    error: str | None
+    createdon: datetime
+    lastmodified: datetime
+
+#Result of /events/ticket. Open the stream with /events?ticket=<ticket> within expires seconds
+class StreamTicketResponse(BaseModel):
+    ticket: str
+    expires: int
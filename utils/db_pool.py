@@ -0,0 +1,62 @@
+import time
+import uuid
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+#Connection pool with telemetry. Pool exhaustion used to show up only as requests timing out, so the pool counts
+#checkouts, time spent waiting for a connection and checkouts that gave up after DB_POOL_TIMEOUT. Live gauges
+#(checked out, overflow...) come from the pool itself, see getPoolStats
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {"checkouts": 0, "timeouts": 0, "waitseconds": 0.0, "maxwaitseconds": 0.0}
+
+    #Runs for every checkout that isn't a reentrant one. Wait time includes opening a new connection when the pool
+    #grows, since the request is held up either way
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.stats["waitseconds"] += waited
+            self.stats["maxwaitseconds"] = max(self.stats["maxwaitseconds"], waited)
+
+        self.stats["checkouts"] += 1
+        return connection
+
+#connect_args that turn off prepared statements, for PgBouncer in transaction pooling mode where consecutive
+#transactions of one session can land on different server connections
+def transactionPoolingConnectArgs(driverName: str) -> dict:
+    if (driverName == "asyncpg"):
+        return {
+            "statement_cache_size": 0, #asyncpg's own cache
+            "prepared_statement_cache_size": 0, #SQLAlchemy's cache on top of it
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__" #Statements asyncpg still prepares can't collide
+        }
+
+    if (driverName == "psycopg"):
+        return {"prepare_threshold": None}
+
+    return {}
+
+#Gauges and counters for engine's pool. Gauges are read from the pool when called. Pools that don't queue
+#(sqlite in memory) report only what they know
+def getPoolStats(engine) -> dict:
+    pool = engine.pool
+    stats = {"checkouts": 0, "timeouts": 0, "waitseconds": 0.0, "maxwaitseconds": 0.0, **getattr(pool, "stats", {})}
+
+    if (isinstance(pool, QueuePool)):
+        stats.update(
+            size=pool.size(),
+            checkedout=pool.checkedout(),
+            checkedin=pool.checkedin(),
+            overflow=max(pool.overflow(), 0) #Negative while the pool hasn't filled up yet
+        )
+
+    return stats
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+#Sends reads to read replicas and keeps writes on the primary. get_router handlers ask for a session through
+#sessionsFor(userid), everything else uses the primary. A user who wrote in the last stickySeconds reads from the
+#primary so they see their own change before it has replicated. So does every user whose read cache entries a write
+#dropped (utils/read_cache.py marks them), e.g. the contacts an edited snip is shared with, who refetch as soon as the
+#push event reaches them: served by a lagging replica, that refetch would put the old rows back in the cache. The
+#window is tracked per process, like the memory read cache, so with several workers a user's next read may reach one
+#that didn't see the write. Size the window to the replicas' worst lag: a replica further behind than that can still
+#refill the read cache with stale entries, which then live until READ_CACHE_TTL
+ROUND_ROBIN = "round_robin"
+LEAST_CONNECTIONS = "least_connections"
+
+def _checkedOut(engine: AsyncEngine) -> int:
+    return engine.pool.checkedout() if isinstance(engine.pool, QueuePool) else 0
+
+class ReplicaRouter:
+    def __init__(self, primary: async_sessionmaker, replicaEngines: list, selection: str = ROUND_ROBIN, stickySeconds: float = 5, maxTracked: int = 100000):
+        self.primary = primary
+        self.replicas = [(engine, async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)) for engine in replicaEngines]
+        self.selection = selection
+        self.stickySeconds = stickySeconds
+        self.maxTracked = maxTracked
+        self.recentWrites: OrderedDict = OrderedDict() #userid -> time.monotonic() their reads may go to replicas again
+        self.nextReplica = 0
+        self.stats = {"replica": 0, "primary": 0, "sticky": 0}
+
+    #Note that userid just wrote, or that a write changed what they read. Called from bumpDataVersion, which every write
+    #handler runs, and for everyone else whose read cache a write invalidates
+    def markWrite(self, userid: int):
+        if (len(self.replicas) == 0 or self.stickySeconds <= 0):
+            return
+
+        now = time.monotonic()
+        self.recentWrites[userid] = now + self.stickySeconds
+        self.recentWrites.move_to_end(userid)
+
+        #Entries are in expiry order, so expired ones are at the front
+        while (len(self.recentWrites) > 0 and (next(iter(self.recentWrites.values())) <= now or len(self.recentWrites) > self.maxTracked)):
+            self.recentWrites.popitem(last=False)
+
+    def recentlyWrote(self, userid: int) -> bool:
+        until = self.recentWrites.get(userid)
+
+        if (until is None):
+            return False
+
+        if (until <= time.monotonic()):
+            del self.recentWrites[userid]
+            return False
+
+        return True
+
+    #Least connections counts connections checked out of each replica's pool. Ties, and round robin, go to the
+    #replicas in turn
+    def _pickReplica(self) -> async_sessionmaker:
+        start = self.nextReplica
+        self.nextReplica = (self.nextReplica + 1) % len(self.replicas)
+        inTurn = self.replicas[start:] + self.replicas[:start]
+
+        if (self.selection == LEAST_CONNECTIONS):
+            return min(inTurn, key=lambda replica: _checkedOut(replica[0]))[1]
+
+        return inTurn[0][1]
+
+    #Session factory for a read by userid
+    def sessionsFor(self, userid: int | None) -> async_sessionmaker:
+        if (len(self.replicas) == 0):
+            self.stats["primary"] += 1
+            return self.primary
+
+        if (userid is not None and self.recentlyWrote(userid)):
+            self.stats["sticky"] += 1
+            return self.primary
+
+        self.stats["replica"] += 1
+        return self._pickReplica()
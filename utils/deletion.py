@@ -0,0 +1,132 @@
+from sqlmodel import delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import Collection, Contact, Job, ShareFeed, Shared, Snip, SnipRevision, Tombstone, User
+from config import JOB_CHUNK_SIZE
+from utils.etag import bumpDataVersion
+from utils.jobs import jobHandler
+from utils.notifications import publishChanges
+from utils.read_cache import ALL_RESOURCES, COLLECTIONS, CONTACTS, SNIPS, invalidateReadCache, invalidateSharedWithMe
+from utils.sync import SyncChanges
+
+#Account and collection deletion as background jobs (utils/jobs.py). Rows go in dependency order, shares and revisions
+#before their snips, shares before contacts, snips before their collections, so no step leans on ON DELETE CASCADE or
+#trips a foreign key. Each call to a handler deletes one chunk of JOB_CHUNK_SIZE rows from the first step with anything
+#left, so a step that finishes early or rows written while the job runs (another session still logged in) are picked
+#up again
+DELETE_ACCOUNT = "deleteAccount"
+DELETE_COLLECTION = "deleteCollection"
+OWNER_CHUNK_SIZE = 100 #Other users whose contact lists lose a deleted account per transaction. Each is a few statements
+
+#Delete a chunk of the snips matching condition with their shares, recording the shares in sync. Returns the snip ids.
+#Their revisions are cleared in chunks of their own beforehand, this only catches ones written since
+async def _deleteSnips(session: AsyncSession, sync: SyncChanges, condition) -> list:
+    snipIds = (await session.exec(select(Snip.snipid).where(condition).order_by(Snip.snipid).limit(JOB_CHUNK_SIZE))).all()
+
+    if (len(snipIds) > 0):
+        shares = (await session.exec(delete(Shared).where(Shared.snipid.in_(snipIds)).returning(Shared.snipid, Shared.contactid))).all()
+        await session.exec(delete(SnipRevision).where(SnipRevision.snipid.in_(snipIds)))
+        await session.exec(delete(Snip).where(Snip.snipid.in_(snipIds)))
+        sync.unshared.update((share.snipid, share.contactid) for share in shares)
+
+    return snipIds
+
+#Delete a chunk of model's rows matching condition, picked by column. Returns how many went
+async def _deleteRows(session: AsyncSession, model, column, condition) -> int:
+    ids = (await session.exec(select(column).where(condition).order_by(column).limit(JOB_CHUNK_SIZE))).all()
+
+    if (len(ids) > 0):
+        await session.exec(delete(model).where(condition & column.in_(ids)))
+
+    return len(ids)
+
+#Other users who have the account as a contact drop it, and the shares they made to it, as if they had deleted the
+#contact themselves
+async def _deleteFromContacts(session: AsyncSession, userid: int) -> tuple:
+    owners = (await session.exec(select(Contact.userid).where(Contact.contactid == userid).order_by(Contact.userid).limit(OWNER_CHUNK_SIZE))).all()
+    rows = 0
+
+    for owner in owners:
+        sync = SyncChanges(owner, await bumpDataVersion(session, owner))
+        snipIds = (await session.exec(delete(Shared).where((Shared.userid == owner) & (Shared.contactid == userid)).returning(Shared.snipid))).scalars().all()
+
+        if (len(snipIds) > 0):
+            await session.exec(update(Snip).where(Snip.snipid.in_(snipIds)).values(changeseq=sync.changeseq)) #Their shared flags changed
+
+        await session.exec(delete(Contact).where((Contact.userid == owner) & (Contact.contactid == userid)))
+        sync.delete(CONTACTS, [userid])
+        await sync.write(session)
+        rows += len(snipIds) + 1
+
+    async def afterCommit():
+        for owner in owners:
+            await invalidateReadCache(owner, CONTACTS, SNIPS)
+
+    return rows, afterCommit
+
+@jobHandler(DELETE_ACCOUNT)
+async def deleteAccountChunk(session: AsyncSession, job: Job) -> tuple:
+    userid = job.target
+    rows, afterCommit = await _deleteFromContacts(session, userid)
+
+    if (rows > 0):
+        return rows, False, afterCommit
+
+    rows = await _deleteRows(session, SnipRevision, SnipRevision.revisionid, SnipRevision.userid == userid)
+
+    if (rows > 0):
+        return rows, False, None
+
+    #The account's snips drop out of their recipients' shared with me lists. The account's own lists need no
+    #tombstones, they go with it
+    sync = SyncChanges(userid, 0)
+    snipIds = await _deleteSnips(session, sync, Snip.userid == userid)
+
+    if (len(snipIds) > 0):
+        await sync.write(session)
+
+        async def afterCommit():
+            await invalidateSharedWithMe({contactId for _, contactId in sync.unshared})
+            await publishChanges(sync, "")
+
+        return len(snipIds) + len(sync.unshared), False, afterCommit
+
+    for model, column in ((Collection, Collection.collectionid), (Contact, Contact.contactid), (Tombstone, Tombstone.tombstoneid)):
+        rows = await _deleteRows(session, model, column, model.userid == userid)
+
+        if (rows > 0):
+            return rows, False, None
+
+    await session.exec(delete(ShareFeed).where(ShareFeed.userid == userid))
+    rows = len((await session.exec(delete(User).where(User.userid == userid).returning(User.userid))).all())
+
+    async def afterCommit():
+        await invalidateReadCache(userid, *ALL_RESOURCES)
+
+    return rows, True, afterCommit
+
+#The collection's snips go first, a chunk per transaction, each a change /sync and push events report like any delete.
+#The collection itself goes last, once empty
+@jobHandler(DELETE_COLLECTION)
+async def deleteCollectionChunk(session: AsyncSession, job: Job) -> tuple:
+    userid, collectionId = job.userid, job.target
+    rows = await _deleteRows(session, SnipRevision, SnipRevision.revisionid, SnipRevision.snipid.in_(select(Snip.snipid).where((Snip.userid == userid) & (Snip.collectionid == collectionId))))
+
+    if (rows > 0):
+        return rows, False, None
+
+    sync = SyncChanges(userid, await bumpDataVersion(session, userid))
+    snipIds = await _deleteSnips(session, sync, (Snip.userid == userid) & (Snip.collectionid == collectionId))
+    sync.delete(SNIPS, snipIds)
+    finished = len(snipIds) == 0
+
+    if (finished):
+        sync.delete(COLLECTIONS, (await session.exec(delete(Collection).where((Collection.userid == userid) & (Collection.collectionid == collectionId)).returning(Collection.collectionid))).scalars().all())
+
+    await sync.write(session)
+
+    async def afterCommit():
+        await invalidateReadCache(userid, COLLECTIONS, SNIPS)
+        await invalidateSharedWithMe({contactId for _, contactId in sync.unshared})
+        await publishChanges(sync, "")
+
+    return len(snipIds) + len(sync.unshared) + (1 if finished else 0), finished, afterCommit
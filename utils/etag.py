@@ -0,0 +1,43 @@
+import hashlib
+from fastapi import Request, Response
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import User
+from config import readRouter
+
+#Read endpoints tag responses with an ETag built from the owner's users.dataversion, which every write handler bumps
+#in the same transaction as the write. A client sending the tag back in If-None-Match gets a 304 after one primary
+#key lookup, without the full query or serialising the response. The counter lives in the database so every worker
+#agrees on it
+
+#Bump the user's data version and return the new one. Call inside the write's transaction before writing anything,
+#the rows written are stamped with the version for /sync (see utils/sync.py). Also keeps the user's reads on the
+#primary for a while, see utils/db_routing.py
+async def bumpDataVersion(session: AsyncSession, userid: int) -> int:
+    dataversion = (await session.exec(update(User).where(User.userid == userid).values(dataversion=User.dataversion + 1).returning(User.dataversion))).scalar()
+    readRouter.markWrite(userid)
+    return dataversion or 0
+
+async def getDataVersion(session: AsyncSession, userid: int) -> int:
+    return (await session.exec(select(User.dataversion).where(User.userid == userid))).first() or 0
+
+#Strong ETag for a response identified by parts (endpoint, user, version, parameters...)
+def makeETag(*parts) -> str:
+    return '"' + hashlib.sha256("|".join(str(p) for p in parts).encode('utf-8')).hexdigest()[:32] + '"'
+
+def _etagMatches(ifNoneMatch: str | None, etag: str) -> bool:
+    if (not ifNoneMatch):
+        return False
+
+    #If-None-Match uses weak comparison, so W/"x" matches "x"
+    return any(tag.strip() == "*" or tag.strip().removeprefix("W/") == etag for tag in ifNoneMatch.split(","))
+
+#Set the ETag on response and return a 304 response to send instead if the client already has this version, else None
+def checkNotModified(request: Request, response: Response, etag: str) -> Response | None:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"} #Browsers may keep the response but must revalidate
+
+    if (_etagMatches(request.headers.get("if-none-match"), etag)):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import case
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import Job
+from config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_SECONDS, JOB_RETRY_SECONDS, sessions
+
+#Background jobs kept in the jobs table, so no broker is needed and a queued job survives restarts. A request queues a
+#job in its own transaction and answers 202 with the job's id. A worker, running in the app process (JOB_WORKER),
+#claims it with a lease and calls its kind's handler until it reports done. Each call works through one chunk in its
+#own short transaction, committed together with the job's progress, so handlers must pick up where the last committed
+#chunk left off. A failed chunk rolls back and the job is retried later from there. Several workers, in one process
+#or many, can share the table: claiming is a conditional update, and a job whose worker died is taken over once its
+#lease runs out
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+jobStats = {"claimed": 0, "chunks": 0, "done": 0, "retried": 0, "failed": 0}
+
+#kind -> async handler(session, job) returning (rows done, finished, afterCommit). afterCommit is None or an async
+#function run once the chunk has committed, for cache invalidation and push events
+JOB_HANDLERS = {}
+
+def jobHandler(kind: str):
+    def register(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+
+    return register
+
+#Queue a job in the caller's transaction, or return the one already waiting or running for the same work, so a
+#repeated request doesn't queue it twice. Call wakeJobs() after commit
+async def enqueueJob(session: AsyncSession, userid: int, kind: str, target: int) -> Job:
+    job = (await session.exec(select(Job).where((Job.kind == kind) & (Job.target == target) & Job.status.in_((QUEUED, RUNNING))))).first()
+
+    if (job is None):
+        job = Job(userid=userid, kind=kind, target=target)
+        session.add(job)
+        await session.flush()
+
+    return job
+
+async def getJob(session: AsyncSession, userid: int, jobId: int) -> Job | None:
+    return (await session.exec(select(Job).where((Job.jobid == jobId) & (Job.userid == userid)))).first()
+
+def _claimable(now: datetime):
+    return ((Job.status == QUEUED) & (Job.runafter <= now)) | ((Job.status == RUNNING) & (Job.leaseduntil < now))
+
+class JobWorker:
+    def __init__(self, sessionFactory=sessions):
+        self.sessions = sessionFactory
+        self.workerid = uuid.uuid4().hex
+        self.wake = asyncio.Event()
+        self.task = None
+
+    #Take the next job due, or None. A running job found here lost its worker, which counts as a failed attempt
+    async def claim(self) -> Job | None:
+        async with self.sessions() as session:
+            now = datetime.now(timezone.utc)
+            jobId = (await session.exec(select(Job.jobid).where(_claimable(now)).order_by(Job.runafter, Job.jobid).limit(1))).first()
+
+            if (jobId is None):
+                return None
+
+            job = (await session.exec(update(Job).where((Job.jobid == jobId) & _claimable(now)).values(
+                status=RUNNING,
+                workerid=self.workerid,
+                leaseduntil=now + timedelta(seconds=JOB_LEASE_SECONDS),
+                attempts=case((Job.status == RUNNING, Job.attempts + 1), else_=Job.attempts),
+                lastmodified=now
+            ).returning(Job))).scalars().first()
+            await session.commit()
+
+        if (job is None):
+            return None #Another worker claimed it first
+
+        jobStats["claimed"] += 1
+        return job
+
+    #Run job's chunks until it is done, fails, or another worker takes it over
+    async def run(self, job: Job):
+        handler = JOB_HANDLERS[job.kind]
+
+        while (True):
+            try:
+                async with self.sessions() as session:
+                    rows, finished, afterCommit = await handler(session, job)
+                    now = datetime.now(timezone.utc)
+                    owned = (await session.exec(update(Job).where((Job.jobid == job.jobid) & (Job.workerid == self.workerid) & (Job.status == RUNNING)).values(
+                        progress=Job.progress + rows,
+                        status=DONE if finished else RUNNING,
+                        workerid=None if finished else self.workerid,
+                        leaseduntil=None if finished else now + timedelta(seconds=JOB_LEASE_SECONDS),
+                        lastmodified=now
+                    ).returning(Job.progress))).first()
+
+                    if (owned is None):
+                        await session.rollback()
+                        logger.warning("Job %s was taken over by another worker", job.jobid)
+                        return
+
+                    await session.commit()
+            except asyncio.CancelledError:
+                raise #The lease runs out and another worker, or this one after a restart, carries on
+            except Exception as e:
+                logger.exception("Job %s (%s) failed", job.jobid, job.kind)
+                await self._retry(job, e)
+                return
+
+            job.progress = owned[0]
+            jobStats["chunks"] += 1
+
+            if (afterCommit is not None):
+                await afterCommit()
+
+            if (finished):
+                jobStats["done"] += 1
+                return
+
+    async def _retry(self, job: Job, error: Exception):
+        async with self.sessions() as session:
+            attempts = job.attempts + 1
+            failed = attempts >= JOB_MAX_ATTEMPTS
+            await session.exec(update(Job).where((Job.jobid == job.jobid) & (Job.workerid == self.workerid)).values(
+                status=FAILED if failed else QUEUED,
+                attempts=attempts,
+                error=str(error)[:1000],
+                workerid=None,
+                leaseduntil=None,
+                runafter=datetime.now(timezone.utc) + timedelta(seconds=JOB_RETRY_SECONDS * 2 ** (attempts - 1)),
+                lastmodified=datetime.now(timezone.utc)
+            ))
+            await session.commit()
+
+        jobStats["failed" if failed else "retried"] += 1
+
+    #Run every job that is due, then return. For scripts and checks
+    async def runPending(self) -> int:
+        ran = 0
+
+        while ((job := await self.claim()) is not None):
+            await self.run(job)
+            ran += 1
+
+        return ran
+
+    async def loop(self):
+        while (True):
+            self.wake.clear() #Before looking, so a job queued while this pass runs still wakes the next one
+
+            try:
+                await self.runPending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker couldn't reach the database")
+
+            try:
+                await asyncio.wait_for(self.wake.wait(), JOB_POLL_SECONDS)
+            except TimeoutError:
+                pass
+
+worker = None
+
+def startJobWorker() -> JobWorker:
+    global worker
+    worker = JobWorker()
+    worker.task = asyncio.create_task(worker.loop())
+    return worker
+
+async def stopJobWorker():
+    global worker
+
+    if (worker is not None and worker.task is not None):
+        worker.task.cancel()
+
+        try:
+            await worker.task
+        except asyncio.CancelledError:
+            pass
+
+    worker = None
+
+#Start on newly queued jobs now rather than at the next poll. Call after the queueing transaction commits
+def wakeJobs():
+    if (worker is not None):
+        worker.wake.set()
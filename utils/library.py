@@ -0,0 +1,264 @@
+import json
+from typing import AsyncIterator
+from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
+from sqlmodel import insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import Collection, Contact, Shared, Snip, User
+from models.http.request_models import *
+from models.http.response_models import ImportResult
+from config import EXPORT_BATCH_SIZE, IMPORT_CHUNK_SIZE, IMPORT_MAX_LINE, readRouter
+from utils.etag import bumpDataVersion
+from utils.read_cache import *
+from utils.snip_content import packSnipContent, unpackSnipContent
+from utils.sync import SyncChanges
+
+#Export and import of a whole library as NDJSON (see the Library*Record models). Export reads through server side
+#cursors and import writes in chunks, so neither holds the library in memory. Import only keeps the ids it has
+#written, to resolve later records and report the changes. benchmarks/library.py measures both
+
+EXPORT_FLUSH_BYTES = 64 * 1024 #Lines are sent in blocks of about this size rather than one write per line
+
+_libraryRecord = TypeAdapter(LibraryRecord)
+
+def _isoformat(value) -> str | None:
+    return value.isoformat() if value is not None else None
+
+#Every record of userid's library, in the order /import needs them: collections, contacts, snips, then shares
+async def _exportRecords(session: AsyncSession, userid: int) -> AsyncIterator[dict]:
+    yield {"type": "header", "version": LIBRARY_FORMAT_VERSION}
+
+    collections = await session.stream(select(Collection.collectionid, Collection.collectionname, Collection.createdon, Collection.lastmodified)
+                                       .where(Collection.userid == userid).order_by(Collection.collectionid)
+                                       .execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+    async for row in collections:
+        yield {"type": "collection", "collectionid": row.collectionid, "collectionname": row.collectionname, "createdon": _isoformat(row.createdon), "lastmodified": _isoformat(row.lastmodified)}
+
+    contacts = await session.stream(select(User.email, Contact.displayname).join(User, User.userid == Contact.contactid)
+                                    .where(Contact.userid == userid).order_by(Contact.contactid)
+                                    .execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+    async for row in contacts:
+        yield {"type": "contact", "email": row.email, "displayname": row.displayname}
+
+    snips = await session.stream(select(Snip.snipid, Snip.collectionid, Snip.snipname, Snip.sniplanguage, Snip.snipdescription, Snip.snipcontent, Snip.snipcontentz, Snip.createdon, Snip.lastmodified)
+                                 .where(Snip.userid == userid).order_by(Snip.snipid)
+                                 .execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+    async for row in snips:
+        yield {
+            "type": "snip",
+            "snipid": row.snipid,
+            "collectionid": row.collectionid,
+            "snipname": row.snipname,
+            "sniplanguage": row.sniplanguage,
+            "snipdescription": row.snipdescription,
+            "snipcontent": unpackSnipContent(row.snipcontent, row.snipcontentz),
+            "createdon": _isoformat(row.createdon),
+            "lastmodified": _isoformat(row.lastmodified)
+        }
+
+    shares = await session.stream(select(Shared.snipid, User.email).join(User, User.userid == Shared.contactid)
+                                  .where(Shared.userid == userid).order_by(Shared.snipid)
+                                  .execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+    async for row in shares:
+        yield {"type": "share", "snipid": row.snipid, "email": row.email}
+
+#NDJSON body for /export. Opens its own session, on a read replica like the other reads, since it runs while the
+#response streams, after the endpoint has returned. On postgres the reads share one REPEATABLE READ snapshot, so a
+#library edited mid export stays consistent
+async def streamLibrary(userid: int) -> AsyncIterator[bytes]:
+    async with readRouter.sessionsFor(userid)() as session:
+        if (session.bind.dialect.name == "postgresql"):
+            await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+        block = []
+        blockSize = 0
+
+        async for record in _exportRecords(session, userid):
+            line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n"
+            block.append(line)
+            blockSize += len(line)
+
+            if (blockSize >= EXPORT_FLUSH_BYTES):
+                yield b"".join(block)
+                block = []
+                blockSize = 0
+
+        if (len(block) > 0):
+            yield b"".join(block)
+
+#Lines of an NDJSON body as they arrive, with their line numbers. Blank lines are skipped. Only the bytes a chunk adds
+#are searched for newlines, so a long line arriving in many chunks costs time in proportion to its length
+async def readLines(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, bytes]]:
+    pending = bytearray()
+    lineNumber = 0
+
+    async for chunk in chunks:
+        searchFrom = len(pending) #Everything before this was searched with the earlier chunks
+        pending += chunk
+        lineStart = 0
+
+        while ((lineEnd := pending.find(b"\n", searchFrom)) != -1):
+            lineNumber += 1
+            line = bytes(pending[lineStart:lineEnd])
+            lineStart = searchFrom = lineEnd + 1
+
+            if (line.strip()):
+                yield (lineNumber, line)
+
+        del pending[:lineStart]
+
+        if (len(pending) > IMPORT_MAX_LINE):
+            raise HTTPException(413, f"Line {lineNumber + 1} is longer than {IMPORT_MAX_LINE} bytes")
+
+    if (pending.strip()):
+        yield (lineNumber + 1, bytes(pending))
+
+#Writes a library into userid's account. Records are buffered and written in bulk, one transaction per chunk of
+#IMPORT_CHUNK_SIZE records of the same type. Exported ids are mapped to the new ones as they are written so later
+#records can refer to earlier ones
+class LibraryImport:
+    def __init__(self, session: AsyncSession, userid: int):
+        self.session = session
+        self.userid = userid
+        self.result = ImportResult()
+        self.collectionIds = {} #Exported collectionid -> new collectionid
+        self.snipIds = {} #Exported snipid -> new snipid
+        self.contactIds = {} #Email -> userid of the user's contacts
+        self.pending = [] #(line number, record) waiting to be written, all of pendingType
+        self.pendingType = None
+        self.sync = None #SyncChanges of the chunk being written
+        self.committed = SyncChanges(userid, 0) #Snips and shares of the chunks committed so far, published when the import ends
+        self.committedThrough = 0 #Last line number whose records are committed
+        self.resources = set() #Read cache resources to drop once the import ends
+        self.sharedWithMe = set()
+
+    async def add(self, lineNumber: int, line: bytes):
+        try:
+            record = _libraryRecord.validate_json(line)
+        except ValidationError as e:
+            raise HTTPException(400, f"Line {lineNumber}: {e.errors()[0]['msg']}")
+
+        if (record.type == "header"):
+            if (record.version != LIBRARY_FORMAT_VERSION):
+                raise HTTPException(400, f"Line {lineNumber}: unsupported library format version {record.version}")
+
+            return
+
+        if (record.type != self.pendingType or len(self.pending) >= IMPORT_CHUNK_SIZE):
+            await self.flush()
+
+        self.pendingType = record.type
+        self.pending.append((lineNumber, record))
+
+    #Write and commit the buffered records
+    async def flush(self):
+        if (len(self.pending) == 0):
+            return
+
+        self.sync = SyncChanges(self.userid, await bumpDataVersion(self.session, self.userid))
+        await _IMPORT_WRITERS[self.pendingType](self, self.pending)
+        await self.sync.write(self.session)
+        await self.session.commit()
+        self.committed.edited.update(self.sync.edited)
+        self.committed.added.update(self.sync.added)
+        self.committedThrough = self.pending[-1][0]
+        self.pending = []
+
+    async def _writeCollections(self, records: list):
+        rows = [Collection(userid=self.userid, **record.model_dump(exclude={"type", "collectionid"}, exclude_none=True), changeseq=self.sync.changeseq).model_dump(exclude={"collectionid"}) for _, record in records]
+        newIds = (await self.session.exec(insert(Collection.__table__).returning(Collection.__table__.c.collectionid, sort_by_parameter_order=True), params=rows)).scalars().all()
+
+        for newId, (_, record) in zip(newIds, records):
+            self.collectionIds[record.collectionid] = newId
+
+        self.result.collections += len(records)
+        self.resources.add(COLLECTIONS)
+
+    async def _writeContacts(self, records: list):
+        emails = {record.email for _, record in records}
+        userIds = dict((await self.session.exec(select(User.email, User.userid).where(User.email.in_(emails)))).all())
+        existing = set((await self.session.exec(select(Contact.contactid).where((Contact.userid == self.userid) & (Contact.contactid.in_(list(userIds.values())))))).all())
+        rows = {}
+
+        for _, record in records:
+            contactId = userIds.get(record.email)
+
+            if (contactId is None or contactId == self.userid):
+                self.result.skipped += 1
+                continue
+
+            self.contactIds[record.email] = contactId
+
+            if (contactId not in existing):
+                rows[contactId] = {"userid": self.userid, "contactid": contactId, "displayname": record.displayname, "changeseq": self.sync.changeseq}
+
+        if (len(rows) > 0):
+            await self.session.exec(insert(Contact).values(list(rows.values())))
+
+        self.result.contacts += len(rows)
+        self.resources.add(CONTACTS)
+
+    async def _writeSnips(self, records: list):
+        rows = []
+
+        for lineNumber, record in records:
+            if (record.collectionid is not None and record.collectionid not in self.collectionIds):
+                raise HTTPException(400, f"Line {lineNumber}: collection {record.collectionid} is not in the file")
+
+            snip = Snip(
+                userid=self.userid,
+                **record.model_dump(exclude={"type", "snipid", "collectionid", "snipcontent"}, exclude_none=True),
+                collectionid=self.collectionIds.get(record.collectionid),
+                **packSnipContent(record.snipcontent),
+                changeseq=self.sync.changeseq
+            )
+            rows.append(snip.model_dump(exclude={"snipid"}))
+
+        newIds = (await self.session.exec(insert(Snip.__table__).returning(Snip.__table__.c.snipid, sort_by_parameter_order=True), params=rows)).scalars().all()
+
+        for newId, (_, record) in zip(newIds, records):
+            self.snipIds[record.snipid] = newId
+
+        self.sync.edited.update(newIds)
+
+        self.result.snips += len(records)
+        self.resources.add(SNIPS)
+
+    async def _writeShares(self, records: list):
+        rows = {}
+
+        for lineNumber, record in records:
+            if (record.snipid not in self.snipIds):
+                raise HTTPException(400, f"Line {lineNumber}: snip {record.snipid} is not in the file")
+
+            if (record.email not in self.contactIds):
+                self.result.skipped += 1
+                continue
+
+            rows[(self.snipIds[record.snipid], self.contactIds[record.email])] = {"snipid": self.snipIds[record.snipid], "userid": self.userid, "contactid": self.contactIds[record.email]}
+
+        if (len(rows) > 0):
+            await self.session.exec(insert(Shared).values(list(rows.values())))
+            #The snips went in with an earlier chunk. Stamp them again so /sync picks up that they are now shared
+            await self.session.exec(update(Snip).where(Snip.snipid.in_({snipId for snipId, _ in rows})).values(changeseq=self.sync.changeseq))
+            self.sync.added.update(rows)
+
+        self.result.shares += len(rows)
+        self.resources.add(SNIPS)
+        self.sharedWithMe.update(contactId for _, contactId in rows)
+
+    #Drop the read cache entries the import made stale. Call when it ends, whether or not it finished
+    async def invalidateCaches(self):
+        await invalidateReadCache(self.userid, *self.resources)
+        await invalidateSharedWithMe(self.sharedWithMe)
+
+_IMPORT_WRITERS = {
+    "collection": LibraryImport._writeCollections,
+    "contact": LibraryImport._writeContacts,
+    "snip": LibraryImport._writeSnips,
+    "share": LibraryImport._writeShares,
+}
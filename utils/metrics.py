@@ -0,0 +1,183 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+#Prometheus metrics kept in process and rendered in the text exposition format by /metrics. Requests are labelled by
+#route template (/getSnipDetails/{snipId}) rather than path so the number of series stays fixed. Everything here is
+#plain counting on the event loop, cheap enough to leave on in production (python -m benchmarks.metrics_overhead).
+#Each worker reports its own numbers, so run one worker per scrape target or tell them apart by instance
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BCRYPT_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+UNMATCHED_ROUTE = "unmatched" #Label for requests no route matched (404s, CORS preflights...)
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) #Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+#A metric family, one series per label values
+class Metric:
+    def __init__(self, name: str, kind: str, help: str, labels: tuple, buckets: tuple = None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def inc(self, *labelValues, amount: float = 1):
+        self.series[labelValues] = self.series.get(labelValues, 0) + amount
+
+    def observe(self, value: float, *labelValues):
+        histogram = self.series.get(labelValues)
+
+        if (histogram is None):
+            histogram = self.series[labelValues] = Histogram(self.buckets)
+
+        histogram.observe(value)
+
+httpRequests = Metric("snipsnap_http_requests_total", "counter", "HTTP requests by route and status", ("method", "route", "status"))
+httpLatency = Metric("snipsnap_http_request_duration_seconds", "histogram", "Time from request to the last byte of the response", ("method", "route"), LATENCY_BUCKETS)
+dbTime = Metric("snipsnap_db_time_seconds", "histogram", "Time a request spent in database statements", ("method", "route"), LATENCY_BUCKETS)
+dbStatements = Metric("snipsnap_db_statements", "histogram", "Database statements sent per request", ("method", "route"), STATEMENT_BUCKETS)
+bcryptTime = Metric("snipsnap_bcrypt_seconds", "histogram", "Time a request spent hashing or checking passwords, excluding the wait for a worker", ("method", "route"), BCRYPT_BUCKETS)
+
+METRICS = (httpRequests, httpLatency, dbTime, dbStatements, bcryptTime)
+
+#What the request being handled has spent so far. Set by MetricsMiddleware and filled in by the engine hooks and the
+#password pool. The context travels into SQLAlchemy's greenlets, so hooks see the request that ran the statement
+class RequestMetrics:
+    __slots__ = ("dbseconds", "statements", "bcryptseconds")
+
+    def __init__(self):
+        self.dbseconds = 0.0
+        self.statements = 0
+        self.bcryptseconds = 0.0
+
+currentRequestMetrics: ContextVar[RequestMetrics | None] = ContextVar("currentRequestMetrics", default=None)
+
+def addBcryptTime(seconds: float):
+    requestMetrics = currentRequestMetrics.get()
+
+    if (requestMetrics is not None):
+        requestMetrics.bcryptseconds += seconds
+
+def _beforeCursorExecute(conn, cursor, statement, parameters, context, executemany):
+    if (context is not None):
+        context._metricsStart = time.perf_counter()
+
+def _afterCursorExecute(conn, cursor, statement, parameters, context, executemany):
+    requestMetrics = currentRequestMetrics.get()
+
+    if (requestMetrics is not None and context is not None):
+        requestMetrics.dbseconds += time.perf_counter() - getattr(context, "_metricsStart", time.perf_counter())
+        requestMetrics.statements += 1
+
+#Attribute statements on engine to the request that sends them
+def instrumentEngine(engine: AsyncEngine):
+    if (not event.contains(engine.sync_engine, "before_cursor_execute", _beforeCursorExecute)):
+        event.listen(engine.sync_engine, "before_cursor_execute", _beforeCursorExecute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _afterCursorExecute)
+
+#Pure ASGI middleware (BaseHTTPMiddleware costs a task and a memory stream per request). The route label is read
+#after the app has run, once FastAPI has put the matched route in the scope
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http"):
+            return await self.app(scope, receive, send)
+
+        requestMetrics = RequestMetrics()
+        token = currentRequestMetrics.set(requestMetrics)
+        start = time.perf_counter()
+        status = 500 #Reported if the app fails before starting a response
+
+        async def sendWithStatus(message):
+            nonlocal status
+
+            if (message["type"] == "http.response.start"):
+                status = message["status"]
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, sendWithStatus)
+        finally:
+            currentRequestMetrics.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else UNMATCHED_ROUTE)
+            httpRequests.inc(*labels, str(status))
+            httpLatency.observe(time.perf_counter() - start, *labels)
+            dbTime.observe(requestMetrics.dbseconds, *labels)
+            dbStatements.observe(requestMetrics.statements, *labels)
+
+            if (requestMetrics.bcryptseconds > 0):
+                bcryptTime.observe(requestMetrics.bcryptseconds, *labels)
+
+def _escapeLabel(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labelSet(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escapeLabel(value)}"' for name, value in zip(names, values)]
+
+    if (extra):
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _formatValue(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def renderMetric(metric: Metric) -> list:
+    lines = [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+
+    for labelValues, value in sorted(metric.series.items()):
+        if (metric.kind != "histogram"):
+            lines.append(f"{metric.name}{_labelSet(metric.labels, labelValues)} {_formatValue(value)}")
+            continue
+
+        cumulative = 0
+
+        for bound, count in zip((*value.buckets, "+Inf"), value.counts):
+            cumulative += count
+            le = 'le="' + str(bound) + '"'
+            lines.append(f"{metric.name}_bucket{_labelSet(metric.labels, labelValues, le)} {cumulative}")
+
+        lines.append(f"{metric.name}_sum{_labelSet(metric.labels, labelValues)} {_formatValue(value.sum)}")
+        lines.append(f"{metric.name}_count{_labelSet(metric.labels, labelValues)} {value.count}")
+
+    return lines
+
+#Gauges and counters read from stats dicts when /metrics is scraped. kinds maps each key to "gauge" or "counter",
+#keys not in it are skipped. Counters get _total appended. series are (labels, stats) pairs, one per labelled source
+#(e.g. each database engine), so the family is declared once
+def renderStats(prefix: str, kinds: dict, *series: tuple) -> list:
+    lines = []
+
+    for key, kind in kinds.items():
+        name = f"{prefix}_{key}_total" if kind == "counter" else f"{prefix}_{key}"
+        values = [(labels, stats[key]) for labels, stats in series if key in stats]
+
+        if (len(values) == 0):
+            continue
+
+        lines.append(f"# TYPE {name} {kind}")
+
+        for labels, value in values:
+            lines.append(f"{name}{_labelSet(tuple(labels), tuple(labels.values()))} {_formatValue(value)}")
+
+    return lines
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator
+from config import NOTIFY_BACKEND, NOTIFY_HEARTBEAT, NOTIFY_MAX_EVENTS, NOTIFY_QUEUE_SIZE, NOTIFY_REDIS_URL
+from utils.read_cache import SNIPS
+
+#Push events for /events streams (Server-Sent Events). Write handlers publish after they commit: recipients hear about
+#snips shared with them, unshared and edited, the owner's other sessions hear about all of that plus their own edits
+#and deletes. Events only carry ids, clients fetch what changed with /sync, so an event can never show a snip to
+#someone who lost access to it since. Publishing goes through a backend: in process, or redis pub/sub so an event
+#reaches streams held by any worker
+
+RESYNC = {"type": "resync"} #Sent instead of events a stream can no longer be given one by one
+
+notifyStats = {"connections": 0, "published": 0, "delivered": 0, "overflows": 0}
+
+#One open stream. Events wait in a bounded queue until the stream sends them
+class Subscriber:
+    def __init__(self, userid: int, sessionid: str):
+        self.userid = userid
+        self.sessionid = sessionid
+        self.queue = asyncio.Queue(NOTIFY_QUEUE_SIZE)
+
+    def deliver(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+            notifyStats["delivered"] += 1
+        except asyncio.QueueFull:
+            #Too far behind to catch up event by event. Swap the backlog for one resync
+            while (not self.queue.empty()):
+                self.queue.get_nowait()
+
+            self.queue.put_nowait(RESYNC)
+            notifyStats["overflows"] += 1
+
+#Streams connected to this process, by user. Publishing delivers straight to them
+class MemoryPubSub:
+    def __init__(self):
+        self.subscribers = {} #userid -> set of Subscriber
+
+    def subscribe(self, userid: int, sessionid: str) -> Subscriber:
+        subscriber = Subscriber(userid, sessionid)
+        self.subscribers.setdefault(userid, set()).add(subscriber)
+        notifyStats["connections"] += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self.subscribers.get(subscriber.userid)
+
+        if (subscribers is not None and subscriber in subscribers):
+            subscribers.discard(subscriber)
+            notifyStats["connections"] -= 1
+
+            if (len(subscribers) == 0):
+                del self.subscribers[subscriber.userid]
+
+    #messages are [userid, event, origin] lists. A stream whose session is origin made the change and is skipped
+    async def publish(self, messages: list):
+        notifyStats["published"] += len(messages)
+        self.deliverLocal(messages)
+
+    def deliverLocal(self, messages: list):
+        for userid, event, origin in messages:
+            for subscriber in self.subscribers.get(userid, ()):
+                if (subscriber.sessionid != origin):
+                    subscriber.deliver(event)
+
+#Shared backend for multiple workers. Publishing goes to one redis channel and every worker with streams open listens
+#on it and delivers to its own. Takes any client with the redis.asyncio publish/pubsub API, so tests can pass a local
+#stand-in
+class RedisPubSub(MemoryPubSub):
+    CHANNEL = "snipsnap:events"
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.listener = None
+
+    def subscribe(self, userid: int, sessionid: str) -> Subscriber:
+        if (self.listener is None or self.listener.done()):
+            self.listener = asyncio.create_task(self._listen())
+
+        return super().subscribe(userid, sessionid)
+
+    async def publish(self, messages: list):
+        notifyStats["published"] += len(messages)
+        await self.client.publish(self.CHANNEL, json.dumps(messages))
+
+    async def _listen(self):
+        while (True):
+            pubsub = self.client.pubsub()
+
+            try:
+                await pubsub.subscribe(self.CHANNEL)
+
+                async for message in pubsub.listen():
+                    if (message["type"] == "message"):
+                        self.deliverLocal(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                #Events published while the connection was down are lost, so every stream here has to resync
+                for subscribers in list(self.subscribers.values()):
+                    for subscriber in subscribers:
+                        subscriber.deliver(RESYNC)
+            finally:
+                await self._close(pubsub)
+
+            await asyncio.sleep(1)
+
+    #Give the old pubsub's connection back before reconnecting, or every reconnect would leak one
+    async def _close(self, pubsub):
+        try:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+        except Exception:
+            pass #Already broken, which is usually why we're reconnecting
+
+def _createBackend():
+    if (NOTIFY_BACKEND == "redis"):
+        import redis.asyncio #Optional dependency, only needed for the shared backend
+        return RedisPubSub(redis.asyncio.from_url(NOTIFY_REDIS_URL))
+
+    if (NOTIFY_BACKEND == "memory"):
+        return MemoryPubSub()
+
+    return None
+
+notifier = _createBackend()
+
+#Swap the backend, e.g. for a stand-in in tests. None turns push events off
+def setNotifyBackend(backend):
+    global notifier
+    notifier = backend
+
+#Events for what a write did, from the SyncChanges it recorded (utils/sync.py), as publish() messages
+def changeEvents(sync, origin: str) -> list:
+    ownerid = sync.userid
+    deletedSnips = {objectId for kind, objectId in sync.deleted if kind == SNIPS}
+    events = {} #userid -> events
+
+    def add(userid: int, event: dict):
+        events.setdefault(userid, []).append(event)
+
+    for snipId, contactId in sorted(sync.added):
+        add(contactId, {"type": "shared", "snipid": snipId, "ownerid": ownerid})
+        add(ownerid, {"type": "shared", "snipid": snipId, "contactid": contactId})
+
+    for snipId, contactId in sorted(sync.shared):
+        add(contactId, {"type": "edited", "snipid": snipId, "ownerid": ownerid})
+
+    for snipId, contactId in sorted(sync.unshared):
+        add(contactId, {"type": "unshared", "snipid": snipId, "ownerid": ownerid})
+
+        if (snipId not in deletedSnips):
+            add(ownerid, {"type": "unshared", "snipid": snipId, "contactid": contactId})
+
+    for snipId in sorted(sync.edited):
+        add(ownerid, {"type": "edited", "snipid": snipId})
+
+    for snipId in sorted(deletedSnips):
+        add(ownerid, {"type": "deleted", "snipid": snipId})
+
+    #A big batch or import would flood streams with events the client is better off replacing with one /sync
+    return [
+        [userid, event, origin]
+        for userid, userEvents in events.items()
+        for event in (userEvents if len(userEvents) <= NOTIFY_MAX_EVENTS else [RESYNC])
+    ]
+
+#Publish the events for a committed write. Call after commit, next to the read cache invalidation
+async def publishChanges(sync, origin: str):
+    if (notifier is None):
+        return
+
+    messages = changeEvents(sync, origin)
+
+    if (len(messages) > 0):
+        await notifier.publish(messages)
+
+def _encodeEvent(event: dict) -> bytes:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode('utf-8')
+
+#Server-Sent Events body for one stream. Subscribes when the client starts reading and unsubscribes however the
+#stream ends. Keepalive comments go out while idle, and the stream ends (event: expired) when the login's JWT does,
+#so a stream never outlives the credentials it was opened with
+async def eventStream(userid: int, sessionid: str, expires: float) -> AsyncIterator[bytes]:
+    subscriber = notifier.subscribe(userid, sessionid)
+
+    try:
+        #No retry: field. A ticket opens one stream, so EventSource reconnecting by itself would only get a 401, the client
+        #reconnects with a new ticket instead (see endpoints/events_endpoints.py). The first line tells it we're subscribed
+        yield b": subscribed\n\n"
+
+        while (True):
+            remaining = expires - time.time()
+
+            if (remaining <= 0):
+                yield _encodeEvent({"type": "expired"})
+                return
+
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), min(NOTIFY_HEARTBEAT, remaining))
+            except TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+
+            yield _encodeEvent(event)
+    finally:
+        notifier.unsubscribe(subscriber)
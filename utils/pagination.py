@@ -0,0 +1,61 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlmodel import exists, select, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import Shared, Snip
+from models.http.request_models import SnipPageRequest
+from utils.serialization import dumpSnipList
+
+#Cursors are base64 encoded (lastmodified, snipid) pairs of the last snip on the previous page. Clients
+#treat them as opaque so the format can change without breaking anyone
+def encodeCursor(lastmodified: datetime, snipid: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([lastmodified.isoformat(), snipid]).encode('utf-8')).decode('utf-8')
+
+def decodeCursor(cursor: str) -> tuple:
+    try:
+        lastmodified, snipid = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        return (datetime.fromisoformat(lastmodified), int(snipid))
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+#Base select for snip lists. Only the columns SnipsResponse needs are read, so list views never pull snipcontent,
+#and snipshared is an EXISTS against the shared table rather than a load of every share row. The subquery has to be
+#correlated explicitly, otherwise SQL alchemy appends snips to its FROM clause and every snip comes back shared
+def selectSnipList():
+    return select(
+        Snip.snipid,
+        Snip.snipname,
+        Snip.sniplanguage,
+        Snip.snipdescription,
+        Snip.lastmodified,
+        exists().where(Shared.snipid == Snip.snipid).correlate(Snip).label("snipshared")
+    )
+
+#Apply the page filters and keyset condition to snipQuery, newest first. Keyset pagination on (lastmodified, snipid)
+#means every page is an index range scan no matter how deep the client pages. One extra row is fetched so we can
+#tell whether there is another page without a COUNT query
+def buildSnipPageQuery(snipQuery, page: SnipPageRequest):
+    if (page.sniplanguage is not None):
+        snipQuery = snipQuery.where(Snip.sniplanguage == page.sniplanguage)
+
+    if (page.nameprefix):
+        snipQuery = snipQuery.where(Snip.snipname.startswith(page.nameprefix, autoescape=True))
+
+    if (page.cursor):
+        snipQuery = snipQuery.where(tuple_(Snip.lastmodified, Snip.snipid) < tuple_(*decodeCursor(page.cursor)))
+
+    return snipQuery.order_by(Snip.lastmodified.desc(), Snip.snipid.desc()).limit(page.limit + 1)
+
+#Get one page of snips from snipQuery, a selectSnipList() with the endpoint's filters applied. Returns the page
+#as a JSON array of SnipsResponse and the next cursor, which is None on the last page
+async def getSnipPage(session: AsyncSession, snipQuery, page: SnipPageRequest) -> tuple[bytes, str | None]:
+    rows = (await session.exec(buildSnipPageQuery(snipQuery, page))).all()
+    nextCursor = None
+
+    if (len(rows) > page.limit):
+        rows = rows[:page.limit]
+        nextCursor = encodeCursor(rows[-1].lastmodified, rows[-1].snipid)
+
+    return (dumpSnipList(rows), nextCursor)
@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+#Counts the SQL statements an engine sends while the block runs. Used to hold each endpoint to a query budget
+#so N+1 lazy loads show up as a failed check rather than as slow pages in production
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+@contextmanager
+def countStatements(engine: AsyncEngine):
+    counter = StatementCounter()
+
+    def onExecute(conn, cursor, statement, parameters, context, executemany):
+        counter.count += 1
+        counter.statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", onExecute)
+
+    try:
+        yield counter
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", onExecute)
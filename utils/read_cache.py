@@ -0,0 +1,179 @@
+import json
+import time
+from collections import OrderedDict
+from config import READ_CACHE_BACKEND, READ_CACHE_REDIS_URL, READ_CACHE_SIZE, READ_CACHE_TTL, readRouter
+
+#Server side cache of read endpoint results. Entries are keyed by (user, resource) and hold one value per variant
+#(page parameters, collection...), so a write handler drops everything a user has cached for a resource with one
+#delete. Writes invalidate after they commit. Every invalidation also bumps a generation for the key, and a read only
+#stores what it loaded if the generation hasn't moved, so a read racing a write can't put stale data back
+SNIPS = "snips"
+SHARED_WITH_ME = "sharedwithme"
+COLLECTIONS = "collections"
+CONTACTS = "contacts"
+SETTINGS = "settings"
+ALL_RESOURCES = (SNIPS, SHARED_WITH_ME, COLLECTIONS, CONTACTS, SETTINGS)
+
+MAX_VARIANTS = 32 #Most variants (e.g. pages) kept per entry
+
+readCacheStats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+#In process LRU. Correct only while the app runs as a single worker. Generations come from one clock that ticks on
+#every invalidation: a read's generation is the clock when it started, and it may store unless its key was invalidated
+#since. The last invalidation of at most maxEntries keys is remembered. Older ones are folded into invalidatedBefore,
+#which then stands in for any key not remembered, so the map stays bounded and a forgotten key can only refuse a store
+class MemoryCacheBackend:
+    def __init__(self, maxEntries: int, ttl: int):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict() #key -> (expires, {variant: value})
+        self.clock = 0
+        self.invalidated: OrderedDict = OrderedDict() #key -> clock at its last invalidation, oldest first
+        self.invalidatedBefore = 0
+
+    async def getGeneration(self, key: str) -> int:
+        return self.clock
+
+    async def get(self, key: str, variant: str):
+        entry = self.entries.get(key)
+
+        if (entry is None):
+            return None
+
+        if (entry[0] <= time.monotonic()):
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return entry[1].get(variant)
+
+    async def set(self, key: str, variant: str, value, generation: int):
+        if (self.invalidated.get(key, self.invalidatedBefore) > generation):
+            return
+
+        entry = self.entries.get(key)
+
+        if (entry is None or entry[0] <= time.monotonic()):
+            entry = (time.monotonic() + self.ttl, {})
+            self.entries[key] = entry
+
+        entry[1][variant] = value
+        self.entries.move_to_end(key)
+
+        if (len(entry[1]) > MAX_VARIANTS):
+            del entry[1][next(iter(entry[1]))]
+
+        while (len(self.entries) > self.maxEntries):
+            self.entries.popitem(last=False)
+            readCacheStats["evictions"] += 1
+
+    async def delete(self, keys: list):
+        self.clock += 1
+
+        for key in keys:
+            self.entries.pop(key, None)
+            self.invalidated[key] = self.clock
+            self.invalidated.move_to_end(key)
+
+        while (len(self.invalidated) > self.maxEntries):
+            self.invalidatedBefore = self.invalidated.popitem(last=False)[1]
+
+#Shared backend for multiple workers. Takes any client with the redis.asyncio hash/counter API, so tests can pass a
+#local stand-in. Entries are redis hashes, generations are counters beside them
+class RedisCacheBackend:
+    def __init__(self, client, ttl: int):
+        self.client = client
+        self.ttl = ttl
+
+    async def getGeneration(self, key: str) -> int:
+        return int(await self.client.get(f"{key}:gen") or 0)
+
+    async def get(self, key: str, variant: str):
+        raw = await self.client.hget(key, variant)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, variant: str, value, generation: int):
+        #Small window between the check and the write. The TTL bounds anything that slips through
+        if (await self.getGeneration(key) != generation):
+            return
+
+        await self.client.hset(key, variant, json.dumps(value))
+        await self.client.expire(key, self.ttl)
+
+    async def delete(self, keys: list):
+        await self.client.delete(*keys)
+
+        for key in keys:
+            await self.client.incr(f"{key}:gen")
+
+def _createBackend():
+    if (READ_CACHE_BACKEND == "redis"):
+        import redis.asyncio #Optional dependency, only needed for the shared backend
+        return RedisCacheBackend(redis.asyncio.from_url(READ_CACHE_REDIS_URL), READ_CACHE_TTL)
+
+    if (READ_CACHE_BACKEND == "memory"):
+        return MemoryCacheBackend(READ_CACHE_SIZE, READ_CACHE_TTL)
+
+    return None
+
+readCache = _createBackend()
+
+#Swap the backend, e.g. for a stand-in in tests. None turns caching off
+def setReadCacheBackend(backend):
+    global readCache
+    readCache = backend
+
+def _cacheKey(userid: int, resource: str) -> str:
+    return f"snipsnap:{userid}:{resource}"
+
+#Return the cached value for (userid, resource, variant), or await loader() and cache what it returns.
+#Values must be JSON serialisable
+async def cachedRead(userid: int, resource: str, variant: str, loader):
+    if (readCache is None):
+        return await loader()
+
+    key = _cacheKey(userid, resource)
+    value = await readCache.get(key, variant)
+
+    if (value is not None):
+        readCacheStats["hits"] += 1
+        return value
+
+    readCacheStats["misses"] += 1
+    generation = await readCache.getGeneration(key)
+    value = await loader()
+    await readCache.set(key, variant, value, generation)
+    return value
+
+#Whoever has cache entries dropped by a write is about to read it, often at once because a push event told them to.
+#Their reads stay on the primary for the read-your-writes window too, so a lagging replica can't answer them with
+#rows from before the write and put those back in the cache (see utils/db_routing.py)
+
+#Drop cached resources for a user. Call after the write commits
+async def invalidateReadCache(userid: int, *resources: str):
+    if (len(resources) == 0):
+        return
+
+    readRouter.markWrite(userid)
+
+    if (readCache is None):
+        return
+
+    readCacheStats["invalidations"] += 1
+    await readCache.delete([_cacheKey(userid, r) for r in resources])
+
+#Drop the shared-with-me lists of everyone a snip is or was shared with
+async def invalidateSharedWithMe(contactIds):
+    contactIds = set(contactIds)
+
+    for contactId in contactIds:
+        readRouter.markWrite(contactId)
+
+    if (readCache is None):
+        return
+
+    keys = [_cacheKey(contactId, SHARED_WITH_ME) for contactId in contactIds]
+
+    if (len(keys) > 0):
+        readCacheStats["invalidations"] += 1
+        await readCache.delete(keys)
@@ -0,0 +1,190 @@
+import difflib
+import json
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy import func
+from sqlmodel import insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import Snip, SnipRevision
+from config import SNIP_COMPRESSION_LEVEL, SNIP_REVISION_MAX_CHAIN, SNIP_REVISIONS
+from utils.snip_content import unpackSnipContent
+
+#Revision history for snip bodies. Every edit that changes a body appends a revision holding either a delta from the
+#previous revision or a snapshot of the whole body. A delta stores only what changed, so history grows with the size
+#of the edits, not of the snip. A snapshot is taken once the deltas since the last one would add up to more than the
+#body itself, or after SNIP_REVISION_MAX_CHAIN of them, so rebuilding any revision reads one snapshot and a bounded
+#chain of deltas, together no bigger than about twice the body. History starts at a snip's first edit, which records
+#the body it replaces as revision 1. The snip row keeps the latest body and its revision number
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+SHORT_DIFF = 200 #Characters. Changed regions shorter than this are stored as one replacement rather than line diffed
+
+#A delta is a list of operations on the old body: a positive int copies that many characters, a negative one skips
+#them, a string is inserted
+def _commonPrefix(a: str, b: str) -> int:
+    low, high = 0, min(len(a), len(b))
+
+    #Binary search on slice comparisons, which run in C, rather than a character loop
+    while (low < high):
+        middle = (low + high + 1) // 2
+
+        if (a[:middle] == b[:middle]):
+            low = middle
+        else:
+            high = middle - 1
+
+    return low
+
+def _commonSuffix(a: str, b: str, limit: int) -> int:
+    low, high = 0, min(len(a), len(b), limit)
+
+    while (low < high):
+        middle = (low + high + 1) // 2
+
+        if (a[len(a) - middle:] == b[len(b) - middle:]):
+            low = middle
+        else:
+            high = middle - 1
+
+    return low
+
+def _append(ops: list, op):
+    #Merge with the previous operation of the same kind so deltas stay short
+    if (len(ops) > 0 and type(ops[-1]) is type(op) and (isinstance(op, str) or (ops[-1] > 0) == (op > 0))):
+        ops[-1] += op
+    elif (op != 0 and op != ""):
+        ops.append(op)
+
+def makeDelta(old: str, new: str) -> list:
+    prefix = _commonPrefix(old, new)
+    suffix = _commonSuffix(old[prefix:], new[prefix:], min(len(old), len(new)) - prefix)
+    oldMiddle, newMiddle = old[prefix:len(old) - suffix], new[prefix:len(new) - suffix]
+    ops = []
+    _append(ops, prefix)
+
+    if (len(oldMiddle) < SHORT_DIFF or len(newMiddle) < SHORT_DIFF):
+        _append(ops, -len(oldMiddle))
+        _append(ops, newMiddle)
+    else:
+        #Edits in several places: diff the lines between the first and last change
+        oldLines, newLines = oldMiddle.splitlines(keepends=True), newMiddle.splitlines(keepends=True)
+
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, oldLines, newLines, autojunk=False).get_opcodes():
+            if (tag == "equal"):
+                _append(ops, sum(len(line) for line in oldLines[i1:i2]))
+            else:
+                _append(ops, -sum(len(line) for line in oldLines[i1:i2]))
+                _append(ops, "".join(newLines[j1:j2]))
+
+    _append(ops, suffix)
+    return ops
+
+def applyDelta(old: str, ops: list) -> str:
+    parts = []
+    position = 0
+
+    for op in ops:
+        if (isinstance(op, str)):
+            parts.append(op)
+        elif (op > 0):
+            parts.append(old[position:position + op])
+            position += op
+        else:
+            position -= op
+
+    if (position != len(old)):
+        raise ValueError("Delta doesn't match the revision it was made from")
+
+    return "".join(parts)
+
+def _encodeDelta(ops: list) -> bytes:
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode('utf-8'), SNIP_COMPRESSION_LEVEL)
+
+def _decodeDelta(data: bytes) -> list:
+    return json.loads(zlib.decompress(data))
+
+def _snapshotRow(content: str) -> dict:
+    return {"kind": SNAPSHOT, "data": zlib.compress(content.encode('utf-8'), SNIP_COMPRESSION_LEVEL), "contentlength": len(content), "chainlength": 0, "chainbytes": 0}
+
+#Revision rows for edits (snipid, new body) in order, given each snip's current state, which is updated as it goes
+def _planRevisions(userid: int, current: dict, edits: list) -> list:
+    rows = []
+    now = datetime.now(timezone.utc)
+
+    for snipId, content in edits:
+        state = current.get(snipId)
+
+        if (state is None or content == state["content"]):
+            continue
+
+        if (state["revision"] == 0):
+            rows.append({"snipid": snipId, "userid": userid, "revision": 1, **_snapshotRow(state["content"]), "createdon": state["lastmodified"]})
+            state.update(revision=1, chainlength=0, chainbytes=0)
+
+        delta = _encodeDelta(makeDelta(state["content"], content))
+        chainLength, chainBytes = state["chainlength"], state["chainbytes"]
+
+        if (chainLength is None or chainLength + 1 > SNIP_REVISION_MAX_CHAIN or chainBytes + len(delta) > len(content.encode('utf-8'))):
+            row = _snapshotRow(content)
+        else:
+            row = {"kind": DELTA, "data": delta, "contentlength": len(content), "chainlength": chainLength + 1, "chainbytes": chainBytes + len(delta)}
+
+        state.update(content=content, revision=state["revision"] + 1, chainlength=row["chainlength"], chainbytes=row["chainbytes"])
+        rows.append({"snipid": snipId, "userid": userid, "revision": state["revision"], **row, "createdon": now})
+
+    return rows
+
+#Record the revisions for edits, a list of (snipid, new body) of the user's snips in the order they are applied, in
+#the caller's transaction before it writes the bodies. Returns {snipid: revision to store on the snip} for each of
+#the user's snips among them, so it doubles as the ownership check. Costs one select, and one insert if any body changed
+async def recordRevisions(session: AsyncSession, userid: int, edits: list) -> dict:
+    snipIds = {snipId for snipId, _ in edits}
+
+    if (not SNIP_REVISIONS):
+        return dict((await session.exec(select(Snip.snipid, Snip.revision).where((Snip.userid == userid) & Snip.snipid.in_(snipIds)))).all())
+
+    rows = await session.exec(
+        select(Snip.snipid, Snip.snipcontent, Snip.snipcontentz, Snip.revision, Snip.lastmodified, SnipRevision.chainlength, SnipRevision.chainbytes)
+        .outerjoin(SnipRevision, (SnipRevision.snipid == Snip.snipid) & (SnipRevision.revision == Snip.revision))
+        .where((Snip.userid == userid) & Snip.snipid.in_(snipIds))
+    )
+    current = {
+        row.snipid: {"content": unpackSnipContent(row.snipcontent, row.snipcontentz), "revision": row.revision, "lastmodified": row.lastmodified, "chainlength": row.chainlength, "chainbytes": row.chainbytes or 0}
+        for row in rows
+    }
+    revisionRows = _planRevisions(userid, current, edits)
+
+    if (len(revisionRows) > 0):
+        await session.exec(insert(SnipRevision).values(revisionRows))
+
+    return {snipId: state["revision"] for snipId, state in current.items()}
+
+#A page of the user's snip's revisions, newest first, starting below before
+async def listRevisions(session: AsyncSession, userid: int, snipId: int, before: int | None, limit: int) -> list:
+    query = select(SnipRevision.revision, SnipRevision.contentlength, SnipRevision.createdon).join(Snip, Snip.snipid == SnipRevision.snipid).where((Snip.userid == userid) & (SnipRevision.snipid == snipId))
+
+    if (before is not None):
+        query = query.where(SnipRevision.revision < before)
+
+    return [row._mapping for row in await session.exec(query.order_by(SnipRevision.revision.desc()).limit(limit))]
+
+#Rebuild the body of one of the user's snip's revisions, or None if there is no such revision. One statement reads
+#the nearest snapshot at or before it and the deltas after that
+async def getRevision(session: AsyncSession, userid: int, snipId: int, revision: int) -> dict | None:
+    snapshot = select(func.max(SnipRevision.revision)).where((SnipRevision.snipid == snipId) & (SnipRevision.kind == SNAPSHOT) & (SnipRevision.revision <= revision)).scalar_subquery()
+    rows = (await session.exec(
+        select(SnipRevision.revision, SnipRevision.kind, SnipRevision.data, SnipRevision.createdon)
+        .join(Snip, Snip.snipid == SnipRevision.snipid)
+        .where((Snip.userid == userid) & (SnipRevision.snipid == snipId) & (SnipRevision.revision >= snapshot) & (SnipRevision.revision <= revision))
+        .order_by(SnipRevision.revision)
+    )).all()
+
+    if (len(rows) == 0 or rows[-1].revision != revision):
+        return None
+
+    content = zlib.decompress(rows[0].data).decode('utf-8')
+
+    for row in rows[1:]:
+        content = applyDelta(content, _decodeDelta(row.data))
+
+    return {"revision": revision, "createdon": rows[-1].createdon, "snipcontent": content}
@@ -0,0 +1,101 @@
+import base64
+import json
+import re
+from fastapi import HTTPException
+from sqlalchemy import column, func, literal_column, or_, table, text, union
+from sqlmodel import select, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import Shared, Snip
+from models.http.request_models import SnipSearchRequest
+from utils.pagination import selectSnipList
+from utils.serialization import dumpSnipList
+
+#Ranked search over the snips a user owns or has been shared, backed by the index migrations/v0004_snip_search.py
+#maintains: tsvector + GIN (and pg_trgm on names when installed) on postgres, FTS5 on sqlite. Every search term is
+#matched as a word prefix and all terms must match
+
+MAX_SEARCH_TERMS = 16
+
+_trigramInstalled = None #Looked up once per process on postgres
+
+#Search terms are the runs of letters and digits in q. Anything else, including the search syntax of either
+#backend, is treated as a separator so user input never reaches the query parser unescaped
+def searchTerms(q: str) -> list:
+    return re.findall(r"[^\W_]+", q.lower())[:MAX_SEARCH_TERMS]
+
+#Search cursors are the (rank, snipid) of the last hit on the previous page, opaque to clients like the list cursors
+def encodeSearchCursor(rank: float, snipid: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, snipid]).encode('utf-8')).decode('utf-8')
+
+def decodeSearchCursor(cursor: str) -> tuple:
+    try:
+        rank, snipid = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+        return (float(rank), int(snipid))
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+async def _trigramAvailable(session: AsyncSession) -> bool:
+    global _trigramInstalled
+
+    if (_trigramInstalled is None):
+        _trigramInstalled = (await session.exec(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"))).first() is not None
+
+    return _trigramInstalled
+
+#selectSnipList() plus a rank column, restricted to snips matching terms. Higher rank is a better match
+def _selectMatches(dialectName: str, userid: int, terms: list, q: str, trigram: bool):
+    if (dialectName == "postgresql"):
+        vector = literal_column("snips.searchvector")
+        tsquery = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+        match = vector.op("@@")(tsquery)
+        rank = func.ts_rank_cd(vector, tsquery)
+
+        if (trigram):
+            match = or_(match, Snip.snipname.op("%")(q))
+            rank = rank + func.similarity(Snip.snipname, q)
+
+        return selectSnipList().add_columns(rank.label("rank")).where(match)
+
+    #bm25 scores lower for better matches. Name hits weigh most, then description, then content, like the postgres weights.
+    #The matches are ranked once, up front. Joined straight to snips, SQLite runs the whole full text query again for
+    #every snip of the user, which took minutes for a heavy user at 100k snips (benchmarks/search.py). The index holds
+    #every user's snips, so only the rows userid owns or has been shared are ranked, not everything the terms match.
+    #The unary + keeps the candidate list a filter: as a rowid constraint FTS5 would run the query once per candidate
+    fts = table("snips_fts", column("rowid"))
+    match = literal_column("snips_fts").op("MATCH")(" ".join(f'"{term}"*' for term in terms))
+    rank = -func.bm25(literal_column("snips_fts"), 10.0, 5.0, 1.0)
+    candidates = union(select(Snip.snipid).where(Snip.userid == userid), select(Shared.snipid).where(Shared.contactid == userid))
+    matches = select(fts.c.rowid.label("snipid"), rank.label("rank")).where(match, literal_column("+snips_fts.rowid").in_(candidates)).cte("matches").prefix_with("MATERIALIZED")
+
+    return selectSnipList().add_columns(matches.c.rank).join(matches, matches.c.snipid == Snip.snipid)
+
+#Query for one page of hits among the snips userid owns or has been shared. Owned and shared snips are matched
+#separately so each side can start from its own index (owner, or shared recipient) before they are merged and ranked
+def buildSearchQuery(dialectName: str, userid: int, search: SnipSearchRequest, trigram: bool = False):
+    matches = _selectMatches(dialectName, userid, searchTerms(search.q), search.q, trigram)
+    owned = matches.where(Snip.userid == userid)
+    shared = matches.join(Shared, Shared.snipid == Snip.snipid).where(Shared.contactid == userid)
+    hits = union(owned, shared).subquery()
+    query = select(*hits.c)
+
+    if (search.cursor):
+        query = query.where(tuple_(hits.c.rank, hits.c.snipid) < tuple_(*decodeSearchCursor(search.cursor)))
+
+    return query.order_by(hits.c.rank.desc(), hits.c.snipid.desc()).limit(search.limit + 1)
+
+#Get one page of search hits, best first. Returns the page as a JSON array of SnipsResponse and the next cursor,
+#which is None on the last page
+async def searchSnipPage(session: AsyncSession, userid: int, search: SnipSearchRequest) -> tuple[bytes, str | None]:
+    if (len(searchTerms(search.q)) == 0):
+        return (b"[]", None)
+
+    dialectName = session.bind.dialect.name
+    trigram = dialectName == "postgresql" and await _trigramAvailable(session)
+    rows = (await session.exec(buildSearchQuery(dialectName, userid, search, trigram))).all()
+    nextCursor = None
+
+    if (len(rows) > search.limit):
+        rows = rows[:search.limit]
+        nextCursor = encodeSearchCursor(rows[-1].rank, rows[-1].snipid)
+
+    return (dumpSnipList(rows), nextCursor)
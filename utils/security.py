@@ -1,18 +1,90 @@
+import asyncio
 import bcrypt
+import hashlib
 import jwt
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
-from config import JWT_SECRET
+from fastapi import Cookie, HTTPException, Request
+from sqlmodel import SQLModel
+from utils.metrics import addBcryptTime
+from config import BCRYPT_ROUNDS, JWT_SECRET, PASSWORD_MAX_QUEUE, PASSWORD_POOL, PASSWORD_POOL_WORKERS, STREAM_TICKET_TTL, TOKEN_CACHE_SIZE
+
+#bcrypt is deliberately slow (100+ ms of CPU), so it runs on a bounded pool instead of the event loop.
+#Workers cap concurrent hashes, and anything past PASSWORD_MAX_QUEUE waiting callers is shed with a 503
+passwordPoolStats = {"running": 0, "queued": 0, "completed": 0, "rejected": 0}
+_passwordExecutor: Executor | None = None
+_passwordSlots: asyncio.Semaphore | None = None
 
 #Create password hash for storing in the DB
 def hashPassword(password: str) -> bytes:
-    hashedPassword = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    hashedPassword = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS))
     return hashedPassword.decode('utf-8')
 
 #Check entered password matches the hashed password in the DB
 def checkPassword(password: str, hashedPassword: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashedPassword.encode('utf-8'))
 
+#Stored hashes look like $2b$<cost>$<salt+hash>. True if the cost differs from the configured one
+def needsRehash(hashedPassword: str) -> bool:
+    try:
+        return int(hashedPassword.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+def _getPasswordExecutor() -> Executor:
+    global _passwordExecutor, _passwordSlots
+
+    if _passwordExecutor is None:
+        poolType = ProcessPoolExecutor if PASSWORD_POOL == "process" else ThreadPoolExecutor
+        _passwordExecutor = poolType(max_workers=PASSWORD_POOL_WORKERS)
+        _passwordSlots = asyncio.Semaphore(PASSWORD_POOL_WORKERS)
+
+    return _passwordExecutor
+
+#Run a password function on the pool. Raises 503 when the queue is full rather than letting logins pile up
+async def _runPasswordTask(func, *args):
+    executor = _getPasswordExecutor()
+
+    if passwordPoolStats["queued"] >= PASSWORD_MAX_QUEUE:
+        passwordPoolStats["rejected"] += 1
+        raise HTTPException(503, "Server busy, please try again")
+
+    passwordPoolStats["queued"] += 1
+
+    try:
+        await _passwordSlots.acquire()
+    finally:
+        passwordPoolStats["queued"] -= 1
+
+    passwordPoolStats["running"] += 1
+    start = time.perf_counter()
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    finally:
+        addBcryptTime(time.perf_counter() - start)
+        passwordPoolStats["running"] -= 1
+        passwordPoolStats["completed"] += 1
+        _passwordSlots.release()
+
+#Non-blocking versions of hashPassword/checkPassword for use inside request handlers
+async def hashPasswordAsync(password: str) -> str:
+    return await _runPasswordTask(hashPassword, password)
+
+async def checkPasswordAsync(password: str, hashedPassword: str) -> bool:
+    return await _runPasswordTask(checkPassword, password, hashedPassword)
+
+def shutdownPasswordPool():
+    global _passwordExecutor, _passwordSlots
+
+    if _passwordExecutor is not None:
+        _passwordExecutor.shutdown(wait=False, cancel_futures=True)
+        _passwordExecutor = None
+        _passwordSlots = None
+
 #Issue new csrf and jwt tokens
 def issueTokens(userId: int, email: str, tokenExp: datetime) -> tuple:
     csrfToken = str(uuid.uuid4())
@@ -26,17 +98,129 @@ def issueTokens(userId: int, email: str, tokenExp: datetime) -> tuple:
 
     return (csrfToken, jwtToken)
 
-#Authenticate user with JWT and claims. Return user ID if authenticated, else -1
-def getAuthenticatedUser(csrfToken: str, jwtToken: str) -> bool:
+#LRU of tokens that already passed signature verification, keyed by sha256 of the token so entries are a fixed
+#size and the cap on entries is a cap on memory. Each entry is (exp, userId, email, csrf) and is dropped once exp passes.
+#Only verified tokens are stored, so garbage tokens can't push real ones out
+tokenCacheStats = {"hits": 0, "misses": 0, "evictions": 0}
+_tokenCache: OrderedDict = OrderedDict()
+
+#Return (exp, userId, email, csrf) for a token, verifying the signature only if we haven't seen the token before.
+#Raises like jwt.decode if the token is invalid or expired
+def _getVerifiedClaims(jwtToken: str) -> tuple:
+    key = hashlib.sha256(jwtToken.encode('utf-8')).digest()
+    cached = _tokenCache.get(key)
+
+    if (cached is not None):
+        if (cached[0] > time.time()):
+            _tokenCache.move_to_end(key)
+            tokenCacheStats["hits"] += 1
+            return cached
+
+        del _tokenCache[key]
+
+    tokenCacheStats["misses"] += 1
+    decodedJwt = jwt.decode(jwtToken, JWT_SECRET, "HS256")
+    claims = (decodedJwt["exp"], decodedJwt["userId"], decodedJwt["email"], decodedJwt["csrf"])
+
+    if (TOKEN_CACHE_SIZE > 0):
+        _tokenCache[key] = claims
+
+        if (len(_tokenCache) > TOKEN_CACHE_SIZE):
+            _tokenCache.popitem(last=False)
+            tokenCacheStats["evictions"] += 1
+
+    return claims
+
+#The authenticated caller, resolved once per request by getCurrentUser
+class UserContext(SQLModel):
+    userid: int
+    email: str
+    sessionid: str = "" #Identifies the login (a hash of its csrf token), so push events can skip the session that made a change
+    expires: int = 0 #When the JWT expires, as a unix time
+
+#Authenticate user with JWT and claims. Return the user if authenticated, else None
+def authenticate(csrfToken: str, jwtToken: str) -> UserContext | None:
     #jwt.decode automatically throws exception if token expired. Wrap this code in try catch
-    #so we can return -1 for easier handling rather than reading exception types
+    #so we can return None for easier handling rather than reading exception types
     try:
-        decodedJwt = jwt.decode(jwtToken, JWT_SECRET, "HS256")
-        jcsrf = decodedJwt["csrf"]
+        exp, userId, email, jcsrf = _getVerifiedClaims(jwtToken)
         
+        #csrf is compared on every request, cached or not
         if jcsrf == csrfToken:
-            return decodedJwt["userId"]
+            return UserContext(userid=userId, email=email, sessionid=hashlib.sha256(jcsrf.encode('utf-8')).hexdigest()[:16], expires=exp)
         
-        return -1
+        return None
+    except Exception as e:
+        return None
+
+#Authenticate user with JWT and claims. Return user ID if authenticated, else -1
+def getAuthenticatedUser(csrfToken: str, jwtToken: str) -> int:
+    user = authenticate(csrfToken, jwtToken)
+    return user.userid if user is not None else -1
+
+#Dependency for authenticated endpoints. Declare it before the session dependency so unauthenticated requests are
+#rejected with 401 before a connection is checked out of the pool
+async def getCurrentUser(request: Request, snipsnap_jwt: str = Cookie(None)) -> UserContext:
+    user = authenticate(request.headers.get("snipsnap_csrf"), snipsnap_jwt)
+
+    if (user is None):
+        raise HTTPException(401, "Unauthorized")
+
+    return user
+
+#EventSource can't send headers, so a browser opening a stream can't show its csrf token the usual way, and the token
+#doesn't belong in a URL where access logs and proxies keep it. Instead the page asks for a stream ticket (an
+#authenticated POST, csrf header and all) and opens the stream with ?ticket=. A ticket is a JWT of its own, good for
+#STREAM_TICKET_TTL seconds, for one stream, and only next to the login cookie it was issued for.
+#Redeemed tickets are remembered until they expire. The memory is per process, so with several workers the TTL is what
+#bounds a ticket replayed on another one
+_redeemedTickets: OrderedDict = OrderedDict() #ticket id -> exp, oldest first
+
+def issueStreamTicket(user: UserContext) -> str:
+    return jwt.encode({
+        "typ": "stream",
+        "jti": str(uuid.uuid4()),
+        "userId": user.userid,
+        "sessionid": user.sessionid,
+        "exp": int(time.time()) + STREAM_TICKET_TTL
+    }, JWT_SECRET, "HS256")
+
+#The user a stream ticket was issued to if it is valid, unused and issued for this login (jwtToken), else None.
+#Redeeming it uses it up
+def redeemStreamTicket(ticket: str, jwtToken: str) -> UserContext | None:
+    try:
+        claims = jwt.decode(ticket, JWT_SECRET, "HS256")
+        exp, userId, email, csrf = _getVerifiedClaims(jwtToken)
     except Exception as e:
-        return -1
\ No newline at end of file
+        return None
+
+    if (claims.get("typ") != "stream" or claims["jti"] in _redeemedTickets):
+        return None
+
+    user = UserContext(userid=userId, email=email, sessionid=hashlib.sha256(csrf.encode('utf-8')).hexdigest()[:16], expires=exp)
+
+    if (claims["userId"] != user.userid or claims["sessionid"] != user.sessionid):
+        return None
+
+    now = time.time()
+
+    while (len(_redeemedTickets) > 0 and next(iter(_redeemedTickets.values())) <= now):
+        _redeemedTickets.popitem(last=False)
+
+    _redeemedTickets[claims["jti"]] = claims["exp"]
+    return user
+
+#Dependency for event streams. Takes the csrf header like getCurrentUser, for clients that can send one, or a stream
+#ticket as the ticket query parameter
+async def getStreamUser(request: Request, snipsnap_jwt: str = Cookie(None)) -> UserContext:
+    ticket = request.query_params.get("ticket")
+
+    if (ticket is not None):
+        user = redeemStreamTicket(ticket, snipsnap_jwt)
+    else:
+        user = authenticate(request.headers.get("snipsnap_csrf"), snipsnap_jwt)
+
+    if (user is None):
+        raise HTTPException(401, "Unauthorized")
+
+    return user
@@ -0,0 +1,39 @@
+from typing import List
+from typing_extensions import TypedDict
+import pydantic_core
+from fastapi import Response
+from pydantic import TypeAdapter
+from models.http.response_models import SnipsResponse
+
+#Read endpoints return JSON they have already built instead of handing models back for FastAPI to validate and
+#serialise a second time through response_model. response_model stays on the routes for the OpenAPI schema only
+
+#JSON response for content that is already valid: bytes of JSON are sent as is, anything else (models, lists of
+#dicts...) is encoded by pydantic-core in one call, with no further validation
+class PreparedJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if (isinstance(content, bytes)):
+            return content
+
+        return pydantic_core.to_json(content)
+
+#Return content as a PreparedJSONResponse carrying the headers the handler set on its injected response (ETag,
+#X-Next-Cursor...). FastAPI drops those when a handler returns a response of its own
+def jsonResponse(response: Response, content) -> PreparedJSONResponse:
+    prepared = PreparedJSONResponse(content)
+    prepared.raw_headers.extend(response.raw_headers)
+    return prepared
+
+#Adapter for lists of rows with model's fields. Rows are validated as TypedDicts rather than model instances, so a
+#list of DB rows goes to JSON in one pydantic-core pass without building (or later revalidating) an object per row
+def rowListAdapter(model) -> TypeAdapter:
+    rowType = TypedDict(f"{model.__name__}Row", {name: field.annotation for name, field in model.model_fields.items()})
+    return TypeAdapter(List[rowType])
+
+_snipListAdapter = rowListAdapter(SnipsResponse)
+
+#JSON array of SnipsResponse for rows selected with the SnipsResponse columns (see pagination.selectSnipList)
+def dumpSnipList(rows) -> bytes:
+    return _snipListAdapter.dump_json(_snipListAdapter.validate_python([row._mapping for row in rows]))
@@ -0,0 +1,40 @@
+from sqlmodel import delete, insert, select, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import Shared
+
+#Bring snips' shares in line with the contacts they should be shared with by touching only the rows that differ.
+#Rewriting every share on each save churned the shared table and its indexes on the busiest write path. Anything that
+#sets who a snip is shared with (editSnip, /batch...) should go through here
+
+#Reconcile the shares of several snips owned by userid. wanted maps snipid -> contact ids. Runs inside the caller's
+#transaction and doesn't commit. Returns {snipid: (previous, added, removed)} sets of contact ids. Costs one SELECT,
+#plus one DELETE and one INSERT only when something changed
+async def reconcileSharesBulk(session: AsyncSession, userid: int, wanted: dict) -> dict:
+    previous = {snipid: set() for snipid in wanted}
+    rows = await session.exec(select(Shared.snipid, Shared.contactid).where((Shared.userid == userid) & (Shared.snipid.in_(list(wanted)))))
+
+    for snipid, contactid in rows:
+        previous[snipid].add(contactid)
+
+    changes = {}
+    toDelete = []
+    toInsert = []
+
+    for snipid, contactIds in wanted.items():
+        added = set(contactIds) - previous[snipid]
+        removed = previous[snipid] - set(contactIds)
+        changes[snipid] = (previous[snipid], added, removed)
+        toDelete.extend((snipid, contactid) for contactid in removed)
+        toInsert.extend({"snipid": snipid, "userid": userid, "contactid": contactid} for contactid in sorted(added))
+
+    if (len(toDelete) > 0):
+        await session.exec(delete(Shared).where((Shared.userid == userid) & (tuple_(Shared.snipid, Shared.contactid).in_(toDelete))))
+
+    if (len(toInsert) > 0):
+        await session.exec(insert(Shared).values(toInsert))
+
+    return changes
+
+#Reconcile the shares of one snip. Returns (previous, added, removed)
+async def reconcileShares(session: AsyncSession, userid: int, snipid: int, contactIds) -> tuple[set, set, set]:
+    return (await reconcileSharesBulk(session, userid, {snipid: contactIds}))[snipid]
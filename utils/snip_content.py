@@ -0,0 +1,81 @@
+import re
+import zlib
+from sqlalchemy import Connection, bindparam, func, select, update
+from models.db_models import Snip
+from config import SNIP_COMPRESSION, SNIP_COMPRESSION_LEVEL, SNIP_COMPRESSION_THRESHOLD
+
+#Optional compressed storage for large snip bodies. A compressed snip keeps its zlib compressed UTF-8 body in
+#snipcontentz and its search vocabulary in snipcontent, which is what the search index reads. List queries never read
+#either column, so only getSnipDetails pays to decompress
+
+#The distinct words of content in order of first use, lowercased and space separated. Words are runs of letters and
+#digits, the same as search terms (utils/search.py), and terms match as word prefixes, so a search finds a compressed
+#snip by its vocabulary whenever it would by its body. Ranking only loses how often and where each word appears
+def searchVocabulary(content: str) -> str:
+    return " ".join(dict.fromkeys(re.findall(r"[^\W_]+", content.lower())))
+
+#Column values to store for content, ready to splat into an insert or update
+def packSnipContent(content: str) -> dict:
+    raw = content.encode('utf-8')
+
+    if (SNIP_COMPRESSION and len(raw) >= SNIP_COMPRESSION_THRESHOLD):
+        packed = zlib.compress(raw, SNIP_COMPRESSION_LEVEL)
+        vocabulary = searchVocabulary(content)
+
+        #Already compressed data (minified bundles, base64...) can come out bigger, and so can text of mostly distinct
+        #words once its vocabulary is counted. Keep those as text
+        if (len(packed) + len(vocabulary.encode('utf-8')) < len(raw)):
+            return {"snipcontent": vocabulary, "snipcontentz": packed}
+
+    return {"snipcontent": content, "snipcontentz": None}
+
+def unpackSnipContent(snipcontent: str, snipcontentz: bytes | None) -> str:
+    return zlib.decompress(snipcontentz).decode('utf-8') if snipcontentz is not None else snipcontent
+
+#Rewrite stored snips to match the current SNIP_COMPRESSION setting: compress large plain bodies when it is on,
+#decompress everything when it is off. Snips compressed before they kept a search vocabulary get one. Walks the table
+#in snipid order, batchSize rows at a time, committing after each batch when commit is set. Returns the number of
+#snips rewritten
+def repackSnips(connection: Connection, batchSize: int = 500, commit: bool = False) -> int:
+    snips = Snip.__table__
+    candidates = select(snips.c.snipid, snips.c.snipcontent, snips.c.snipcontentz)
+
+    if (SNIP_COMPRESSION):
+        #A character is at most 4 UTF-8 bytes, so this can't miss a body over the threshold. packSnipContent decides
+        candidates = candidates.where(
+            (snips.c.snipcontentz.is_(None) & (func.length(snips.c.snipcontent) >= SNIP_COMPRESSION_THRESHOLD // 4)) |
+            (snips.c.snipcontentz.is_not(None) & (snips.c.snipcontent == ""))
+        )
+    else:
+        candidates = candidates.where(snips.c.snipcontentz.is_not(None))
+
+    repack = update(snips).where(snips.c.snipid == bindparam("b_snipid")).values(
+        snipcontent=bindparam("snipcontent"),
+        snipcontentz=bindparam("snipcontentz")
+    )
+    lastSnipId = 0
+    repacked = 0
+
+    while (True):
+        rows = connection.execute(candidates.where(snips.c.snipid > lastSnipId).order_by(snips.c.snipid).limit(batchSize)).all()
+
+        if (len(rows) == 0):
+            break
+
+        lastSnipId = rows[-1].snipid
+        params = []
+
+        for row in rows:
+            packed = packSnipContent(unpackSnipContent(row.snipcontent, row.snipcontentz))
+
+            if (packed["snipcontentz"] != row.snipcontentz or packed["snipcontent"] != row.snipcontent):
+                params.append({"b_snipid": row.snipid, **packed})
+
+        if (len(params) > 0):
+            connection.execute(repack, params)
+            repacked += len(params)
+
+        if (commit):
+            connection.commit()
+
+    return repacked
@@ -0,0 +1,141 @@
+import base64
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlmodel import delete, insert, select, tuple_, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.db_models import Collection, Contact, ShareFeed, Shared, Snip, Tombstone, User
+from models.http.response_models import CollectionResponse, ContactsResponse, SnipsResponse
+from config import SYNC_TOMBSTONE_DAYS
+from utils.pagination import selectSnipList
+from utils.read_cache import COLLECTIONS, CONTACTS, SHARED_WITH_ME, SNIPS
+from utils.serialization import rowListAdapter
+
+#Delta sync. Write handlers take the user's next users.dataversion from bumpDataVersion before writing anything and
+#stamp the rows they write with it (changeseq). Deletes leave a tombstone carrying it instead. The bump locks the
+#user's row until commit, so one user's writes commit in sequence order and a token can't get ahead of a write still
+#in flight. Snips shared with a user change through their owners' writes, so they follow a second sequence, the
+#recipient's sharefeeds row. A sync token holds both positions and when it was issued
+
+SYNC_KINDS = (SNIPS, COLLECTIONS, CONTACTS, SHARED_WITH_ME)
+_ID_FIELDS = {SNIPS: "snipid", COLLECTIONS: "collectionid", CONTACTS: "contactid", SHARED_WITH_ME: "snipid"} #What a tombstone's objectid is for each kind
+
+_snipRows = rowListAdapter(SnipsResponse)
+_collectionRows = rowListAdapter(CollectionResponse)
+_contactRows = rowListAdapter(ContactsResponse)
+
+#Tokens are base64 encoded [dataversion, share feed version, issued at] triples. Clients treat them as opaque
+def encodeSyncToken(dataversion: int, shareversion: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([dataversion, shareversion, int(time.time())]).encode('utf-8')).decode('utf-8')
+
+def decodeSyncToken(token: str) -> tuple:
+    try:
+        dataversion, shareversion, issued = json.loads(base64.urlsafe_b64decode(token.encode('utf-8')))
+        return (int(dataversion), int(shareversion), int(issued))
+    except Exception:
+        raise HTTPException(400, "Invalid sync token")
+
+#Bump the share feeds of contactIds and return {contactid: new version}. Rows are locked in id order, so sharers
+#writing at the same time can't deadlock
+async def bumpShareFeeds(session: AsyncSession, contactIds) -> dict:
+    upsert = (postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert)(ShareFeed)
+    upsert = upsert.values([{"userid": contactId, "version": 1} for contactId in sorted(contactIds)])
+    upsert = upsert.on_conflict_do_update(index_elements=[ShareFeed.userid], set_={"version": ShareFeed.version + 1})
+    return dict((await session.exec(upsert.returning(ShareFeed.userid, ShareFeed.version))).all())
+
+#What one write transaction changed that the stamped rows don't show by themselves: deleted rows, and shares whose
+#recipients should see their snip again or drop it. write() records it, inside the transaction, before commit. The
+#same record drives the push events sent after commit, see utils/notifications.py
+class SyncChanges:
+    def __init__(self, userid: int, changeseq: int):
+        self.userid = userid
+        self.changeseq = changeseq #The user's dataversion after this write's bump
+        self.deleted = [] #(kind, objectid) of the user's own rows
+        self.edited = set() #snipid of the user's snips created or edited
+        self.added = set() #(snipid, contactid) of shares added
+        self.shared = set() #(snipid, contactid) of shares kept on a snip that was edited
+        self.unshared = set() #(snipid, contactid) of shares removed, including those of deleted snips
+
+    def delete(self, kind: str, objectIds):
+        self.deleted.extend((kind, objectId) for objectId in objectIds)
+
+    #Costs nothing beyond the stamped rows unless shares were touched, then one statement to bump the recipients' share
+    #feeds, one to stamp the shares and one to write the tombstones
+    async def write(self, session: AsyncSession):
+        tombstones = [{"userid": self.userid, "kind": kind, "objectid": objectId, "changeseq": self.changeseq} for kind, objectId in self.deleted]
+        stamped = self.added | self.shared
+        recipients = {contactId for _, contactId in stamped | self.unshared}
+
+        if (len(recipients) > 0):
+            versions = await bumpShareFeeds(session, recipients)
+
+            if (len(stamped) > 0):
+                await session.exec(update(Shared).where(tuple_(Shared.snipid, Shared.contactid).in_(list(stamped))).values(changeseq=case(versions, value=Shared.contactid)))
+
+            tombstones.extend({"userid": contactId, "kind": SHARED_WITH_ME, "objectid": snipId, "changeseq": versions[contactId]} for snipId, contactId in self.unshared)
+
+        if (len(tombstones) > 0):
+            deletedOn = datetime.now(timezone.utc)
+            await session.exec(insert(Tombstone).values([{**tombstone, "deletedon": deletedOn} for tombstone in tombstones]))
+
+def _emptyChanges(token: str, full: bool) -> dict:
+    return {"token": token, "full": full, **{kind: [] for kind in SYNC_KINDS}, "deleted": {kind: [] for kind in SYNC_KINDS}}
+
+#Everything in userid's lists that changed since token, as a SyncResponse. No token, or one older than the tombstones
+#kept, gets every row with full set, and the client replaces what it has. Costs one primary key lookup when nothing
+#changed
+async def getChangesSince(session: AsyncSession, userid: int, token: str | None) -> dict:
+    current = (await session.exec(select(User.dataversion, ShareFeed.version).outerjoin(ShareFeed, ShareFeed.userid == User.userid).where(User.userid == userid))).first()
+
+    if (current is None):
+        raise HTTPException(404, "User not found")
+
+    dataversion, shareversion = current[0], current[1] or 0
+    since = decodeSyncToken(token) if token else None
+    full = since is None or since[2] < time.time() - SYNC_TOMBSTONE_DAYS * 86400
+
+    if (full):
+        sinceData, sinceShare = -1, -1
+    else:
+        #A lagging replica can be behind the token, never hand the client back an older position
+        sinceData, sinceShare = since[0], since[1]
+        dataversion, shareversion = max(dataversion, sinceData), max(shareversion, sinceShare)
+
+    changes = _emptyChanges(encodeSyncToken(dataversion, shareversion), full)
+
+    if (not full and sinceData >= dataversion and sinceShare >= shareversion):
+        return changes
+
+    if (full or dataversion > sinceData):
+        changes[SNIPS] = _snipRows.validate_python([row._mapping for row in await session.exec(selectSnipList().where((Snip.userid == userid) & (Snip.changeseq > sinceData)))])
+        changes[COLLECTIONS] = _collectionRows.validate_python([row._mapping for row in await session.exec(select(Collection.collectionname, Collection.collectionid).where((Collection.userid == userid) & (Collection.changeseq > sinceData)))])
+        changes[CONTACTS] = _contactRows.validate_python([row._mapping for row in await session.exec(select(Contact.userid, Contact.contactid, Contact.displayname).where((Contact.userid == userid) & (Contact.changeseq > sinceData)))])
+
+    if (full or shareversion > sinceShare):
+        changes[SHARED_WITH_ME] = _snipRows.validate_python([row._mapping for row in await session.exec(selectSnipList().join(Shared, Shared.snipid == Snip.snipid).where((Shared.contactid == userid) & (Shared.changeseq > sinceShare)))])
+
+    if (full):
+        return changes
+
+    tombstones = await session.exec(select(Tombstone.kind, Tombstone.objectid).where((Tombstone.userid == userid) & (
+        ((Tombstone.kind == SHARED_WITH_ME) & (Tombstone.changeseq > sinceShare)) | ((Tombstone.kind != SHARED_WITH_ME) & (Tombstone.changeseq > sinceData))
+    )))
+    #Something deleted and then created again with the same id (a contact, a share) is live, its row wins
+    live = {kind: {row[_ID_FIELDS[kind]] for row in changes[kind]} for kind in SYNC_KINDS}
+    deleted = {kind: set() for kind in SYNC_KINDS}
+
+    for kind, objectId in tombstones:
+        if (objectId not in live[kind]):
+            deleted[kind].add(objectId)
+
+    changes["deleted"] = {kind: sorted(objectIds) for kind, objectIds in deleted.items()}
+    return changes
+
+#Delete tombstones older than SYNC_TOMBSTONE_DAYS. Returns how many went
+async def pruneTombstones(connection: AsyncConnection) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=SYNC_TOMBSTONE_DAYS)
+    return (await connection.execute(delete(Tombstone).where(Tombstone.deletedon < cutoff))).rowcount